@@ -8,9 +8,9 @@ import getpass
 import sys
 import logging
 # import urllib2
-import requests
-from requests.auth import HTTPBasicAuth
-import rmxml
+# requests and rmxml are only needed by the API helpers, and importing
+# requests costs every s3upload run ~100ms, so they are imported where
+# they are used
 
 
 def geturl(input_url, content='text'):
@@ -21,6 +21,8 @@ def geturl(input_url, content='text'):
     and you can use the whole response object for looking at
     headers, status_code, cookies, history, etc.
     """
+    import requests
+
     try:
         # response = urllib2.urlopen(input_url)
         response = requests.get(input_url)
@@ -35,6 +37,27 @@ def geturl(input_url, content='text'):
     return response
 
 
+def read_fields(path, fields):
+    """
+    Reads a file of "field: value" lines and returns {field: value} for
+    the lines naming one of fields.  Only the first ':' separates the
+    field from its value, so values keep their colons and inner spaces
+    (C:\\backups, /srv/my files); blank lines, lines starting with '#'
+    and unknown fields are skipped.
+    """
+    values = {}
+
+    with open(path, "r") as source:
+        for line in source:
+            if line.startswith("#"):
+                continue
+            key, colon, value = line.partition(":")
+            if colon and key.strip() in fields:
+                values[key.strip()] = value.strip()
+
+    return values
+
+
 class Config(object):
     """creates a configuration object"""
 
@@ -44,8 +67,13 @@ class Config(object):
         self.logfile = None
         self.loglevel = None
         self.interval = None
+        self.reconcile_interval = None
         self.job = None
         self.keyfile = None
+        self.statsd_host = None
+        self.statsd_port = None
+        self.dogstatsd = None
+        self.prometheus_file = None
 
         mykwargs = kwargs
         if config is not None:
@@ -56,31 +84,10 @@ class Config(object):
             self.input()
 
     def read(self):
-        "Reads the credential file and builds auth object"
-        def _strip(content, field):
-            extract = [field, ":", " ", "\n", "\t"]
-            for item in extract:
-                if item in content:
-                    newline = content.replace(item, "")
-                    content = newline
-                else:
-                    pass
-            return content
-
-        with open(self.config, "r") as auth:
-            valid_options = self.__dict__
-            while True:
-                newline = auth.readline()
-                if not newline:
-                    break
-                elif newline.startswith("#"):
-                    pass
-                else:
-                    for key in valid_options:
-                        if key in newline:
-                            setattr(self, key, _strip(newline, key))
-                        else:
-                            pass
+        "Reads the configuration file"
+        fields = [key for key in self.__dict__ if key != 'config']
+        for key, value in read_fields(self.config, fields).items():
+            setattr(self, key, value)
         return
 
     def input(self):
@@ -106,10 +113,15 @@ class Config(object):
                 self.loglevel = data[value]
             elif value == 'interval':
                 self.interval = int(data[value])
+            elif value == 'reconcile_interval':
+                self.reconcile_interval = int(data[value])
             elif value == 'job':
                 self.job = data[value]
             elif value == 'keyfile':
                 self.keyfile = data[value]
+            elif value in ('statsd_host', 'statsd_port', 'dogstatsd',
+                           'prometheus_file'):
+                setattr(self, value, data[value])
         return
 
 
@@ -149,30 +161,9 @@ class KeySecret(object):
 
     def read(self):
         "Reads the credential file and builds auth object"
-        def _strip(content, field):
-            extract = [field, ":", " ", "\n", "\t"]
-            for item in extract:
-                if item in content:
-                    newline = content.replace(item, "")
-                    content = newline
-                else:
-                    pass
-            return content
-
-        with open(self.cfile, "r") as auth:
-            valid_options = self.__dict__
-            while True:
-                newline = auth.readline()
-                if not newline:
-                    break
-                elif newline.startswith("#"):
-                    pass
-                else:
-                    for key in valid_options:
-                        if key in newline:
-                            setattr(self, key, _strip(newline, key))
-                        else:
-                            pass
+        fields = [key for key in self.__dict__ if key != 'cfile']
+        for key, value in read_fields(self.cfile, fields).items():
+            setattr(self, key, value)
         return
 
     def input(self):
@@ -265,6 +256,8 @@ class API(object):
 
     def get(self, **kwargs):
         """ performs the get request """
+        import rmxml
+
         def _page_cursor(opener, url, headers, data):
             requestedsize = int(headers["<requestedSize>"])
             resultsize = int(headers["<resultSize>"])
@@ -369,6 +362,9 @@ class API(object):
         #                           headers=headers)
         # response = opener.open(request)
         # return_response = response.read()
+        import requests
+        from requests.auth import HTTPBasicAuth
+
         headers = {'Content-Type': 'application/xml'}
         response = requests.post(self.url, auth=HTTPBasicAuth(self.username,
                                                               self.password),
@@ -395,30 +391,9 @@ class AuthObject(object):
 
     def read(self):
         "Reads the credential file and builds auth object"
-        def _strip(content, field):
-            valid_options = [field, ":", " ", "\n", "\t"]
-            for item in valid_options:
-                if item in content:
-                    newline = content.replace(item, "")
-                    content = newline
-                else:
-                    pass
-            return content
-
-        with open(self.file, "r") as auth:
-            valid_options = self.__dict__
-            while True:
-                newline = auth.readline()
-                if not newline:
-                    break
-                elif newline.startswith("#"):
-                    pass
-                else:
-                    for key in valid_options:
-                        if key in newline:
-                            setattr(self, key, str(_strip(newline, key)))
-                        else:
-                            pass
+        fields = [key for key in self.__dict__ if key != 'file']
+        for key, value in read_fields(self.file, fields).items():
+            setattr(self, key, value)
         return
 
     def input(self):
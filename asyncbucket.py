@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+asyncbucket.py - an asyncio front end to S3Bucket.
+
+AsyncS3Bucket exposes awaitable versions of the bucket operations for
+code running on an event loop.  boto3 has no native asyncio support, so
+the blocking calls run on one thread pool owned by the bucket rather
+than a thread per call: any number of coroutines can await operations,
+while a semaphore bounds how many are running at once - one for single
+requests, which are cheap, and a smaller one for whole-file transfers,
+which each fan out into their own part threads.
+
+Cancelling a task that is still waiting for a slot never starts its
+request.  A request that is already running can't be interrupted in
+boto3; it finishes in the background and its result is dropped.  An
+interrupted 'resumable' upload or large download leaves its journal
+behind and carries on from the finished parts next time.
+
+usage:
+
+    async with AsyncS3Bucket(auth=auth, bucket_name='mybucket') as bucket:
+        await bucket.init()
+        await asyncio.gather(*(bucket.put(key, data) for key, data in items))
+        await bucket.download('db.bak', '/restore/db.bak')
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import s3upload
+from s3upload import DEFAULT_WORKERS, S3Bucket, TransferResult
+
+
+# single requests running at once
+DEFAULT_CONCURRENCY = 64
+
+
+class AsyncS3Bucket(object):
+    """
+    Awaitable S3Bucket operations with bounded concurrency.
+
+    usage:
+
+        bucket = AsyncS3Bucket(auth=auth, bucket_name='mybucket')
+        await bucket.upload('/backups/db.bak', 'db.bak')
+        await bucket.close()
+
+    Pass an existing S3Bucket as bucket, or the S3Bucket arguments as
+    keywords.  concurrency bounds single requests (put, get, delete,
+    listing) and transfers bounds whole-file uploads and downloads.
+    """
+    def __init__(self, bucket=None, concurrency=DEFAULT_CONCURRENCY,
+                 transfers=DEFAULT_WORKERS, **kwargs):
+
+        if bucket is None:
+            kwargs.setdefault('max_pool_connections', max(
+                concurrency, s3upload.DEFAULT_POOL_CONNECTIONS))
+            bucket = S3Bucket(**kwargs)
+
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.transfers = transfers
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency + transfers,
+            thread_name_prefix='asyncbucket')
+        self._requests = None
+        self._transfers = None
+
+    @property
+    def bucket_name(self):
+        return self.bucket.bucket_name
+
+    @property
+    def objectindex(self):
+        return self.bucket.objectindex
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _semaphores(self):
+        # created on first use so they belong to the running loop
+        if self._requests is None:
+            self._requests = asyncio.Semaphore(self.concurrency)
+            self._transfers = asyncio.Semaphore(self.transfers)
+        return self._requests, self._transfers
+
+    async def _run(self, semaphore, function, *args, **kwargs):
+        """
+        Runs a blocking call on the pool once semaphore has a free slot.
+        """
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(function, *args, **kwargs))
+
+    async def _request(self, function, *args, **kwargs):
+        return await self._run(self._semaphores()[0], function, *args, **kwargs)
+
+    async def _transfer(self, function, *args, **kwargs):
+        return await self._run(self._semaphores()[1], function, *args, **kwargs)
+
+    async def exists(self, refresh=False):
+        """
+        Awaitable S3Bucket.exists.
+        """
+        return await self._request(self.bucket.exists, refresh)
+
+    async def init(self):
+        """
+        Awaitable S3Bucket.init.
+        """
+        return await self._request(self.bucket.init)
+
+    async def get_objects(self, workers=None, prefixes=None):
+        """
+        Awaitable S3Bucket.get_objects, refreshing the key index.
+        """
+        return await self._request(self.bucket.get_objects, workers, prefixes)
+
+    async def put(self, s3_name, data, **kwargs):
+        """
+        Stores data (bytes) as s3_name with a single PutObject.
+
+        returns the response of PutObject.
+        """
+        def _put():
+            response = self.bucket._call(
+                self.bucket.client.put_object, Bucket=self.bucket_name,
+                Key=s3_name, Body=data, **kwargs)
+            self.bucket._index_add(s3_name, len(data), response.get('ETag'))
+            return response
+
+        return await self._request(_put)
+
+    async def get(self, s3_name, **kwargs):
+        """
+        Returns the content of s3_name as bytes.
+        """
+        def _get():
+            body = self.bucket.client.get_object(Bucket=self.bucket_name,
+                                                 Key=s3_name, **kwargs)['Body']
+            try:
+                return body.read()
+            finally:
+                body.close()
+
+        return await self._request(self.bucket._call, _get)
+
+    async def upload(self, file_object, s3_name, action='upload', config='auto'):
+        """
+        Awaitable S3Bucket.multipart_transfer for an upload; action can
+        be 'upload', 'resumable' or 'dedup'.
+        """
+        return await self._transfer(self.bucket.multipart_transfer, file_object,
+                                    s3_name, action, config=config)
+
+    async def download(self, s3_name, local_path, config='auto'):
+        """
+        Awaitable S3Bucket.multipart_transfer download.
+        """
+        return await self._transfer(self.bucket.multipart_transfer, s3_name,
+                                    local_path, 'download', config=config)
+
+    async def delete(self, s3_name):
+        """
+        Awaitable S3Bucket.delete_object for a single key.
+        """
+        return await self._request(self.bucket.delete_object, s3_name)
+
+    async def delete_objects(self, object_list):
+        """
+        Awaitable S3Bucket.delete_objects, one DeleteObjects request per
+        batch of keys.
+        """
+        return await self._request(self.bucket.delete_objects, object_list,
+                                   workers=1)
+
+    async def multipart_transfers(self, transfer_list, action, config='auto'):
+        """
+        Runs upload or download for every {file_object: s3_name} item
+        concurrently, within the transfer limit.
+
+        returns a dictionary with results in the format:
+        {"file_object" : TransferResult}
+        """
+        if action == 'download':
+            calls = [self.download(name, path, config=config)
+                     for name, path in transfer_list.items()]
+        else:
+            calls = [self.upload(path, name, action, config=config)
+                     for path, name in transfer_list.items()]
+
+        outcomes = await asyncio.gather(*calls, return_exceptions=True)
+
+        results = {}
+        for name, outcome in zip(transfer_list, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            results[name] = TransferResult(name, outcome)
+
+        return results
+
+    async def close(self):
+        """
+        Waits for running calls to finish and releases the thread pool.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+reader_bench.py - compares the ways a large file's parts can be read
+for upload: CPU time per GB and peak RSS of the uploading process.
+
+    mmap              ResumableUpload sending memoryview slices of a
+                      mapping of the file (mapped.MappedFile), as it
+                      does with --mmap for files watch.py found stable
+    read              ResumableUpload reading each part into a new
+                      bytes object with pread (mapped.PartReader), as it
+                      does for every other file
+    transfer_manager  boto3's upload_file, the 'upload' action's old path
+
+Each reader runs in its own process against a moto server in this one
+(see transfer_bench.py), so the CPU time and RSS reported are the
+client's alone.  Both ResumableUpload readers also compute the file's
+checksums (see checksums.py), which the transfer manager doesn't; mmap
+against read is the like-for-like comparison.
+
+usage:
+
+    python benchmarks/reader_bench.py --size 2048 --part-size 64
+    python benchmarks/reader_bench.py --endpoint-url http://127.0.0.1:9000
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# transfer_bench puts the repository on sys.path
+import transfer_bench
+import resumable
+import s3upload
+from boto3.s3.transfer import TransferConfig
+
+MB = s3upload.MB
+GB = 1024 * MB
+
+READERS = ('mmap', 'read', 'transfer_manager')
+
+
+def cpu_seconds():
+    """
+    Returns the user and system CPU time this process has used.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_child(args):
+    """
+    Uploads one file with args.child and prints its figures as JSON.
+    """
+    workdir = tempfile.mkdtemp(prefix='s3bench')
+
+    try:
+        bucket = transfer_bench.make_bucket(
+            args, 'bench-reader-' + args.child.replace('_', '-'))
+        path = os.path.join(workdir, 'large')
+        transfer_bench.write_random(path, args.size * MB)
+        part_size = args.part_size * MB
+
+        start_cpu = cpu_seconds()
+        start = time.perf_counter()
+
+        if args.child == 'transfer_manager':
+            bucket.client.upload_file(path, bucket.bucket_name, 'large',
+                                      Config=TransferConfig(
+                                          multipart_threshold=part_size,
+                                          multipart_chunksize=part_size,
+                                          max_concurrency=args.workers))
+        else:
+            resumable.ResumableUpload(bucket.client, bucket.bucket_name, path,
+                                      'large', part_size=part_size,
+                                      workers=args.workers,
+                                      journal_dir=workdir,
+                                      stable=args.child == 'mmap').run()
+
+        seconds = time.perf_counter() - start
+        cpu = cpu_seconds() - start_cpu
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    gigabytes = args.size * MB / float(GB)
+    print(json.dumps({'reader': args.child,
+                      'seconds': round(seconds, 3),
+                      'mb_per_s': round(args.size / seconds, 1),
+                      'cpu_s_per_gb': round(cpu / gigabytes, 3),
+                      'peak_rss_mb': round(transfer_bench.peak_rss_mb(), 1)}))
+
+
+def main():
+    """
+    Runs every reader in a child process and prints a table.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--reader', action='append', choices=READERS,
+                        help='reader to run (default: all)')
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint to use '
+                        'instead of starting a moto server')
+    parser.add_argument('--size', type=int, default=1024, help='file size in MB')
+    parser.add_argument('--part-size', type=int, default=64,
+                        help='part size in MB')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--child', choices=READERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args)
+
+    server = None
+    if args.endpoint_url is None:
+        server, args.endpoint_url = transfer_bench.start_moto()
+
+    records = []
+
+    try:
+        for reader in args.reader or READERS:
+            command = [sys.executable, os.path.abspath(__file__),
+                       '--child', reader,
+                       '--endpoint-url', args.endpoint_url,
+                       '--size', str(args.size),
+                       '--part-size', str(args.part_size),
+                       '--workers', str(args.workers)]
+            output = subprocess.check_output(command)
+            records.append(json.loads(output.decode().strip().splitlines()[-1]))
+    finally:
+        if server is not None:
+            server.stop()
+
+    print("{0:18} {1:>9} {2:>9} {3:>12} {4:>9}".format(
+        'reader', 'seconds', 'MB/s', 'cpu s/GB', 'rss MB'))
+    for record in records:
+        print("{0:18} {1:>9} {2:>9} {3:>12} {4:>9}".format(
+            record['reader'], record['seconds'], record['mb_per_s'],
+            record['cpu_s_per_gb'], record['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
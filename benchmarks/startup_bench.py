@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+startup_bench.py - measures how long s3upload and s3download take to
+start, and checks that they leave their heavy dependencies unloaded.
+
+boto3 (with botocore's client machinery and s3transfer), requests and
+cProfile are imported by the code paths that use them, not when the
+entry points are imported; a top level import of any of them adds
+100ms or more to every cron run and to --help.  For each command this
+reports, over --runs fresh interpreters:
+
+    median wall time in ms, the same less a bare interpreter's start,
+    and the -X importtime cumulative time of the imported module
+
+and then the modules that took longest to import (a script run as
+__main__ has no import time of its own).  It exits 1 if one of
+LAZY_MODULES was imported, or with --max-ms if a command took longer
+than that beyond a bare interpreter.
+
+usage:
+
+    python benchmarks/startup_bench.py
+    python benchmarks/startup_bench.py --runs 20 --max-ms 150 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules the entry points must not import until they are needed
+LAZY_MODULES = ('boto3', 's3transfer', 'botocore.client', 'botocore.session',
+                'requests', 'rmxml', 'cProfile', 'pstats')
+
+COMMANDS = (
+    ('import s3upload', ['-c', 'import s3upload'], 's3upload'),
+    ('import s3download', ['-c', 'import s3download'], 's3download'),
+    ('s3upload --help', ['s3upload.py', '--help'], None),
+    ('s3download --help', ['s3download.py', '--help'], None),
+)
+
+
+def run(arguments):
+    """
+    Runs the interpreter with -X importtime and arguments in ROOT.
+
+    returns (wall seconds, {module: (self us, cumulative us)})
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime'] + arguments,
+                               cwd=ROOT, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, check=True)
+    seconds = time.perf_counter() - start
+
+    return seconds, parse_importtime(completed.stderr.decode())
+
+
+def parse_importtime(output):
+    """
+    Returns {module: (self us, cumulative us)} from -X importtime output.
+    """
+    modules = {}
+
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+
+    return modules
+
+
+def loaded_lazy_modules():
+    """
+    Returns the LAZY_MODULES importing both entry points loads.
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import json, sys, s3upload, s3download; '
+         'print(json.dumps(sorted(sys.modules)))'], cwd=ROOT)
+    loaded = set(json.loads(output.decode()))
+
+    return [name for name in LAZY_MODULES if name in loaded]
+
+
+def main():
+    """
+    Times every command and prints a table.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='interpreters started per command')
+    parser.add_argument('--top', type=int, default=15,
+                        help='slowest imports listed')
+    parser.add_argument('--max-ms', type=float,
+                        help='fail if a command takes longer than this '
+                        'beyond a bare interpreter')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    baseline = statistics.median(run(['-c', 'pass'])[0]
+                                 for _ in range(args.runs))
+
+    records = []
+    slowest = {}
+
+    for label, arguments, module in COMMANDS:
+        walls = []
+        imports = []
+
+        for _ in range(args.runs):
+            seconds, modules = run(arguments)
+            walls.append(seconds)
+            if module is not None:
+                imports.append(modules.get(module, (0, 0))[1])
+            for name, (self_us, _) in modules.items():
+                slowest[name] = max(slowest.get(name, 0), self_us)
+
+        wall = statistics.median(walls) * 1000
+        records.append({'command': label,
+                        'wall_ms': round(wall, 1),
+                        'startup_ms': round(wall - baseline * 1000, 1),
+                        'import_ms': round(statistics.median(imports) / 1000.0,
+                                           1) if imports else None})
+
+    print("python -c pass: {0:.1f} ms".format(baseline * 1000))
+    print("{0:20} {1:>9} {2:>11} {3:>10}".format(
+        'command', 'wall ms', 'startup ms', 'import ms'))
+    for record in records:
+        print("{0:20} {1:>9} {2:>11} {3:>10}".format(
+            record['command'], record['wall_ms'], record['startup_ms'],
+            '-' if record['import_ms'] is None else record['import_ms']))
+
+    print("\nslowest imports (self ms, worst run):")
+    for name in sorted(slowest, key=lambda name: -slowest[name])[:args.top]:
+        print("{0:>8.1f}  {1}".format(slowest[name] / 1000.0, name))
+
+    lazy = loaded_lazy_modules()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'baseline_ms': round(baseline * 1000, 1),
+                       'records': records, 'lazy_modules_loaded': lazy},
+                      output, indent=2)
+
+    failed = False
+
+    if lazy:
+        print("\nimported at startup: {0}".format(', '.join(lazy)))
+        failed = True
+
+    if args.max_ms is not None:
+        for record in records:
+            if record['startup_ms'] > args.max_ms:
+                print("{0} took {1} ms, more than {2} ms".format(
+                    record['command'], record['startup_ms'], args.max_ms))
+                failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+transfer_bench.py - measures S3Bucket transfer and listing performance
+against a local S3 stand-in.
+
+By default a moto server is started on a free local port (pip install
+-r benchmarks/requirements.txt); pass --endpoint-url to use another
+S3-compatible server such as MinIO instead.  Each scenario runs in its
+own process so its peak RSS is its own, and reports:
+
+    seconds, bytes, objects, MB/s, objects/s, requests by operation,
+    peak RSS in MB
+
+usage:
+
+    python benchmarks/transfer_bench.py --output results.json
+    python benchmarks/transfer_bench.py --scenario listing --list-keys 50000
+    python benchmarks/transfer_bench.py --compare old.json --output new.json
+
+Results are written as JSON along with the git revision, so runs of
+different versions can be compared with --compare.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import admin  # noqa: E402
+import s3upload  # noqa: E402
+
+MB = s3upload.MB
+
+SCENARIOS = ('small_files', 'multipart_upload', 'multipart_download',
+             'listing')
+
+
+class RequestCounter(object):
+    """
+    Counts the S3 requests a client sends, by operation name.
+    """
+    def __init__(self, client):
+
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        client.meta.events.register('before-send.s3', self)
+
+    def __call__(self, event_name=None, **kwargs):
+        with self._lock:
+            self.counts[event_name.rsplit('.', 1)[-1]] += 1
+
+    def reset(self):
+        """
+        Clears the counts before a timed section.
+        """
+        with self._lock:
+            self.counts.clear()
+
+
+def peak_rss_mb():
+    """
+    Returns this process's peak resident set size in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        return peak / float(MB)
+    return peak / 1024.0
+
+
+def write_random(path, size, block=MB):
+    """
+    Writes size bytes of incompressible data to path.
+    """
+    with open(path, 'wb') as data:
+        remaining = size
+        while remaining > 0:
+            data.write(os.urandom(min(block, remaining)))
+            remaining -= block
+
+
+def result(scenario, seconds, total_bytes, objects, counter):
+    """
+    Builds the result record for one timed section.
+    """
+    return {'scenario': scenario,
+            'seconds': round(seconds, 4),
+            'bytes': total_bytes,
+            'objects': objects,
+            'mb_per_s': round(total_bytes / MB / seconds, 2) if seconds else None,
+            'objects_per_s': round(objects / seconds, 2) if seconds else None,
+            'requests': dict(counter.counts),
+            'request_total': sum(counter.counts.values()),
+            'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+
+def make_bucket(args, name):
+    """
+    Creates an empty bucket on the stand-in and returns its S3Bucket.
+    """
+    auth = admin.KeySecret(key='testing', secret='testing')
+    bucket = s3upload.S3Bucket(auth=auth, bucket_name=name,
+                               region='us-east-1',
+                               endpoint_url=args.endpoint_url)
+    bucket.client.create_bucket(Bucket=name)
+    bucket.init()
+    return bucket
+
+
+def small_files(args, workdir):
+    """
+    Uploads many small files with add_objects.
+    """
+    bucket = make_bucket(args, 'bench-small-files')
+    transfers = {}
+
+    for number in range(args.small_count):
+        path = os.path.join(workdir, 'small{0:06d}'.format(number))
+        write_random(path, args.small_size)
+        transfers[path] = 'small/{0:06d}'.format(number)
+
+    counter = RequestCounter(bucket.client)
+    start = time.perf_counter()
+    results = bucket.add_objects(transfers, workers=args.workers)
+    seconds = time.perf_counter() - start
+
+    failed = [name for name in results if not results[name]]
+    if failed:
+        raise RuntimeError("{0} uploads failed".format(len(failed)))
+
+    return [result('small_files', seconds, args.small_count * args.small_size,
+                   args.small_count, counter)]
+
+
+def multipart(args, workdir, download):
+    """
+    Uploads, and optionally downloads again, one large file with
+    multipart_transfer.
+    """
+    name = 'multipart_download' if download else 'multipart_upload'
+    bucket = make_bucket(args, 'bench-' + name.replace('_', '-'))
+    path = os.path.join(workdir, 'large')
+    write_random(path, args.large_size)
+    counter = RequestCounter(bucket.client)
+
+    if download:
+        bucket.multipart_transfer(path, 'large', 'upload')
+        path = os.path.join(workdir, 'large.download')
+        counter.reset()
+
+    start = time.perf_counter()
+    if download:
+        outcome = bucket.multipart_transfer('large', path, 'download')
+    else:
+        outcome = bucket.multipart_transfer(path, 'large', args.upload_action)
+    seconds = time.perf_counter() - start
+
+    if outcome is not True:
+        raise RuntimeError("{0} failed: {1}".format(name, outcome))
+
+    return [result(name, seconds, args.large_size, 1, counter)]
+
+
+def listing(args, workdir):
+    """
+    Lists a bucket of list_keys objects sequentially and in parallel.
+    """
+    bucket = make_bucket(args, 'bench-listing')
+    keys = ['dir{0:03d}/key{1:07d}'.format(number % 100, number)
+            for number in range(args.list_keys)]
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(lambda key: bucket.client.put_object(
+            Bucket=bucket.bucket_name, Key=key, Body=b''), keys))
+
+    records = []
+    counter = RequestCounter(bucket.client)
+
+    for label, workers in (('listing', 1), ('listing_parallel', args.workers)):
+        counter.reset()
+        start = time.perf_counter()
+        bucket.get_objects(workers=workers)
+        seconds = time.perf_counter() - start
+
+        if len(bucket.objectindex) != len(keys):
+            raise RuntimeError("{0} found {1} of {2} keys".format(
+                label, len(bucket.objectindex), len(keys)))
+
+        records.append(result(label, seconds, 0, len(keys), counter))
+
+    return records
+
+
+def run_child(args):
+    """
+    Runs one scenario in this process and prints its results as JSON.
+    """
+    workdir = tempfile.mkdtemp(prefix='s3bench')
+
+    try:
+        if args.child == 'small_files':
+            records = small_files(args, workdir)
+        elif args.child == 'multipart_upload':
+            records = multipart(args, workdir, download=False)
+        elif args.child == 'multipart_download':
+            records = multipart(args, workdir, download=True)
+        else:
+            records = listing(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(records))
+
+
+def start_moto():
+    """
+    Starts a moto server on a free port and returns (server, endpoint).
+    """
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit("moto[server] is not installed; install "
+                 "benchmarks/requirements.txt or pass --endpoint-url")
+
+    # keep the server's access log out of the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    return server, 'http://127.0.0.1:{0}'.format(port)
+
+
+def git_revision():
+    """
+    Returns the short git revision of the tree being measured, or None.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=ROOT, stderr=subprocess.DEVNULL
+                                       ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(records, baseline_file):
+    """
+    Prints the change in throughput and requests against a previous
+    results file.
+    """
+    with open(baseline_file) as baseline:
+        previous = {record['scenario']: record
+                    for record in json.load(baseline)['results']}
+
+    print("\nchange against {0}:".format(baseline_file))
+    for record in records:
+        old = previous.get(record['scenario'])
+        if old is None:
+            continue
+        for field in ('mb_per_s', 'objects_per_s', 'request_total',
+                      'peak_rss_mb'):
+            if old.get(field) and record.get(field) is not None:
+                change = (record[field] - old[field]) / float(old[field]) * 100
+                print("  {0:20} {1:14} {2:>10} -> {3:>10} ({4:+.1f}%)".format(
+                    record['scenario'], field, old[field], record[field], change))
+
+
+def main():
+    """
+    Runs the selected scenarios, each in a child process, and reports.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='scenario to run (default: all)')
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint to use '
+                        'instead of starting a moto server')
+    parser.add_argument('--workers', type=int, default=s3upload.DEFAULT_WORKERS)
+    parser.add_argument('--small-count', type=int, default=500)
+    parser.add_argument('--small-size', type=int, default=16 * 1024)
+    parser.add_argument('--large-size', type=int, default=256 * MB)
+    parser.add_argument('--upload-action', default='upload',
+                        choices=('upload', 'resumable'))
+    parser.add_argument('--list-keys', type=int, default=20000)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='results file to compare against')
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args)
+
+    server = None
+    if args.endpoint_url is None:
+        server, args.endpoint_url = start_moto()
+
+    records = []
+
+    try:
+        for scenario in args.scenario or SCENARIOS:
+            command = [sys.executable, os.path.abspath(__file__),
+                       '--child', scenario,
+                       '--endpoint-url', args.endpoint_url,
+                       '--workers', str(args.workers),
+                       '--small-count', str(args.small_count),
+                       '--small-size', str(args.small_size),
+                       '--large-size', str(args.large_size),
+                       '--upload-action', args.upload_action,
+                       '--list-keys', str(args.list_keys)]
+            output = subprocess.check_output(command)
+            records.extend(json.loads(output.decode().strip().splitlines()[-1]))
+    finally:
+        if server is not None:
+            server.stop()
+
+    print("{0:20} {1:>9} {2:>9} {3:>10} {4:>9} {5:>9}".format(
+        'scenario', 'seconds', 'MB/s', 'objects/s', 'requests', 'rss MB'))
+    for record in records:
+        print("{0:20} {1:>9} {2:>9} {3:>10} {4:>9} {5:>9}".format(
+            record['scenario'], record['seconds'], record['mb_per_s'],
+            record['objects_per_s'], record['request_total'],
+            record['peak_rss_mb']))
+
+    if args.compare:
+        compare(records, args.compare)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'revision': git_revision(),
+                       'time': time.time(),
+                       'python': platform.python_version(),
+                       'settings': {key: value for key, value in vars(args).items()
+                                    if key not in ('child', 'output', 'compare',
+                                                   'scenario')},
+                       'results': records}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+checksums.py - checksums computed while an upload reads its data.
+
+Digests hashes each block as it goes past: MD5, which is what S3's
+ETag is made of, SHA-256, and a CRC - CRC32C with the crc32c package,
+otherwise zlib's CRC32.  The CRC is sent as the request's S3 checksum
+(ALGORITHM) and the MD5 as Content-MD5, so S3 rejects a request whose
+data was damaged on the way; both are computed from the bytes already
+in memory for the request, so the file is read from disk only once.
+
+Objects uploaded in one request also carry the whole file's digests in
+their metadata (see metadata()).  A multipart upload's metadata is
+fixed before its data is read, so for those S3 keeps the checksum of
+every part, and the whole file's digests - hashed in file order while
+the parts are read - are returned with the transfer result.
+
+usage:
+
+    digests = Digests(data)
+    client.put_object(Bucket='bucket', Key='key', Body=data,
+                      Metadata=digests.metadata(), **digests.headers())
+    print(digests.result())
+"""
+
+import base64
+import hashlib
+import zlib
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+
+# the S3 checksum algorithm sent with each request
+ALGORITHM = 'CRC32C' if crc32c is not None else 'CRC32'
+
+# object metadata recording the digests of the uploaded file
+MD5_METADATA = 's3upload-md5'
+SHA256_METADATA = 's3upload-sha256'
+CRC_METADATA = 's3upload-' + ALGORITHM.lower()
+
+
+def _crc(data, value=0):
+    if crc32c is not None:
+        return crc32c.crc32c(data, value)
+    return zlib.crc32(data, value)
+
+
+def _b64(digest):
+    return base64.b64encode(digest).decode('ascii')
+
+
+def multipart_etag(part_md5s):
+    """
+    Returns the ETag S3 gives a multipart upload whose parts had the
+    MD5 digests part_md5s, in part order.
+    """
+    combined = hashlib.md5(b''.join(part_md5s)).hexdigest()
+    return '"{0}-{1}"'.format(combined, len(part_md5s))
+
+
+class Digests(object):
+    """
+    The MD5, SHA-256 and CRC of a stream of bytes.
+
+    usage:
+
+        digests = Digests()
+        digests.update(block)
+        digests.headers()
+
+    With sha256=False the SHA-256 is left out, for the parts of a
+    multipart upload: S3 is sent their MD5 and CRC only.
+    """
+    def __init__(self, data=None, sha256=True):
+
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256() if sha256 else None
+        self.crc = 0
+        self.size = 0
+
+        if data is not None:
+            self.update(data)
+
+    def update(self, data):
+        self.md5.update(data)
+        if self.sha256 is not None:
+            self.sha256.update(data)
+        self.crc = _crc(data, self.crc)
+        self.size += len(data)
+
+    def crc_value(self):
+        """
+        The CRC in the base64 form S3 uses for checksums.
+        """
+        return _b64(self.crc.to_bytes(4, 'big'))
+
+    def etag(self):
+        return '"{0}"'.format(self.md5.hexdigest())
+
+    def headers(self):
+        """
+        Returns the put_object / upload_part arguments that have S3
+        check the data against these digests.
+        """
+        return {'ContentMD5': _b64(self.md5.digest()),
+                'Checksum' + ALGORITHM: self.crc_value()}
+
+    def metadata(self):
+        """
+        Returns object metadata recording these digests.
+        """
+        return {MD5_METADATA: self.md5.hexdigest(),
+                SHA256_METADATA: self.sha256.hexdigest(),
+                CRC_METADATA: '{0:08x}'.format(self.crc)}
+
+    def result(self):
+        """
+        Returns the digests as a dictionary of hex strings.
+        """
+        return {'size': self.size, 'md5': self.md5.hexdigest(),
+                'sha256': self.sha256.hexdigest(),
+                ALGORITHM.lower(): '{0:08x}'.format(self.crc)}
+
+
+class HashingReader(object):
+    """
+    A read-only, non-seekable file object that passes another file
+    object's content through a Digests.
+
+    Being non-seekable makes the boto3 transfer manager read it once,
+    in order, into the part buffers it sends from.
+
+    usage:
+
+        HashingReader(open('file', 'rb'), Digests()).read(8 * 1024 * 1024)
+    """
+    def __init__(self, source, digests):
+
+        self.source = source
+        self.digests = digests
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.digests.update(data)
+        return data
+
+    def close(self):
+        self.source.close()
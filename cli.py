@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+cli.py - the command line shared by s3upload.py and s3download.py.
+
+Both entry points take the same options - a config file, daemon mode,
+profiling and transfer settings - and run their jobs the same way
+through a scheduler.Scheduler.  Each only brings its own job function,
+the way it builds its buckets and any options of its own.
+
+usage:
+
+    parser = cli.parser("Uploads local directories to S3 buckets.",
+                        's3upload-profile', watch=True)
+    parser.add_argument('--mmap', action='store_true')
+    cli.run(parser.parse_args(), upload_job, make_bucket,
+            watch_job=watch_upload_job)
+"""
+
+import argparse
+import os
+import signal
+import admin
+import metrics
+import profiling
+import scheduler
+
+
+# credentials used when there is no config, or it names no keyfile
+DEFAULT_KEYFILE = '.s32.secret'
+
+# the job run when there is no config
+DEFAULT_JOBS = [scheduler.Job("mtkbackup", os.path.normcase(
+    r"/Program Files/Microsoft SQL Server/MSSQL10_50.MSSQLSERVER/MSSQL/Backup/test/"))]
+
+TRANSFER_OPTIONS = ('part_size', 'multipart_threshold', 'max_concurrency')
+
+
+def parser(description, profile_out, watch=False):
+    """
+    Returns an argparse.ArgumentParser with the options every entry
+    point takes, and --watch with watch=True.  profile_out is the
+    default path of --profile's files.  Callers add their own options.
+    """
+    arguments = argparse.ArgumentParser(description=description)
+    arguments.add_argument('--config', help="admin.Config file naming the "
+                           "job file, interval, reconcile_interval, logfile, "
+                           "keyfile and metrics targets")
+    arguments.add_argument('--daemon', action='store_true',
+                           help="repeat the jobs every config interval")
+    if watch:
+        arguments.add_argument('--watch', action='store_true',
+                               help="after the first run, upload files as "
+                               "they are written")
+    arguments.add_argument('--profile', nargs='?', const='phases',
+                           choices=profiling.MODES,
+                           help="time the phases of the run, and with "
+                           "cprofile or sample profile it too")
+    arguments.add_argument('--profile-out', default=profile_out,
+                           help="path the profile files are written to, "
+                           "without extension")
+    arguments.add_argument('--part-size', type=scheduler.parse_size,
+                           help="multipart part size, e.g. 64MB (default: "
+                           "picked from each file's size)")
+    arguments.add_argument('--multipart-threshold', type=scheduler.parse_size,
+                           help="smallest file sent in parts, e.g. 64MB")
+    arguments.add_argument('--max-concurrency', type=int,
+                           help="parts of one file transferred at once")
+    return arguments
+
+
+def transfer_settings(args):
+    """
+    Returns the transfer_config() settings given on the command line.
+    """
+    return {setting: getattr(args, setting) for setting in TRANSFER_OPTIONS
+            if getattr(args, setting) is not None}
+
+
+def run(args, run_job, make_bucket, watch_job=None):
+    """
+    Runs run_job for each job once, or keeps running them as args
+    asks; watch_job is the job --watch runs for each change.
+
+    The jobs are read from the job file of args.config, and default to
+    DEFAULT_JOBS without one.  make_bucket(bucket_name, budget,
+    **arguments) builds each bucket, passing the S3Bucket arguments
+    taken from the config - auth, metrics and, if the config sets it,
+    reconcile_interval - on to it.
+    """
+    keyfile = DEFAULT_KEYFILE
+    interval = None
+    emitter = None
+    reconcile_interval = None
+    jobs = DEFAULT_JOBS
+
+    if args.config:
+        config = admin.Config(config=args.config)
+        scheduler.configure_logging(config)
+        jobs = scheduler.load_jobs(config.job)
+        interval = config.interval
+        keyfile = config.keyfile or keyfile
+        reconcile_interval = config.reconcile_interval
+        emitter = metrics.from_config(config)
+
+    arguments = {'auth': admin.KeySecret(source=keyfile), 'metrics': emitter}
+    if reconcile_interval is not None:
+        # seconds before the manifest is checked against a new listing
+        arguments['reconcile_interval'] = int(reconcile_interval)
+
+    def _bucket(bucket_name, budget):
+        return make_bucket(bucket_name, budget, **arguments)
+
+    runner = scheduler.Scheduler(jobs, run_job, _bucket, interval=interval,
+                                 metrics=emitter,
+                                 config=transfer_settings(args))
+
+    profiler = None
+    if args.profile:
+        profiler = profiling.Profiler(args.profile)
+        profiler.start()
+
+    try:
+        _run(runner, args, watch_job)
+    finally:
+        if emitter is not None:
+            emitter.close()
+        if profiler is not None:
+            profiler.stop()
+            print(profiler.summary())
+            for path in profiler.dump(args.profile_out):
+                print("profile written to {0}".format(path))
+
+
+def _run(runner, args, watch_job=None):
+    """
+    Runs the jobs once and prints the results, or keeps running them as
+    args asks.
+    """
+    watching = watch_job is not None and args.watch
+
+    if args.daemon or watching:
+        signal.signal(signal.SIGTERM, lambda *_: runner.stop())
+        if watching:
+            runner.watch(watch_job)
+        else:
+            runner.run_forever()
+        return
+
+    for job, results in runner.run_once().items():
+        if isinstance(results, Exception):
+            print("{0}: {1!r}".format(job, results))
+            continue
+        for item in results:
+            print(results[item])
+
+    for bucket in runner.buckets.values():
+        print("concurrency: {0}".format(bucket.controller.report()))
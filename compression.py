@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+compression.py - streaming compression for uploads and downloads.
+
+CompressingReader wraps an open file and hands out compressed bytes
+from read(), so it can be given straight to the boto3 multipart
+uploader: the file is compressed part by part as it is sent, without a
+compressed copy being staged on disk.  The codec is recorded in the
+object's metadata under CODEC_METADATA, and download() uses it to
+decompress the object as it streams back down.
+
+Codecs are 'gzip' (standard library) and 'zstd', which needs the
+zstandard package.
+
+usage:
+
+    with open('db.bak', 'rb') as source:
+        client.upload_fileobj(CompressingReader(source, 'zstd'), 'bucket',
+                              'db.bak', ExtraArgs=extra_args('zstd', size))
+
+    download(client, 'bucket', 'db.bak', '/restore/db.bak')
+"""
+
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CODECS = ('gzip', 'zstd')
+
+# object metadata recording how an object was compressed
+CODEC_METADATA = 's3upload-codec'
+SIZE_METADATA = 's3upload-size'
+
+BLOCKSIZE = 1024 * 1024
+
+
+def _check(codec):
+    if codec not in CODECS:
+        raise ValueError("unknown compression codec {0!r}".format(codec))
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package")
+
+
+def compressor(codec):
+    """
+    Returns an object with compress() and flush() for codec.
+    """
+    _check(codec)
+
+    if codec == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    return zstandard.ZstdCompressor().compressobj()
+
+
+def decompressor(codec):
+    """
+    Returns an object with decompress() for codec.
+    """
+    _check(codec)
+
+    if codec == 'gzip':
+        return zlib.decompressobj(31)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def extra_args(codec, size=None):
+    """
+    Returns the ExtraArgs that record codec, and the uncompressed size,
+    in the metadata of an uploaded object.
+    """
+    metadata = {CODEC_METADATA: codec}
+    if size is not None:
+        metadata[SIZE_METADATA] = str(size)
+    return {'Metadata': metadata}
+
+
+class CompressingReader(object):
+    """
+    A read-only, non-seekable file object returning the compressed
+    content of another file object.
+
+    usage:
+
+        CompressingReader(open('file', 'rb'), 'gzip').read(8 * 1024 * 1024)
+    """
+    def __init__(self, source, codec, blocksize=BLOCKSIZE):
+
+        self.source = source
+        self.blocksize = blocksize
+        self._compressor = compressor(codec)
+        self._buffer = bytearray()
+        self._finished = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def _fill(self, size):
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            block = self.source.read(self.blocksize)
+
+            if block:
+                self.bytes_in += len(block)
+                self._buffer += self._compressor.compress(block)
+            else:
+                self._buffer += self._compressor.flush()
+                self._finished = True
+
+    def read(self, size=-1):
+        """
+        Returns up to size compressed bytes, or all that remain if size
+        is negative.  An empty result means the stream is finished.
+        """
+        if size is None:
+            size = -1
+
+        self._fill(size)
+
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer = bytearray()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+
+        self.bytes_out += len(data)
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+def object_codec(client, bucket_name, s3_name):
+    """
+    Returns the codec recorded in an object's metadata, or None.
+    """
+    response = client.head_object(Bucket=bucket_name, Key=s3_name)
+    return response.get('Metadata', {}).get(CODEC_METADATA)
+
+
+def download(client, bucket_name, s3_name, local_path, codec,
+             blocksize=BLOCKSIZE):
+    """
+    Streams an object compressed with codec into local_path,
+    decompressing as it arrives.  The file is written under a temporary
+    name and only moved into place once complete.
+    """
+    partial = local_path + '.part'
+    stream = decompressor(codec)
+    body = client.get_object(Bucket=bucket_name, Key=s3_name)['Body']
+
+    try:
+        with open(partial, 'wb') as output:
+            for block in iter(lambda: body.read(blocksize), b''):
+                output.write(stream.decompress(block))
+
+            if hasattr(stream, 'flush'):
+                output.write(stream.flush())
+
+        os.replace(partial, local_path)
+
+    except Exception:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+
+    finally:
+        body.close()
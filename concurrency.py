@@ -0,0 +1,262 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+concurrency.py - adapts the number of requests in flight to what S3 and
+the link will take.
+
+An AdaptiveController is attached to a boto3 client through botocore's
+event hooks, so it sees every request the client sends - single puts,
+the parts of boto3 managed transfers, resumable uploads and ranged
+downloads alike.  A request has to take a slot before it is sent, and
+the number of slots follows an AIMD rule:
+
+- every window of `limit` completed requests, the limit grows by one,
+  unless the average latency has risen above LATENCY_TOLERANCE times
+  the best window seen without throughput improving, in which case it
+  shrinks by one;
+- a throttling response (503 SlowDown and friends) or a failed
+  connection halves the limit, at most once per window, and doubles
+  the part size suggested for the next transfers, so the same data
+  takes fewer requests;
+- after CLEAN_WINDOWS windows in a row without a throttle, the part
+  size scale is halved again, so a long running daemon goes back to
+  its usual part sizes once S3 has stopped pushing back.
+
+Slots are held from sending a request to receiving its response
+headers, so a GET's body is read after its slot is released.
+
+usage:
+
+    controller = concurrency.for_client(client, maximum=128)
+    ...
+    print(controller.report())
+"""
+
+import threading
+import time
+import weakref
+
+
+THROTTLE_CODES = frozenset(('SlowDown', 'Throttling', 'ThrottlingException',
+                            'RequestLimitExceeded', 'RequestThrottled',
+                            'TooManyRequestsException', 'ServiceUnavailable'))
+THROTTLE_STATUS = frozenset((429, 503))
+
+DEFAULT_INITIAL = 8
+DEFAULT_MINIMUM = 2
+DEFAULT_MAXIMUM = 128
+
+# how far the window latency may rise over the best seen before growth
+# stops, unless throughput is still improving by THROUGHPUT_GAIN
+LATENCY_TOLERANCE = 2.0
+THROUGHPUT_GAIN = 0.05
+
+# multiplicative decrease on throttling
+BACKOFF = 0.5
+
+# the most the suggested part size is scaled up after throttling
+MAX_PART_SCALE = 8
+
+# windows without a throttle before the part size scale is halved
+CLEAN_WINDOWS = 8
+
+_LOCK = threading.Lock()
+_CONTROLLERS = weakref.WeakKeyDictionary()
+
+
+class AdaptiveController(object):
+    """
+    An AIMD limit on the requests in flight through one or more clients.
+
+    usage:
+
+        controller = AdaptiveController(initial=8, maximum=64)
+        controller.attach(client)
+    """
+    def __init__(self, initial=DEFAULT_INITIAL, minimum=DEFAULT_MINIMUM,
+                 maximum=DEFAULT_MAXIMUM):
+
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self._limit = float(min(max(initial, minimum), self.maximum))
+        self.part_scale = 1
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._local = threading.local()
+
+        # totals for report()
+        self.requests = 0
+        self.throttles = 0
+        self.bytes = 0
+        self.peak_limit = self.limit
+        self._started = time.monotonic()
+        self._busy = 0.0
+
+        # the current window
+        self._window_start = self._started
+        self._window_requests = 0
+        self._window_latency = 0.0
+        self._window_bytes = 0
+        self._since_decrease = self.maximum
+        self._clean_windows = 0
+        self._best_latency = None
+        self._throughput = 0.0
+
+    @property
+    def limit(self):
+        """
+        The number of requests currently allowed in flight.
+        """
+        return int(self._limit)
+
+    def attach(self, client):
+        """
+        Routes every request of a boto3 S3 client through this
+        controller.
+        """
+        events = client.meta.events
+        events.register('before-send.s3', self._before_send,
+                        unique_id='s3upload-adaptive-send')
+        events.register('response-received.s3', self._response_received,
+                        unique_id='s3upload-adaptive-received')
+
+    def acquire(self):
+        """
+        Waits for a free slot.
+        """
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, transferred=0, throttled=False):
+        """
+        Frees a slot and records the outcome of its request.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.requests += 1
+            self.bytes += transferred
+            self._busy += latency
+            self._since_decrease += 1
+
+            if throttled:
+                self.throttles += 1
+                self._clean_windows = 0
+                self._decrease()
+            else:
+                self._window_requests += 1
+                self._window_latency += latency
+                self._window_bytes += transferred
+
+                if self._window_requests >= self.limit:
+                    self._evaluate()
+
+            self._condition.notify_all()
+
+    def _decrease(self):
+        # one cut per window: the requests already in flight when the
+        # first throttle came back will often be throttled too
+        if self._since_decrease < self.limit:
+            return
+
+        self._limit = max(self.minimum, self._limit * BACKOFF)
+        self.part_scale = min(MAX_PART_SCALE, self.part_scale * 2)
+        self._since_decrease = 0
+        self._reset_window()
+
+    def _evaluate(self):
+        now = time.monotonic()
+        latency = self._window_latency / self._window_requests
+        throughput = self._window_bytes / max(now - self._window_start, 1e-6)
+
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+
+        congested = (latency > self._best_latency * LATENCY_TOLERANCE and
+                     throughput <= self._throughput * (1 + THROUGHPUT_GAIN))
+
+        if congested:
+            self._limit = max(self.minimum, self._limit - 1)
+        else:
+            self._limit = min(self.maximum, self._limit + 1)
+            self.peak_limit = max(self.peak_limit, self.limit)
+
+        self._clean_windows += 1
+        if self.part_scale > 1 and self._clean_windows >= CLEAN_WINDOWS:
+            self.part_scale //= 2
+            self._clean_windows = 0
+
+        self._throughput = throughput
+        self._reset_window(now)
+
+    def _reset_window(self, now=None):
+        self._window_start = now or time.monotonic()
+        self._window_requests = 0
+        self._window_latency = 0.0
+        self._window_bytes = 0
+
+    def part_size(self, part_size, largest):
+        """
+        Returns part_size scaled up after throttling, at most largest.
+        """
+        return min(part_size * self.part_scale, largest)
+
+    def _before_send(self, request=None, **kwargs):
+        self.acquire()
+        self._local.started = time.monotonic()
+        self._local.sent = int(request.headers.get('Content-Length') or 0)
+
+    def _response_received(self, response_dict=None, parsed_response=None,
+                           exception=None, **kwargs):
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            return
+        self._local.started = None
+
+        status = response_dict['status_code'] if response_dict else None
+        code = (parsed_response or {}).get('Error', {}).get('Code')
+        throttled = (exception is not None or status in THROTTLE_STATUS or
+                     code in THROTTLE_CODES)
+
+        transferred = self._local.sent
+        if status is not None and status < 300:
+            transferred += int(response_dict['headers'].get('content-length')
+                               or 0)
+
+        self.release(time.monotonic() - started, transferred, throttled)
+
+    def report(self):
+        """
+        Returns the settled limit and part scale along with totals for
+        the run so far.
+        """
+        with self._condition:
+            elapsed = time.monotonic() - self._started
+            return {'limit': self.limit,
+                    'peak_limit': self.peak_limit,
+                    'part_scale': self.part_scale,
+                    'requests': self.requests,
+                    'throttles': self.throttles,
+                    'mean_latency_ms': round(self._busy / self.requests * 1000, 1)
+                                       if self.requests else None,
+                    'mb_per_s': round(self.bytes / elapsed / (1024 * 1024), 2)
+                                if elapsed else None}
+
+
+def for_client(client, initial=DEFAULT_INITIAL, minimum=DEFAULT_MINIMUM,
+               maximum=DEFAULT_MAXIMUM):
+    """
+    Returns the controller attached to client, attaching a new one the
+    first time.  Clients are shared between buckets (see connections.py),
+    so the buckets using one client share its limit.
+    """
+    with _LOCK:
+        controller = _CONTROLLERS.get(client)
+
+        if controller is None:
+            controller = AdaptiveController(initial, minimum, maximum)
+            controller.attach(client)
+            _CONTROLLERS[client] = controller
+
+        return controller
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+connections.py - shares boto3 sessions and S3 connection pools.
+
+Building a boto3 client creates a botocore session, resolves
+credentials and opens a fresh connection pool, so every S3Bucket that
+built its own paid for new TLS handshakes.  get_client hands out one
+client per set of credentials, region and endpoint instead, and its
+connection pool is shared by all the buckets, jobs and transfer threads
+using it.
+
+Only clients are shared: they are thread safe, but boto3 resources
+are not, so nothing here hands one out; list with the client's
+paginators instead (see listing.py).
+
+usage:
+
+    client = connections.get_client(auth, max_pool_connections=64)
+"""
+
+import threading
+import retry
+
+
+# botocore's own default pool size
+DEFAULT_POOL_CONNECTIONS = 10
+
+_LOCK = threading.Lock()
+_SESSIONS = {}
+_CLIENTS = {}
+
+
+def _credentials(auth):
+    if auth is None:
+        return (None, None)
+    return (auth.key, auth.secret)
+
+
+def get_session(auth=None, region=None):
+    """
+    Returns the boto3 Session for a set of credentials and region.
+
+    auth is an admin.KeySecret, or None for boto3's default credential
+    chain.
+    """
+    # boto3 takes longer to import than a short run takes to start, so
+    # it is only imported once a bucket needs a session
+    import boto3.session
+
+    key = _credentials(auth) + (region,)
+
+    with _LOCK:
+        if key not in _SESSIONS:
+            _SESSIONS[key] = boto3.session.Session(
+                aws_access_key_id=key[0], aws_secret_access_key=key[1],
+                region_name=region)
+
+        return _SESSIONS[key]
+
+
+def _config(max_pool_connections):
+    import botocore.config
+
+    return botocore.config.Config(max_pool_connections=max_pool_connections,
+                                  retries=retry.BOTOCORE_RETRIES)
+
+
+def get_client(auth=None, region=None,
+               max_pool_connections=DEFAULT_POOL_CONNECTIONS,
+               endpoint_url=None):
+    """
+    Returns the shared S3 client for a set of credentials, region and
+    endpoint.
+
+    The client keeps at least max_pool_connections connections.  When
+    a caller asks for a bigger pool than the shared client has, the
+    client is rebuilt with the bigger size; objects already holding the
+    old one keep working with it.
+    """
+    session = get_session(auth, region)
+    key = _credentials(auth) + (region, endpoint_url)
+
+    with _LOCK:
+        client = _CLIENTS.get(key)
+
+        if client is not None:
+            current = client.meta.config.max_pool_connections
+            if current >= max_pool_connections:
+                return client
+            max_pool_connections = max(current, max_pool_connections)
+
+        # sessions are not thread safe, so clients are only built under
+        # the lock
+        client = session.client('s3', endpoint_url=endpoint_url,
+                                config=_config(max_pool_connections))
+        _CLIENTS[key] = client
+
+        return client
+
+
+def reset():
+    """
+    Forgets every shared session and client, e.g. after credentials
+    have been rotated.
+    """
+    with _LOCK:
+        _SESSIONS.clear()
+        _CLIENTS.clear()
@@ -0,0 +1,321 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+dedup.py - a content-defined chunk store for backup files.
+
+Files are split into content-defined chunks: whether a chunk ends at a
+position depends only on the bytes just before it, so an insertion or
+change only moves the boundaries close to it and the rest of the file
+produces the same chunks as the night before.  A boundary may only fall
+after one of a few marker byte values, which a compiled regular
+expression finds at C speed; a CRC-32 of the WINDOW bytes before each
+marker then decides, with FastCDC style normalization around the
+average chunk size.  This keeps the per-byte work out of Python.
+Each chunk is stored once, under CHUNK_PREFIX and the SHA-256 of its
+content, and chunks the bucket already holds are not sent again.  A
+small JSON manifest under MANIFEST_PREFIX lists the chunks that make up
+each file, and restore() reassembles a file from it.  Both prefixes
+are under NAMESPACE, which starts with a '.' so that it can't collide
+with the keys of files synced from a tree and is left out of downloads
+like any other hidden key.
+
+The bucket index upload() is given can be hours old, so a chunk it
+lists may have been deleted since.  Such chunks are checked with a
+HEAD request, which costs far less than sending the chunk, and are
+sent again if they are gone; a manifest never refers to a chunk that
+was missing when it was written.
+
+usage:
+
+    upload(client, 'bucket', '/backups/db.bak', 'db.bak', known_keys)
+    restore(client, 'bucket', manifest_key('db.bak'), '/restore/db.bak')
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import botocore.exceptions
+import retry
+
+
+NAMESPACE = '.s3upload/'
+CHUNK_PREFIX = NAMESPACE + 'chunks/'
+MANIFEST_PREFIX = NAMESPACE + 'manifests/'
+MANIFEST_FORMAT = 's3upload-dedup/1'
+
+MIN_CHUNK = 256 * 1024
+AVG_CHUNK = 1024 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+
+# chunk uploads or downloads queued per worker
+BACKLOG = 4
+
+# bytes hashed before a marker to decide on a boundary
+WINDOW = 48
+
+# 8 of the 256 byte values, avoiding the usual fill bytes 0x00, 0x20 and
+# 0xff; one position in 32 of random data is a candidate boundary
+_MARKERS = bytes([0x1d, 0x3b, 0x59, 0x77, 0x95, 0xb3, 0xd1, 0xef])
+_CANDIDATE = re.compile(b'[' + re.escape(_MARKERS) + b']')
+
+
+def _masks(avg_size):
+    """
+    Returns the strict and loose CRC masks used before and after
+    avg_size, allowing for only one position in 32 being a candidate.
+    """
+    bits = max(avg_size.bit_length() - 1 - 5, 3)
+    return (1 << (bits + 2)) - 1, (1 << (bits - 2)) - 1
+
+
+def _find_cut(data, start, end, mask):
+    for match in _CANDIDATE.finditer(data, start, end):
+        position = match.end()
+        if not zlib.crc32(data[position - WINDOW:position]) & mask:
+            return position
+    return None
+
+
+def _cut_point(data, min_size, avg_size, max_size):
+    """
+    Returns the length of the first chunk of data.
+    """
+    length = len(data)
+    if length <= min_size:
+        return length
+
+    end = min(length, max_size)
+    normal = min(avg_size, end)
+    mask_strict, mask_loose = _masks(avg_size)
+
+    cut = _find_cut(data, max(min_size, WINDOW) - 1, normal - 1, mask_strict)
+    if cut is None:
+        cut = _find_cut(data, normal - 1, end - 1, mask_loose)
+
+    return end if cut is None else cut
+
+
+def chunks(source, min_size=MIN_CHUNK, avg_size=AVG_CHUNK, max_size=MAX_CHUNK):
+    """
+    Yields (offset, data) for the content-defined chunks of an open
+    binary file.
+    """
+    buffer = bytearray()
+    offset = 0
+    finished = False
+
+    while True:
+        while not finished and len(buffer) < max_size:
+            block = source.read(READ_SIZE)
+            if block:
+                buffer += block
+            else:
+                finished = True
+
+        if not buffer:
+            return
+
+        cut = _cut_point(buffer, min_size, avg_size, max_size)
+        data = bytes(buffer[:cut])
+        del buffer[:cut]
+
+        yield offset, data
+        offset += cut
+
+
+def chunk_key(digest):
+    """
+    Returns the object key of the chunk with the given SHA-256 hex digest.
+    """
+    return CHUNK_PREFIX + digest
+
+
+def manifest_key(s3_name):
+    """
+    Returns the object key of the manifest for s3_name.
+    """
+    return MANIFEST_PREFIX + s3_name
+
+
+def remote_files(objectindex):
+    """
+    Maps a bucket's {key: RemoteObject} index to {file name: RemoteObject}
+    of the manifests in it, leaving out the chunks.
+    """
+    return {key[len(MANIFEST_PREFIX):]: entry
+            for key, entry in (objectindex or {}).items()
+            if key.startswith(MANIFEST_PREFIX)}
+
+
+def _bounded(pool, function, items, workers):
+    """
+    Runs function over items on pool with at most workers * BACKLOG
+    calls queued, raising the first error.
+    """
+    futures = set()
+
+    for item in items:
+        if len(futures) >= workers * BACKLOG:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+        futures.add(pool.submit(function, item))
+
+    for future in wait(futures).done:
+        future.result()
+
+
+def upload(client, bucket_name, file_object, s3_name, known_keys=(),
+           workers=8, on_stored=None, attempts=None):
+    """
+    Stores file_object as chunks plus a manifest named after s3_name.
+
+    known_keys is a container of keys already in the bucket (such as
+    S3Bucket.objectindex); chunks found there are only sent if a HEAD
+    request shows they have been deleted since.  on_stored,
+    if given, is called with (key, size, etag) for every object written.
+    With attempts (see retry.py) each chunk is retried on its own.
+
+    returns a dictionary with the manifest key and the number of chunks
+    and bytes that were sent or skipped.
+    """
+    lock = threading.Lock()
+    claimed = set()
+    manifest = []
+    stats = {'chunks_sent': 0, 'bytes_sent': 0,
+             'chunks_skipped': 0, 'bytes_skipped': 0}
+
+    def _pending(source):
+        for _, data in chunks(source):
+            digest = hashlib.sha256(data).hexdigest()
+            key = chunk_key(digest)
+            manifest.append([digest, len(data)])
+
+            with lock:
+                skip = key in claimed
+                claimed.add(key)
+
+            if skip:
+                with lock:
+                    stats['chunks_skipped'] += 1
+                    stats['bytes_skipped'] += len(data)
+            else:
+                yield key, data
+
+    def _stored(key):
+        try:
+            retry.call(attempts, client.head_object, Bucket=bucket_name,
+                       Key=key)
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] in ('404', 'NoSuchKey',
+                                                   'NotFound'):
+                return False
+            raise
+        return True
+
+    def _store(item):
+        key, data = item
+
+        if key in known_keys and _stored(key):
+            with lock:
+                stats['chunks_skipped'] += 1
+                stats['bytes_skipped'] += len(data)
+            return
+
+        response = retry.call(attempts, client.put_object, Bucket=bucket_name,
+                              Key=key, Body=data)
+
+        with lock:
+            stats['chunks_sent'] += 1
+            stats['bytes_sent'] += len(data)
+
+        if on_stored is not None:
+            on_stored(key, len(data), response.get('ETag'))
+
+    size = os.path.getsize(file_object)
+
+    with open(file_object, 'rb') as source:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            _bounded(pool, _store, _pending(source), workers)
+
+    body = json.dumps({'format': MANIFEST_FORMAT, 'size': size,
+                       'chunks': manifest}, separators=(',', ':')).encode()
+    key = manifest_key(s3_name)
+    response = retry.call(attempts, client.put_object, Bucket=bucket_name,
+                          Key=key, Body=body, ContentType='application/json')
+
+    if on_stored is not None:
+        on_stored(key, len(body), response.get('ETag'))
+
+    stats['manifest'] = key
+    return stats
+
+
+def _write_at(output, lock, offset, data):
+    if hasattr(os, 'pwrite'):
+        os.pwrite(output.fileno(), data, offset)
+    else:
+        with lock:
+            output.seek(offset)
+            output.write(data)
+
+
+def restore(client, bucket_name, key, local_path, workers=8, attempts=None):
+    """
+    Rebuilds a file from the manifest stored at key, fetching its chunks
+    concurrently and writing each at its offset.  Every chunk is checked
+    against its hash.  The file is assembled under a temporary name and
+    moved into place once complete.  With attempts (see retry.py) each
+    chunk is retried on its own.
+    """
+    def _read(object_key):
+        body = client.get_object(Bucket=bucket_name, Key=object_key)['Body']
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    manifest = json.loads(retry.call(attempts, _read, key).decode())
+
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ValueError("{0} is not a dedup manifest".format(key))
+
+    pieces = []
+    offset = 0
+    for digest, length in manifest['chunks']:
+        pieces.append((offset, digest, length))
+        offset += length
+
+    partial = local_path + '.part'
+    lock = threading.Lock()
+
+    def _fetch(piece):
+        start, digest, length = piece
+        data = retry.call(attempts, _read, chunk_key(digest))
+
+        if len(data) != length or hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError("chunk {0} is corrupt".format(digest))
+
+        _write_at(output, lock, start, data)
+
+    try:
+        with open(partial, 'wb') as output:
+            output.truncate(manifest['size'])
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                _bounded(pool, _fetch, pieces, workers)
+
+        os.replace(partial, local_path)
+
+    except Exception:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+listing.py - lists a bucket with several ListObjectsV2 requests in
+flight at once.
+
+ListObjectsV2 returns at most 1,000 keys per call, so one sequential
+walk of a multi-million-key bucket is thousands of round trips in a
+row.  parallel_list splits the keyspace on the delimiter: the objects
+at the top level plus everything under each common prefix is exactly
+the whole bucket, so listing those prefixes concurrently and merging
+the pages gives the same index as a sequential listing.
+
+usage:
+
+    index = parallel_list(client, 'mybucket', workers=16)
+    index = parallel_list(client, 'mybucket', prefixes=['2024/', '2025/'])
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from syncplan import RemoteObject
+
+
+# how many delimiter levels are split when there are fewer shards than
+# workers
+MAX_SHARD_DEPTH = 3
+
+
+def _entry(item):
+    return RemoteObject(item['Key'], item['Size'], item.get('ETag'),
+                        item.get('LastModified'))
+
+
+def list_prefix(client, bucket_name, prefix='', delimiter=None):
+    """
+    Lists every object under prefix.
+
+    With a delimiter, only the objects directly under prefix are
+    returned, along with the common prefixes below it.
+
+    returns ({key: RemoteObject}, [common prefixes])
+    """
+    index = {}
+    prefixes = []
+    arguments = {'Bucket': bucket_name, 'Prefix': prefix}
+
+    if delimiter:
+        arguments['Delimiter'] = delimiter
+
+    paginator = client.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(**arguments):
+        for item in page.get('Contents', ()):
+            index[item['Key']] = _entry(item)
+
+        for common in page.get('CommonPrefixes', ()):
+            prefixes.append(common['Prefix'])
+
+    return index, prefixes
+
+
+def _minimal_prefixes(prefixes):
+    """
+    Drops duplicate prefixes and any prefix already covered by a
+    shorter one, so no key is listed twice.
+    """
+    minimal = []
+
+    for prefix in sorted(set(prefixes)):
+        if not minimal or not prefix.startswith(minimal[-1]):
+            minimal.append(prefix)
+
+    return minimal
+
+
+def shard(client, bucket_name, pool, workers, delimiter='/'):
+    """
+    Splits the bucket into prefix shards on delimiter, going up to
+    MAX_SHARD_DEPTH levels deep while there are fewer shards than
+    workers.
+
+    returns ({key: RemoteObject} of the objects outside every shard,
+             [shard prefixes])
+    """
+    index, shards = list_prefix(client, bucket_name, '', delimiter)
+    depth = 1
+
+    while shards and len(shards) < workers and depth < MAX_SHARD_DEPTH:
+        deeper = []
+
+        for found, prefixes in pool.map(
+                lambda prefix: list_prefix(client, bucket_name, prefix,
+                                           delimiter), shards):
+            index.update(found)
+            deeper.extend(prefixes)
+
+        if not deeper:
+            # nothing below this level is nested any further; the
+            # objects listed on the way down are the whole bucket
+            return index, []
+
+        shards = deeper
+        depth += 1
+
+    return index, shards
+
+
+def parallel_list(client, bucket_name, prefixes=None, workers=8,
+                  delimiter='/'):
+    """
+    Lists a bucket with up to workers concurrent requests.
+
+    Without prefixes the keyspace is sharded on delimiter and the result
+    is the whole bucket, the same as a sequential listing.  With
+    prefixes only the objects under those prefixes are listed, each
+    prefix as its own shard.
+
+    returns {key: RemoteObject}
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if prefixes is None:
+            index, shards = shard(client, bucket_name, pool, workers, delimiter)
+        else:
+            index, shards = {}, _minimal_prefixes(prefixes)
+
+        for found, _ in pool.map(
+                lambda prefix: list_prefix(client, bucket_name, prefix),
+                shards):
+            index.update(found)
+
+    return index
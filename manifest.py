@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+manifest.py - a persistent local copy of a bucket's key index.
+
+The manifest is an SQLite database per bucket in a cache directory,
+holding the key, size, ETag and LastModified of every object.  S3Bucket
+keeps it up to date with its own uploads and deletes, so a new run can
+load the index from disk instead of listing the whole bucket.  A full
+listing is only needed to reconcile changes made by other writers, on
+demand or once the manifest is older than its reconcile interval.
+
+usage:
+
+    cache = Manifest('mybucket', reconcile_interval=3600)
+    if cache.is_stale():
+        cache.replace(listed_index)
+    index = cache.load()
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from syncplan import RemoteObject, to_timestamp
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.s3upload', 'cache')
+
+# seconds between full listings of the bucket
+RECONCILE_INTERVAL = 6 * 60 * 60
+
+
+class Manifest(object):
+    """
+    The cached key index of one bucket.
+
+    usage:
+
+        Manifest('bucket name', cache_dir='/var/cache/s3upload',
+                 reconcile_interval=3600)
+
+    reconcile_interval is the age in seconds after which is_stale()
+    reports that the bucket should be listed again; None never expires.
+    """
+    def __init__(self, bucket_name, cache_dir=DEFAULT_CACHE_DIR,
+                 reconcile_interval=RECONCILE_INTERVAL):
+
+        self.bucket_name = bucket_name
+        self.reconcile_interval = reconcile_interval
+        self.path = os.path.join(cache_dir, '{0}.sqlite'.format(bucket_name))
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS objects ('
+                             'key TEXT PRIMARY KEY, size INTEGER, '
+                             'etag TEXT, last_modified REAL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                             'name TEXT PRIMARY KEY, value REAL)')
+
+    @property
+    def reconciled(self):
+        """
+        When the manifest was last rebuilt from a full listing, as a
+        POSIX timestamp, or None if it never has been.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta "
+                                   "WHERE name = 'reconciled'").fetchone()
+        return row[0] if row else None
+
+    def is_stale(self):
+        """
+        Returns True if the bucket has never been listed into this
+        manifest or the last listing is older than reconcile_interval.
+        """
+        reconciled = self.reconciled
+
+        if reconciled is None:
+            return True
+        if self.reconcile_interval is None:
+            return False
+        return time.time() - reconciled > self.reconcile_interval
+
+    def load(self):
+        """
+        Returns the cached index as {key: RemoteObject}.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT key, size, etag, last_modified '
+                                    'FROM objects').fetchall()
+
+        return {key: RemoteObject(key, size, etag, None if modified is None
+                                  else datetime.fromtimestamp(modified,
+                                                              timezone.utc))
+                for key, size, etag, modified in rows}
+
+    def replace(self, index):
+        """
+        Replaces the cached index with a full listing and marks the
+        manifest as reconciled.
+        """
+        rows = [(entry.key, entry.size, entry.etag,
+                 to_timestamp(entry.last_modified)) for entry in index.values()]
+
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM objects')
+            self._db.executemany('INSERT INTO objects VALUES (?, ?, ?, ?)', rows)
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES "
+                             "('reconciled', ?)", (time.time(),))
+
+    def put(self, entry):
+        """
+        Records a RemoteObject written by this tool.
+        """
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)',
+                             (entry.key, entry.size, entry.etag,
+                              to_timestamp(entry.last_modified)))
+
+    def remove(self, key):
+        """
+        Drops a key deleted by this tool.
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM objects WHERE key = ?', (key,))
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        with self._lock:
+            self._db.close()
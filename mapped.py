@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+mapped.py - reads the parts of a file for upload without copying them.
+
+MappedFile maps a file into memory and hands out memoryview slices of
+the mapping.  The kernel pages the data in straight from the page
+cache, and the slices are hashed and written to the socket from there,
+where file.read() would first copy every part into a new bytes object
+(and the boto3 transfer manager into further buffers after that).
+Once a part has been sent, release() tells the kernel its pages are no
+longer needed, so a long upload doesn't carry the part of the file it
+has already sent in its resident set.
+
+A mapped file must not be truncated while it is being read: touching a
+page past its new end kills the process with SIGBUS - and with it every
+job in a daemon - instead of raising an error.  A backup tool rewriting
+a file in place (SQL Server's BACKUP ... WITH INIT, logrotate's
+copytruncate) does just that, and a file that was quiet for a while can
+still be rewritten hours into its upload.  So mapping is opt-in: files
+are read by a PartReader, with pread, which returns short reads instead
+of faulting and raises OSError for them, unless the caller asks for a
+mapping with stable=True (S3Bucket only does with mmap=True, for files
+watch.py found quiet).  Even then the file is only mapped if its size
+and mtime are still the ones the caller recorded, and a MappedFile
+checks them again before every part, reading the part with pread if
+they have changed.  That narrows the window to the time a part takes
+to send; it does not close it.
+
+Where a file can't be mapped - an empty file, or a file system without
+mmap support - open_parts falls back to a PartReader too.
+
+usage:
+
+    with open_parts('/backups/db.bak', True, (size, mtime)) as parts:
+        view = parts.part(offset, length)
+        client.upload_part(..., Body=PartBody(view))
+        parts.release(offset, length)
+"""
+
+import io
+import mmap
+import os
+import threading
+
+
+class PartReader(object):
+    """
+    Reads byte ranges of a file into memory.
+
+    usage:
+
+        with PartReader('file') as parts:
+            parts.part(offset, length)
+    """
+    def __init__(self, path):
+
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def part(self, offset, length):
+        """
+        Returns a memoryview of length bytes from offset.
+
+        Raises OSError if the file has been truncated since it was
+        opened.
+        """
+        if hasattr(os, 'pread'):
+            data = os.pread(self._file.fileno(), length, offset)
+        else:
+            with self._lock:
+                self._file.seek(offset)
+                data = self._file.read(length)
+
+        if len(data) != length:
+            raise OSError("{0} shrank while it was being read".format(
+                self._file.name))
+
+        return memoryview(data)
+
+    def release(self, offset, length):
+        """
+        Marks a range as no longer needed.
+        """
+
+    def close(self):
+        self._file.close()
+
+
+class MappedFile(PartReader):
+    """
+    Hands out byte ranges of a file as memoryviews of a read-only
+    mapping of it, or reads them with pread once the file's size or
+    mtime has changed since it was mapped.
+
+    Raises OSError or ValueError if the file can't be mapped.
+    """
+    def __init__(self, path):
+
+        super(MappedFile, self).__init__(path)
+        self.stat = self._stat()
+
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+
+        self._view = memoryview(self._map)
+
+    def _stat(self):
+        stat = os.fstat(self._file.fileno())
+        return stat.st_size, stat.st_mtime
+
+    def part(self, offset, length):
+        if self._stat() != self.stat:
+            # touching a page the file no longer has would be SIGBUS
+            return super(MappedFile, self).part(offset, length)
+
+        return self._view[offset:offset + length]
+
+    def release(self, offset, length):
+        """
+        Drops a range that has been sent from the resident set; it is
+        paged in again from the file if it is read again.
+        """
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+
+        start = offset - offset % mmap.PAGESIZE
+        end = min(offset + length, self.size)
+        if end > start:
+            self._map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def close(self):
+        self._view.release()
+
+        try:
+            self._map.close()
+        except BufferError:
+            # a part is still referenced somewhere; the mapping is
+            # closed when the last one goes away
+            pass
+
+        self._file.close()
+
+
+def open_parts(path, stable=False, expected=None):
+    """
+    Returns a MappedFile for path if stable is True, the file can be
+    mapped and, given expected, its (size, mtime) still match it;
+    otherwise a PartReader.
+    """
+    if not stable:
+        return PartReader(path)
+
+    try:
+        parts = MappedFile(path)
+    except (OSError, ValueError):
+        return PartReader(path)
+
+    if expected is not None and parts.stat != tuple(expected):
+        parts.close()
+        return PartReader(path)
+
+    return parts
+
+
+class PartBody(io.RawIOBase):
+    """
+    A read-only, seekable file object over a memoryview, for use as a
+    request Body.  read() returns slices of the view, so the data is
+    not copied on its way to the socket.
+    """
+    def __init__(self, view):
+
+        super(PartBody, self).__init__()
+        self._view = view
+        self._position = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+
+        data = self._view[self._position:end]
+        self._position = max(self._position, end)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+
+        if offset < 0:
+            raise ValueError("negative seek position {0}".format(offset))
+
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
@@ -0,0 +1,367 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+metrics.py - sends transfer metrics to StatsD / DogStatsD or to a
+Prometheus textfile.
+
+S3Bucket reports every transfer it runs in a batch - its bytes,
+duration, throughput, retries and error code - and a summary of each
+batch; the scheduler reports whether each job left its bucket up to
+date.  They all go through an emitter:
+
+- StatsdEmitter sends UDP datagrams to a StatsD server, or with
+  dogstatsd=True to a Datadog agent, with the tags Datadog understands;
+- PrometheusEmitter keeps totals in memory and rewrites a file for the
+  node_exporter textfile collector every FLUSH_INTERVAL seconds.
+
+emit() never waits on the network or the disk.  The StatsD emitter
+queues metrics for a background thread that packs them into datagrams,
+dropping them (and counting them in dropped) if the queue is full; the
+Prometheus emitter only updates a dictionary.  Tag values should be
+few - bucket names, operations, error codes - not object keys.
+
+usage:
+
+    emitter = StatsdEmitter('127.0.0.1', 8125, dogstatsd=True)
+    emitter.emit('transfer.bytes', 1024, 'count', {'bucket': 'backups'})
+    emitter.close()
+"""
+
+import os
+import queue
+import socket
+import threading
+
+
+PREFIX = 's3upload'
+
+# metrics a StatsdEmitter holds while its sender catches up
+QUEUE_SIZE = 10000
+
+# the largest datagram sent; fits an Ethernet MTU after the headers
+MAX_PACKET = 1432
+
+# seconds between rewrites of a Prometheus textfile
+FLUSH_INTERVAL = 10.0
+
+KINDS = ('count', 'gauge', 'timing', 'histogram')
+
+_STATSD_TYPES = {'count': 'c', 'gauge': 'g', 'timing': 'ms', 'histogram': 'h'}
+
+
+class Emitter(object):
+    """
+    Where metrics go.  Subclasses implement emit().
+
+    kind is one of KINDS: a count is added up, a gauge replaces the
+    last value, and timings (in milliseconds) and histograms are
+    distributions.  tags is a dictionary of names and values.
+    """
+    def emit(self, name, value, kind='count', tags=None):
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Sends whatever has been emitted so far.
+        """
+
+    def close(self):
+        self.flush()
+
+
+class Emitters(Emitter):
+    """
+    Sends every metric to several emitters.
+    """
+    def __init__(self, emitters):
+
+        self.emitters = list(emitters)
+
+    def emit(self, name, value, kind='count', tags=None):
+        for emitter in self.emitters:
+            emitter.emit(name, value, kind, tags)
+
+    def flush(self):
+        for emitter in self.emitters:
+            emitter.flush()
+
+    def close(self):
+        for emitter in self.emitters:
+            emitter.close()
+
+
+class StatsdEmitter(Emitter):
+    """
+    Sends metrics to a StatsD server over UDP.
+
+    usage:
+
+        StatsdEmitter(host='127.0.0.1', port=8125, dogstatsd=True)
+
+    With dogstatsd=True tags are sent in the DogStatsD format and
+    histograms as histograms; plain StatsD gets no tags, and histograms
+    as timings.
+    """
+    def __init__(self, host='127.0.0.1', port=8125, prefix=PREFIX,
+                 dogstatsd=False, queue_size=QUEUE_SIZE,
+                 max_packet=MAX_PACKET):
+
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.dogstatsd = dogstatsd
+        self.max_packet = max_packet
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._sender = threading.Thread(target=self._send,
+                                        name='statsd-sender', daemon=True)
+        self._sender.start()
+
+    def emit(self, name, value, kind='count', tags=None):
+        try:
+            self._queue.put_nowait((name, value, kind, tags))
+        except queue.Full:
+            self.dropped += 1
+
+    def _line(self, name, value, kind, tags):
+        statsd_type = _STATSD_TYPES[kind]
+        if statsd_type == 'h' and not self.dogstatsd:
+            statsd_type = 'ms'
+
+        line = '{0}.{1}:{2}|{3}'.format(self.prefix, name, value, statsd_type)
+
+        if tags and self.dogstatsd:
+            line += '|#' + ','.join('{0}:{1}'.format(tag, tags[tag])
+                                    for tag in sorted(tags))
+
+        return line.encode('utf-8')
+
+    def _send(self):
+        """
+        Packs queued metrics into datagrams until close() is called.
+        """
+        finished = False
+
+        while not finished:
+            item = self._queue.get()
+            taken = 1
+            packet = b''
+
+            while True:
+                if item is None:
+                    finished = True
+                else:
+                    line = self._line(*item)
+                    if packet and len(packet) + 1 + len(line) > self.max_packet:
+                        self._sendto(packet)
+                        packet = b''
+                    packet = packet + b'\n' + line if packet else line
+
+                if finished:
+                    break
+
+                try:
+                    item = self._queue.get_nowait()
+                    taken += 1
+                except queue.Empty:
+                    break
+
+            if packet:
+                self._sendto(packet)
+
+            for _ in range(taken):
+                self._queue.task_done()
+
+    def _sendto(self, packet):
+        try:
+            self._socket.sendto(packet, self.address)
+        except OSError:
+            # a full socket buffer or nobody listening; metrics are
+            # not worth slowing a transfer down for
+            self.dropped += packet.count(b'\n') + 1
+
+    def flush(self):
+        """
+        Waits until every metric emitted so far has been sent.
+        """
+        if self._sender.is_alive():
+            self._queue.join()
+
+    def close(self):
+        if self._sender.is_alive():
+            self._queue.put(None)
+            self._sender.join()
+        self._socket.close()
+
+
+def _metric_name(prefix, name):
+    return '{0}_{1}'.format(prefix, name).replace('.', '_').replace('-', '_')
+
+
+def _labels(tags):
+    if not tags:
+        return ''
+
+    return '{' + ','.join('{0}="{1}"'.format(
+        tag, str(tags[tag]).replace('\\', '\\\\').replace('"', '\\"'))
+        for tag in sorted(tags)) + '}'
+
+
+class PrometheusEmitter(Emitter):
+    """
+    Keeps metrics in memory and writes them to path in the Prometheus
+    text format, for node_exporter's textfile collector.
+
+    usage:
+
+        PrometheusEmitter('/var/lib/node_exporter/s3upload.prom')
+
+    Counts become counters (name_total), gauges gauges, and timings and
+    histograms summaries (name_sum and name_count).  The file is
+    replaced atomically every interval seconds and on flush().
+    """
+    def __init__(self, path, prefix=PREFIX, interval=FLUSH_INTERVAL):
+
+        self.path = path
+        self.prefix = prefix
+        self._values = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_every,
+                                        args=(interval,),
+                                        name='prometheus-writer', daemon=True)
+        self._writer.start()
+
+    def emit(self, name, value, kind='count', tags=None):
+        labels = _labels(tags)
+        metric = _metric_name(self.prefix, name)
+
+        with self._lock:
+            if kind == 'count':
+                key = (metric + '_total', 'counter', labels)
+                self._values[key] = self._values.get(key, 0) + value
+            elif kind == 'gauge':
+                self._values[(metric, 'gauge', labels)] = value
+            else:
+                total = (metric + '_sum', 'summary', labels)
+                count = (metric + '_count', 'summary', labels)
+                self._values[total] = self._values.get(total, 0) + value
+                self._values[count] = self._values.get(count, 0) + 1
+
+    def _render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+
+        lines = []
+        typed = set()
+
+        for (metric, metric_type, labels), value in values:
+            family = metric
+            for suffix in ('_total', '_sum', '_count'):
+                if metric_type != 'gauge' and family.endswith(suffix):
+                    family = family[:-len(suffix)]
+                    break
+
+            if family not in typed:
+                typed.add(family)
+                lines.append('# TYPE {0} {1}'.format(family, metric_type))
+
+            lines.append('{0}{1} {2}'.format(metric, labels, round(value, 6)))
+
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        """
+        Rewrites the textfile with the current values.
+        """
+        text = self._render()
+        partial = self.path + '.part'
+
+        with self._write_lock:
+            with open(partial, 'w') as output:
+                output.write(text)
+            os.replace(partial, self.path)
+
+    def _write_every(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def close(self):
+        self._stop.set()
+        self._writer.join()
+        self.flush()
+
+
+def from_config(config):
+    """
+    Returns the emitter configured in an admin.Config - statsd_host
+    (and statsd_port, dogstatsd) and/or prometheus_file - or None.
+    """
+    emitters = []
+
+    if getattr(config, 'statsd_host', None):
+        emitters.append(StatsdEmitter(
+            config.statsd_host, int(config.statsd_port or 8125),
+            dogstatsd=str(config.dogstatsd).lower() in ('1', 'true', 'yes')))
+
+    if getattr(config, 'prometheus_file', None):
+        emitters.append(PrometheusEmitter(config.prometheus_file))
+
+    if not emitters:
+        return None
+    if len(emitters) == 1:
+        return emitters[0]
+    return Emitters(emitters)
+
+
+def error_tag(error):
+    """
+    Returns the tag value of a TransferResult error: its error code, or
+    the name of the exception.
+    """
+    if isinstance(error, (int, str)):
+        return str(error)
+    return type(error).__name__
+
+
+def record_transfer(emitter, tags, result, seconds, size):
+    """
+    Emits the metrics of one transfer.  result is its TransferResult,
+    size the bytes it moved.
+    """
+    tags = dict(tags, status='ok' if result else 'failed')
+
+    emitter.emit('transfer.count', 1, 'count', tags)
+    emitter.emit('transfer.duration', round(seconds * 1000, 3), 'timing', tags)
+
+    if size:
+        emitter.emit('transfer.bytes', size, 'count', tags)
+        if seconds > 0:
+            emitter.emit('transfer.throughput', round(size / seconds),
+                         'histogram', tags)
+
+    if result.retries:
+        emitter.emit('transfer.retries', result.retries, 'count', tags)
+
+    if not result:
+        emitter.emit('transfer.errors', 1, 'count',
+                     dict(tags, error=error_tag(result.error)))
+
+
+def record_batch(emitter, tags, results, seconds, size):
+    """
+    Emits the totals of a batch of transfers.
+    """
+    failed = sum(1 for name in results if not results[name])
+
+    emitter.emit('batch.files', len(results), 'count', tags)
+    emitter.emit('batch.failed', failed, 'count', tags)
+    emitter.emit('batch.bytes', size, 'count', tags)
+    emitter.emit('batch.duration', round(seconds * 1000, 3), 'timing', tags)
+    if seconds > 0:
+        emitter.emit('batch.throughput', round(size / seconds), 'gauge', tags)
@@ -0,0 +1,315 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+profiling.py - shows where a sync run spends its time.
+
+The slow parts of a run are marked as phases - scanning the local tree
+(scan, listdirectory), listing the bucket (get_objects), comparing the
+two (diff, filelist_diff, plan) and the transfers themselves - and
+while a Profiler is running each phase is timed with perf_counter.
+Phases run concurrently on many threads, so their totals are summed
+thread time and can add up to more than the run took.
+
+On top of that a Profiler can run
+
+- cProfile, on every thread, for exact call counts and times; or
+- a sampling profiler, which looks at every thread's stack every
+  SAMPLE_INTERVAL seconds and costs far less on a busy run.
+
+With no Profiler running, phase() returns a shared no-op context and
+timed() the iterable it was given, so the markers cost a function call.
+
+usage:
+
+    profiler = Profiler('sample')
+    profiler.start()
+    with phase('get_objects'):
+        bucket.get_objects()
+    profiler.stop()
+    print(profiler.summary())
+    profiler.dump('s3upload-profile')
+"""
+
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+MODES = ('phases', 'cprofile', 'sample')
+
+# seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# functions listed in the summary of a cProfile run
+TOP_FUNCTIONS = 25
+
+# the running Profiler, if any
+_active = None
+
+
+class _NoPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _Phase(object):
+
+    def __init__(self, profiler, name):
+
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def phase(name):
+    """
+    Returns a context manager timing the code in it as phase name.
+    """
+    profiler = _active
+    if profiler is None:
+        return _NO_PHASE
+    return profiler.phase(name)
+
+
+def add(name, seconds):
+    """
+    Adds a run of phase name timed by the caller.
+    """
+    profiler = _active
+    if profiler is not None:
+        profiler.add(name, seconds)
+
+
+def timed(name, iterable):
+    """
+    Returns iterable with the time spent producing its items timed as
+    phase name, for generators such as scanner.scan.
+    """
+    profiler = _active
+    if profiler is None:
+        return iterable
+    return profiler.timed(name, iterable)
+
+
+class Profiler(object):
+    """
+    Times the phases of a run, and profiles it if mode is 'cprofile' or
+    'sample'.
+
+    usage:
+
+        profiler = Profiler('cprofile')
+        profiler.start()
+        ...
+        profiler.stop()
+    """
+    def __init__(self, mode='phases', sample_interval=SAMPLE_INTERVAL):
+
+        if mode not in MODES:
+            raise ValueError("unknown profiling mode {0!r}".format(mode))
+
+        self.mode = mode
+        self.sample_interval = sample_interval
+        self.phases = {}
+        self.seconds = None
+        self._started = None
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._samples = Counter()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def add(self, name, seconds, calls=1):
+        """
+        Adds calls runs taking seconds in all to phase name.
+        """
+        with self._lock:
+            entry = self.phases.setdefault(name, [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+
+    def timed(self, name, iterable):
+        seconds = 0.0
+        iterator = iter(iterable)
+
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+
+                yield item
+        finally:
+            self.add(name, seconds)
+
+    def start(self):
+        """
+        Makes this the running Profiler.
+        """
+        global _active
+
+        if self.mode == 'cprofile':
+            if sys.version_info < (3, 12):
+                # before 3.12 cProfile only sees the thread that enabled
+                # it, so every new thread starts a profile of its own
+                threading.setprofile(self._profile_thread)
+            self._profile_thread()
+
+        elif self.mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample,
+                                             name='profiling-sampler',
+                                             daemon=True)
+            self._sampler.start()
+
+        self._started = time.perf_counter()
+        _active = self
+
+    def stop(self):
+        """
+        Stops timing and profiling.
+        """
+        global _active
+
+        _active = None
+        self.seconds = time.perf_counter() - self._started
+
+        if self.mode == 'cprofile':
+            threading.setprofile(None)
+            for profile in self._profiles:
+                profile.disable()
+
+        elif self.mode == 'sample':
+            self._stop.set()
+            self._sampler.join()
+
+    def _profile_thread(self, *_):
+        import cProfile
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler holds this interpreter
+            return
+
+        with self._lock:
+            self._profiles.append(profile)
+
+    def _sample(self):
+        sampler = threading.get_ident()
+
+        while not self._stop.wait(self.sample_interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{0} ({1}:{2})'.format(
+                        code.co_name, os.path.basename(code.co_filename),
+                        code.co_firstlineno))
+                    frame = frame.f_back
+
+                self._samples[';'.join(reversed(stack))] += 1
+
+    def _stats(self):
+        import pstats
+
+        stream = io.StringIO()
+        stats = pstats.Stats(*self._profiles, stream=stream)
+        return stats, stream
+
+    def summary(self):
+        """
+        Returns a table of the phases, and of the top functions of a
+        cProfile run or the top frames of a sampled one.
+        """
+        lines = ["{0:24} {1:>9} {2:>11} {3:>10} {4:>7}".format(
+            'phase', 'calls', 'seconds', 'mean ms', 'of run')]
+
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: -item[1][1])
+
+        for name, (calls, seconds) in phases:
+            lines.append("{0:24} {1:>9} {2:>11.3f} {3:>10.3f} {4:>6.0f}%".format(
+                name, calls, seconds, seconds / calls * 1000 if calls else 0,
+                seconds / self.seconds * 100 if self.seconds else 0))
+
+        lines.append("{0:24} {1:>9} {2:>11.3f}".format('run', 1,
+                                                       self.seconds or 0))
+
+        if self.mode == 'cprofile' and self._profiles:
+            stats, stream = self._stats()
+            stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            lines.append(stream.getvalue())
+
+        elif self.mode == 'sample' and self._samples:
+            total = sum(self._samples.values())
+            frames = Counter()
+            for stack, count in self._samples.items():
+                frames[stack.rsplit(';', 1)[-1]] += count
+
+            lines.append("\n{0:>7}  innermost frame ({1} samples)".format(
+                'share', total))
+            for frame, count in frames.most_common(TOP_FUNCTIONS):
+                lines.append("{0:>6.1f}%  {1}".format(count * 100.0 / total,
+                                                      frame))
+
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        """
+        Writes the phase timings to path.json, and the cProfile stats to
+        path.prof (for pstats or snakeviz) or the samples to path.folded
+        (collapsed stacks, for flamegraph.pl or speedscope).
+
+        returns the files written.
+        """
+        with self._lock:
+            phases = {name: {'calls': calls, 'seconds': round(seconds, 6)}
+                      for name, (calls, seconds) in self.phases.items()}
+
+        written = [path + '.json']
+        with open(written[0], 'w') as output:
+            json.dump({'mode': self.mode, 'seconds': self.seconds,
+                       'phases': phases}, output, indent=2)
+
+        if self.mode == 'cprofile' and self._profiles:
+            written.append(path + '.prof')
+            self._stats()[0].dump_stats(written[-1])
+
+        elif self.mode == 'sample':
+            written.append(path + '.folded')
+            with open(written[-1], 'w') as output:
+                for stack, count in self._samples.most_common():
+                    output.write('{0} {1}\n'.format(stack, count))
+
+        return written
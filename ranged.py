@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+ranged.py - downloads large objects as concurrent byte-range GETs.
+
+The local file is preallocated at its final size under a temporary
+name and every range is written straight to its offset, so parts can
+arrive in any order and nothing is copied through a spooling file.  As
+each part lands it is recorded in a journal (see resumable.py); a
+restore that is interrupted carries on with the parts that are still
+missing, as long as the object's ETag has not changed.  Ranges are
+requested with If-Match on that ETag, so an object replaced mid-restore
+fails the download instead of producing a mix of two versions.
+
+usage:
+
+    RangedDownload(client, 'mybucket', 'db.bak', '/restore/db.bak',
+                   part_size=64 * 1024 * 1024, workers=16).run()
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import botocore.exceptions
+import resumable
+import retry
+
+
+# bytes read from a response body per write
+BLOCKSIZE = 1024 * 1024
+
+
+def progress_path(journal_dir, bucket_name, s3_name, local_path):
+    """
+    Returns the journal file recording a download of s3_name to local_path.
+    """
+    name = hashlib.sha1('{0}/{1}:{2}'.format(
+        bucket_name, s3_name, os.path.abspath(local_path)).encode('utf-8'))
+    return os.path.join(journal_dir, name.hexdigest() + '.download')
+
+
+class RangedDownload(object):
+    """
+    Downloads an object in parts of part_size bytes on up to workers
+    threads, recording each finished part so an interrupted download
+    can be resumed.
+
+    usage:
+
+        RangedDownload(client, 'bucket', 'key', 'local file',
+                       part_size=64 * 1024 * 1024, workers=8).run()
+
+    client is a boto3 S3 client.  The partial file is kept as
+    local_path + '.part' and only moved into place once every part has
+    been written.  With attempts (see retry.py) each part is retried on
+    its own, including one whose body broke off part way.
+    """
+    def __init__(self, client, bucket_name, s3_name, local_path, part_size,
+                 workers=4, journal_dir=resumable.DEFAULT_JOURNAL_DIR,
+                 attempts=None):
+
+        self.client = client
+        self.bucket_name = bucket_name
+        self.s3_name = s3_name
+        self.local_path = local_path
+        self.partial = local_path + '.part'
+        self.part_size = part_size
+        self.workers = workers
+        self.journal = resumable.UploadJournal(progress_path(
+            journal_dir, bucket_name, s3_name, local_path))
+        self.resumed_parts = 0
+        self.attempts = attempts
+        self._lock = threading.Lock()
+
+    def _header(self, response):
+        return {'bucket': self.bucket_name, 'key': self.s3_name,
+                'destination': os.path.abspath(self.local_path),
+                'size': response['ContentLength'], 'etag': response['ETag'],
+                'part_size': self.part_size}
+
+    def _part_count(self, size):
+        return max(1, -(-size // self.part_size))
+
+    def _resume(self, header):
+        """
+        Returns the part numbers already written if the journalled
+        download is of the same object version and its partial file is
+        still there, or None.  A resumed download keeps the part size it
+        was started with, which header is updated to.
+        """
+        if not self.journal.load():
+            return None
+
+        # the part size may have changed since (see concurrency.py), but
+        # the parts already written were cut with the journalled one
+        journalled = self.journal.header
+        if dict(journalled, part_size=header['part_size']) != header:
+            return None
+
+        try:
+            if os.path.getsize(self.partial) != header['size']:
+                return None
+        except OSError:
+            return None
+
+        header['part_size'] = self.part_size = journalled['part_size']
+        return set(self.journal.parts)
+
+    def _fetch_part(self, output, number, header):
+        offset = (number - 1) * self.part_size
+        last = min(offset + self.part_size, header['size']) - 1
+
+        response = self.client.get_object(
+            Bucket=self.bucket_name, Key=self.s3_name, IfMatch=header['etag'],
+            Range='bytes={0}-{1}'.format(offset, last))
+        body = response['Body']
+
+        try:
+            for block in iter(lambda: body.read(BLOCKSIZE), b''):
+                self._write_at(output, offset, block)
+                offset += len(block)
+        finally:
+            body.close()
+
+        if offset != last + 1:
+            start = (number - 1) * self.part_size
+            raise botocore.exceptions.IncompleteReadError(
+                actual_bytes=offset - start, expected_bytes=last + 1 - start)
+
+        # the data has to be on disk before the journal says it is
+        os.fsync(output.fileno())
+        self.journal.record(number)
+
+    def _write_at(self, output, offset, data):
+        if hasattr(os, 'pwrite'):
+            os.pwrite(output.fileno(), data, offset)
+        else:
+            with self._lock:
+                output.seek(offset)
+                output.write(data)
+
+    def run(self):
+        """
+        Downloads whatever parts are missing and moves the file into
+        place.
+
+        returns the object's size.  Errors are raised; the partial file
+        and journal are kept so the next run resumes.
+        """
+        response = retry.call(self.attempts, self.client.head_object,
+                              Bucket=self.bucket_name, Key=self.s3_name)
+        header = self._header(response)
+        size = header['size']
+        completed = self._resume(header)
+
+        directory = os.path.dirname(self.local_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        if completed is None:
+            with open(self.partial, 'wb') as output:
+                output.truncate(size)
+            self.journal.start(header)
+            completed = set()
+
+        self.resumed_parts = len(completed)
+        missing = [number for number in range(1, self._part_count(size) + 1)
+                   if number not in completed]
+
+        if size:
+            with open(self.partial, 'r+b') as output:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    futures = [pool.submit(retry.call, self.attempts,
+                                           self._fetch_part, output, number,
+                                           header)
+                               for number in missing]
+
+                    for future in futures:
+                        future.result()
+
+        os.replace(self.partial, self.local_path)
+        self.journal.remove()
+
+        return size
@@ -0,0 +1,452 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+resumable.py - multipart uploads that survive being interrupted.
+
+Each upload keeps a journal file on disk.  The first line records the
+bucket, key, source file and multipart UploadId; every part that
+completes appends a line with its number and ETag.  When an upload is
+started again for the same file, the journal and the parts S3 already
+holds are used to carry on from where it stopped instead of from byte
+zero.
+
+Every part is sent with its checksums (see checksums.py), and the
+parts are hashed in file order as they are read, so the whole file's
+digests are known when the upload completes without reading it again.
+Parts an earlier run already uploaded are read once more for that.
+Files that have stopped changing (stable=True) are sent straight from a
+memory mapping (see mapped.py) rather than copied into buffers first;
+others are read with pread, as a mapped file that is truncated kills
+the process.
+
+usage:
+
+    upload = ResumableUpload(client, 'mybucket', '/backups/db.bak', 'db.bak')
+    upload.run()
+
+    abort_stale_uploads(client, 'mybucket')
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import botocore.exceptions
+import checksums
+import mapped
+import retry
+
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.s3upload',
+                                   'journal')
+
+# multipart uploads older than this with no journal are treated as orphaned
+STALE_AFTER = timedelta(days=1)
+
+MB = 1024 * 1024
+
+# the most parts S3 accepts in one multipart upload
+MAX_PARTS = 10000
+
+
+def journal_path(journal_dir, bucket_name, s3_name):
+    """
+    Returns the journal file used for an upload of s3_name to bucket_name.
+    """
+    name = hashlib.sha1('{0}/{1}'.format(bucket_name, s3_name).encode('utf-8'))
+    return os.path.join(journal_dir, name.hexdigest() + '.journal')
+
+
+def fit_part_size(size, part_size):
+    """
+    Returns part_size, raised to a whole number of MB if a file of size
+    bytes would otherwise need more than MAX_PARTS parts.
+    """
+    if size <= part_size * MAX_PARTS:
+        return part_size
+    smallest = -(-size // MAX_PARTS)
+    return -(-smallest // MB) * MB
+
+
+class UploadJournal(object):
+    """
+    The on-disk checkpoint of a single multipart upload, also used by
+    ranged.RangedDownload to record the parts of a download.
+
+    usage:
+
+        journal = UploadJournal('/path/to/file.journal')
+        if journal.load():
+            print(journal.upload_id, journal.parts)
+    """
+    def __init__(self, path):
+
+        self.path = path
+        self.header = None
+        self.parts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def upload_id(self):
+        """
+        The UploadId the journal belongs to, or None.
+        """
+        if self.header is None:
+            return None
+        return self.header.get('upload_id')
+
+    def load(self):
+        """
+        Reads the journal from disk.  Returns True if one was found.
+
+        A line cut short by a crash is ignored; its part is uploaded
+        again.
+        """
+        self.header = None
+        self.parts = {}
+
+        try:
+            with open(self.path, 'r') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+
+                    if 'part' in entry:
+                        self.parts[entry['part']] = entry.get('etag')
+                    else:
+                        self.header = entry
+
+        except IOError:
+            return False
+
+        return self.header is not None
+
+    def start(self, header):
+        """
+        Begins a new journal, replacing any previous one.
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.header = header
+        self.parts = {}
+
+        with open(self.path, 'w') as journal:
+            journal.write(json.dumps(header) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def record(self, part_number, etag=None):
+        """
+        Appends a completed part to the journal.
+        """
+        with self._lock:
+            self.parts[part_number] = etag
+
+            with open(self.path, 'a') as journal:
+                journal.write(json.dumps({'part': part_number,
+                                          'etag': etag}) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def remove(self):
+        """
+        Deletes the journal once the upload has completed or been
+        abandoned.
+        """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ResumableUpload(object):
+    """
+    Uploads a file in parts, recording progress in an UploadJournal so
+    an interrupted upload can be resumed.
+
+    usage:
+
+        ResumableUpload(client, 'bucket', 'local file', 'key',
+                        part_size=64 * 1024 * 1024, workers=8).run()
+
+    client is a boto3 S3 client.  The journal is only reused if the
+    local file still has the size and modification time it was recorded
+    with; otherwise the old upload is aborted and a new one started.  A
+    resumed upload keeps the part size it was started with, whatever
+    part_size is now, so parts already sent still fit.  stable=True says
+    the file has stopped changing, so its parts may be sent from a
+    memory mapping.  A part_size too small for the file to fit in
+    MAX_PARTS parts is raised (see fit_part_size) before the journal is
+    read or written.  With attempts (see retry.py) each request, and
+    each part, is retried on its own.  After run(), checksums holds the
+    whole file's digests (see checksums.Digests.result).
+    """
+    def __init__(self, client, bucket_name, file_object, s3_name,
+                 part_size, workers=4, journal_dir=DEFAULT_JOURNAL_DIR,
+                 attempts=None, stable=False):
+
+        self.client = client
+        self.bucket_name = bucket_name
+        self.file_object = file_object
+        self.s3_name = s3_name
+        self.part_size = part_size
+        self.workers = workers
+        self.journal = UploadJournal(journal_path(journal_dir, bucket_name,
+                                                  s3_name))
+        self.resumed_parts = 0
+        self.attempts = attempts
+        self.stable = stable
+        self.checksums = None
+        self._digests = None
+        self._hashed = 0
+        self._error = None
+        self._turn = threading.Condition()
+        self._part_md5s = {}
+        self._part_checksums = {}
+        self._parts = None
+
+    def _header(self, upload_id):
+        stat = os.stat(self.file_object)
+        return {'bucket': self.bucket_name, 'key': self.s3_name,
+                'source': os.path.abspath(self.file_object),
+                'size': stat.st_size, 'mtime': stat.st_mtime,
+                'part_size': self.part_size, 'checksum': checksums.ALGORITHM,
+                'upload_id': upload_id}
+
+    def _part_count(self, size):
+        return max(1, -(-size // self.part_size))
+
+    def _matches(self, header):
+        """
+        Checks a journal header against the current state of the file.
+        """
+        current = self._header(header['upload_id'])
+        return all(header.get(field) == current[field]
+                   for field in ('bucket', 'key', 'source', 'size', 'mtime',
+                                 'part_size', 'checksum'))
+
+    def _server_parts(self, upload_id):
+        """
+        Returns {part_number: (etag, size)} for the parts S3 holds for
+        upload_id, or None if the upload no longer exists.
+        """
+        parts = {}
+        paginator = self.client.get_paginator('list_parts')
+
+        try:
+            for page in paginator.paginate(Bucket=self.bucket_name,
+                                           Key=self.s3_name,
+                                           UploadId=upload_id):
+                for part in page.get('Parts', ()):
+                    parts[part['PartNumber']] = (part['ETag'], part['Size'])
+
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] in ('NoSuchUpload', '404'):
+                return None
+            raise
+
+        return parts
+
+    def _abort(self, upload_id):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name,
+                                               Key=self.s3_name,
+                                               UploadId=upload_id)
+        except botocore.exceptions.ClientError:
+            pass
+
+    def _resume(self):
+        """
+        Picks up the journalled upload if it can be continued.  Returns
+        the {part_number: etag} already completed, or None.
+        """
+        if not self.journal.load():
+            return None
+
+        upload_id = self.journal.upload_id
+        requested = self.part_size
+
+        # the part size may have changed since - set by the caller, or
+        # scaled after throttling (see concurrency.py) - but the parts
+        # already sent were cut with the journalled one
+        self.part_size = self.journal.header.get('part_size') or requested
+
+        if not self._matches(self.journal.header):
+            self.part_size = requested
+            self._abort(upload_id)
+            return None
+
+        server_parts = self._server_parts(upload_id)
+        if server_parts is None:
+            self.part_size = requested
+            return None
+
+        size = self.journal.header['size']
+        completed = {}
+
+        for number, (etag, part_size) in server_parts.items():
+            expected = min(self.part_size, size - (number - 1) * self.part_size)
+            if part_size == expected:
+                completed[number] = etag
+
+        return completed
+
+    def _hash_in_order(self, number, body):
+        """
+        Adds a part to the whole file's digests once every part before
+        it has been added.  A part that is retried is only added once.
+        """
+        with self._turn:
+            self._turn.wait_for(lambda: self._hashed >= number - 1 or
+                                self._error is not None)
+            if self._hashed >= number:
+                return
+            if self._error is not None:
+                raise RuntimeError("part {0} abandoned after another part "
+                                   "failed".format(number))
+
+            self._digests.update(body)
+            self._hashed = number
+            self._turn.notify_all()
+
+    def _upload_part(self, upload_id, number, size, send=True):
+        """
+        Reads and checksums a part, and uploads it unless it is already
+        on the server (send=False).
+        """
+        offset = (number - 1) * self.part_size
+        length = min(self.part_size, size - offset)
+        body = self._parts.part(offset, length)
+
+        try:
+            digests = checksums.Digests(body, sha256=False)
+            self._hash_in_order(number, body)
+            self._part_md5s[number] = digests.md5.digest()
+            self._part_checksums[number] = digests.crc_value()
+
+            if not send:
+                return
+
+            response = self.client.upload_part(Bucket=self.bucket_name,
+                                               Key=self.s3_name,
+                                               PartNumber=number,
+                                               UploadId=upload_id,
+                                               Body=mapped.PartBody(body),
+                                               **digests.headers())
+        finally:
+            body.release()
+            self._parts.release(offset, length)
+
+        self.journal.record(number, response['ETag'])
+
+    def _part(self, upload_id, number, size, send):
+        try:
+            return retry.call(self.attempts, self._upload_part, upload_id,
+                              number, size, send)
+        except Exception as error:
+            # parts waiting for this one to be hashed would wait forever
+            with self._turn:
+                if self._error is None:
+                    self._error = error
+                self._turn.notify_all()
+            raise
+
+    def run(self):
+        """
+        Uploads whatever parts are missing and completes the upload.
+
+        returns the response of CompleteMultipartUpload.  Errors are
+        raised; the journal is kept so the next run resumes.
+        """
+        self.part_size = fit_part_size(os.path.getsize(self.file_object),
+                                       self.part_size)
+        completed = retry.call(self.attempts, self._resume)
+
+        if completed is None:
+            response = retry.call(self.attempts,
+                                  self.client.create_multipart_upload,
+                                  Bucket=self.bucket_name, Key=self.s3_name,
+                                  ChecksumAlgorithm=checksums.ALGORITHM)
+            self.journal.start(self._header(response['UploadId']))
+            completed = {}
+
+        upload_id = self.journal.upload_id
+        size = self.journal.header['size']
+        self.resumed_parts = len(completed)
+        self.journal.parts = dict(completed)
+
+        self._digests = checksums.Digests()
+        self._hashed = 0
+        self._error = None
+
+        # every part is read, in order, for the whole file's digests;
+        # the ones already on the server are not sent again
+        header = self.journal.header
+        with mapped.open_parts(self.file_object, self.stable,
+                               (header['size'], header['mtime'])) as self._parts:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(self._part, upload_id, number, size,
+                                       number not in completed)
+                           for number in range(1, self._part_count(size) + 1)]
+
+                for future in futures:
+                    future.exception()
+
+        if self._error is not None:
+            raise self._error
+
+        numbers = sorted(self.journal.parts)
+        parts = [{'PartNumber': number, 'ETag': self.journal.parts[number],
+                  'Checksum' + checksums.ALGORITHM: self._part_checksums[number]}
+                 for number in numbers]
+
+        response = retry.call(self.attempts,
+                              self.client.complete_multipart_upload,
+                              Bucket=self.bucket_name, Key=self.s3_name,
+                              UploadId=upload_id,
+                              MultipartUpload={'Parts': parts})
+        self.journal.remove()
+
+        self.checksums = self._digests.result()
+        self.checksums['etag_verified'] = response.get('ETag') == \
+            checksums.multipart_etag([self._part_md5s[number]
+                                      for number in numbers])
+
+        return response
+
+
+def abort_stale_uploads(client, bucket_name, older_than=STALE_AFTER,
+                        journal_dir=DEFAULT_JOURNAL_DIR):
+    """
+    Aborts multipart uploads in bucket_name that were started more than
+    older_than ago and that no local journal expects to resume, so
+    orphaned parts stop being billed.
+
+    returns a list of the (key, upload_id) pairs that were aborted.
+    """
+    cutoff = datetime.now(timezone.utc) - older_than
+    aborted = []
+    paginator = client.get_paginator('list_multipart_uploads')
+
+    for page in paginator.paginate(Bucket=bucket_name):
+        for upload in page.get('Uploads', ()):
+            if upload['Initiated'] > cutoff:
+                continue
+
+            journal = UploadJournal(journal_path(journal_dir, bucket_name,
+                                                 upload['Key']))
+            if journal.load() and journal.upload_id == upload['UploadId']:
+                continue
+
+            client.abort_multipart_upload(Bucket=bucket_name,
+                                          Key=upload['Key'],
+                                          UploadId=upload['UploadId'])
+            aborted.append((upload['Key'], upload['UploadId']))
+
+    return aborted
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+retry.py - the retry policy shared by every S3Bucket operation.
+
+Retries happen at two levels.  botocore retries each request itself
+(BOTOCORE_RETRIES, its 'standard' mode: exponential backoff with full
+jitter); the shared clients in connections.py are built with it.  What
+gets past that - a request that ran out of attempts, a body that broke
+off while streaming, a whole transfer that failed - comes to a
+RetryPolicy, which decides whether the operation is worth running
+again:
+
+- throttling, 5xx responses, timeouts and dropped connections are
+  retried; anything else (access denied, missing keys, bad requests,
+  local file errors) is fatal and raised at once;
+- the wait before retry n is a random time between 0 and
+  min(cap, base * 2 ** n) ("full jitter"), so clients that were
+  throttled together don't come back together;
+- an operation stops retrying after max_attempts tries, or once budget
+  seconds have passed since its first failure; a wait that would run
+  past the budget is cut short.
+
+Journalled transfers (resumable uploads, ranged downloads) pick up
+from their finished parts when they are retried.
+
+usage:
+
+    attempts = RetryPolicy(max_attempts=5, budget=300).start()
+    attempts.call(client.put_object, Bucket='bucket', Key='key', Body=data)
+    print(attempts.retries)
+"""
+
+import random
+import sys
+import threading
+import time
+import botocore.exceptions
+
+
+# per request retries done by botocore before an error reaches the policy
+BOTOCORE_RETRIES = {'mode': 'standard', 'max_attempts': 3}
+
+RETRYABLE_CODES = frozenset((
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+    'RequestThrottled', 'TooManyRequestsException', 'ServiceUnavailable',
+    'InternalError', 'RequestTimeout', 'RequestTimeoutException',
+    'PriorRequestNotComplete', 'IDPCommunicationError', 'BadDigest',
+    'OperationAborted'))
+RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504))
+RETRYABLE_ERRORS = (botocore.exceptions.ConnectionError,
+                    botocore.exceptions.HTTPClientError,
+                    botocore.exceptions.IncompleteReadError)
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE = 0.5
+DEFAULT_CAP = 30.0
+DEFAULT_BUDGET = 300.0
+
+
+def retryable(error):
+    """
+    Returns True if error is worth retrying.  Wrapped errors, such as
+    the ClientError behind boto3's S3UploadFailedError, are looked
+    through.
+    """
+    seen = set()
+
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+
+        if isinstance(error, botocore.exceptions.ClientError):
+            response = error.response
+            code = response.get('Error', {}).get('Code')
+            status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            return (code in RETRYABLE_CODES or status in RETRYABLE_STATUS or
+                    str(code) in ('500', '502', '503', '504'))
+
+        if isinstance(error, RETRYABLE_ERRORS + _transfer_errors()):
+            return True
+
+        error = error.__cause__ or error.__context__
+
+    return False
+
+
+def _transfer_errors():
+    # importing s3transfer takes longer than most runs take to start, and
+    # until the transfer manager has loaded it none of its errors can be
+    # raised
+    exceptions = sys.modules.get('s3transfer.exceptions')
+    if exceptions is None:
+        return ()
+    return (exceptions.RetriesExceededError,)
+
+
+def call(attempts, function, *args, **kwargs):
+    """
+    Calls function under attempts, or just once if attempts is None.
+    """
+    if attempts is None:
+        return function(*args, **kwargs)
+    return attempts.call(function, *args, **kwargs)
+
+
+class RetryPolicy(object):
+    """
+    How often and how patiently failed operations are retried.
+
+    usage:
+
+        policy = RetryPolicy(max_attempts=6, base=1, cap=60, budget=600)
+        policy.start().call(function, *args)
+
+    Use start() for each operation; the attempts it returns share one
+    time budget and retry count across calls and threads.
+    """
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base=DEFAULT_BASE,
+                 cap=DEFAULT_CAP, budget=DEFAULT_BUDGET, sleep=time.sleep):
+
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+        self.sleep = sleep
+
+    def delay(self, retry):
+        """
+        Returns the seconds to wait before retry number retry (from 0).
+        """
+        return random.uniform(0, min(self.cap, self.base * 2 ** retry))
+
+    def start(self):
+        """
+        Returns the Attempts of a new operation.
+        """
+        return Attempts(self)
+
+
+class Attempts(object):
+    """
+    The retries of one operation under a RetryPolicy.
+    """
+    def __init__(self, policy):
+
+        self.policy = policy
+        self.retries = 0
+        self.first_failure = None
+        self._lock = threading.Lock()
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls function, retrying it under the policy.  The last error is
+        raised once the policy gives up.
+        """
+        retry = 0
+
+        while True:
+            try:
+                return function(*args, **kwargs)
+
+            except Exception as error:  # pylint: disable=broad-except
+                wait = self._wait(error, retry)
+                if wait is None:
+                    raise
+
+            self.policy.sleep(wait)
+            retry += 1
+
+    def _wait(self, error, retry):
+        """
+        Returns the seconds to wait before retrying after error, or None
+        to give up.
+        """
+        if retry + 1 >= self.policy.max_attempts or not retryable(error):
+            return None
+
+        now = time.monotonic()
+
+        with self._lock:
+            if self.first_failure is None:
+                self.first_failure = now
+            spent = now - self.first_failure
+            if spent >= self.policy.budget:
+                return None
+
+            self.retries += 1
+
+        return min(self.policy.delay(retry), self.policy.budget - spent)
@@ -6,36 +6,81 @@ to S3 Buckets
 """
 
 import os
-import platform
-from os import listdir
-from os.path import isfile, join
-import boto3
-import botocore
-import admin
-
-
-def listdirectory(local_path):
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+# boto3 and s3transfer are imported by the functions that build clients
+# and transfer configs, so --help and short runs don't wait for them
+import botocore.exceptions
+import checksums
+import cli
+import compression
+import concurrency
+import connections
+import dedup
+import listing
+import manifest
+import mapped
+import metrics
+import profiling
+import ranged
+import resumable
+import retry
+import scanner
+import servercopy
+import syncplan
+import watch
+from syncplan import RemoteObject
+
+
+DEFAULT_WORKERS = 8
+
+# transfers queued per worker when a batch is fed from a generator
+BATCH_BACKLOG = 4
+
+# the most keys a single DeleteObjects request accepts
+DELETE_BATCH_SIZE = 1000
+
+MB = 1024 * 1024
+
+# S3 multipart limits
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * 1024 * MB
+MAX_PARTS = resumable.MAX_PARTS
+
+# bounds used by transfer_config when picking settings from a file size
+AUTO_PART_SIZE = (8 * MB, 512 * MB)
+AUTO_TARGET_PARTS = 2000
+AUTO_CONCURRENCY = (4, 16)
+AUTO_MEMORY_BUDGET = 1024 * MB
+AUTO_IO_QUEUE = (100, 1000)
+IO_CHUNKSIZE = 256 * 1024
+
+# enough pooled connections for DEFAULT_WORKERS transfers, each running
+# the most threads transfer_config picks
+DEFAULT_POOL_CONNECTIONS = DEFAULT_WORKERS * AUTO_CONCURRENCY[1]
+
+
+def listdirectory(local_path, recursive=False):
     """
     Lists the content of a local directory
 
-    rasies an error if the directory doesn't exist
-    raises ValueError if the directory_path is not a string
-
     usage:
 
         listdirectory('local_path')
        :type local_path: str
 
-    returns - a list of file names as strings.
+    returns - a list of file names as strings, or None if the directory
+    can't be read.  With recursive=True names in subdirectories are
+    included as 'subdirectory/name'.  Use scanner.scan directly to
+    stream the entries and their stat data instead.
     """
-    print("platform type is : {0}".format(platform.system()))
-
-    if platform.system() == 'Windows':
-        print(local_path)
-        input()
-
     try:
-        return [f for f in listdir(local_path) if isfile(join(local_path, f))]
+        with profiling.phase('listdirectory'):
+            return [entry.name for entry in scanner.scan(local_path,
+                                                         skip_hidden=False,
+                                                         recursive=recursive)]
 
     except OSError:
         return None
@@ -51,15 +96,135 @@ def filelist_diff(desired_list, actual_list):
     filelist_diff(desired_list, actual_list)
         :type desired_list: list
         :type actual_list: list
+
+    Only names are compared; use syncplan to also pick up files that
+    changed under the same name.
+    """
+    with profiling.phase('filelist_diff'):
+        actual = set(actual_list or ())
+
+        return [item for item in desired_list if item not in actual]
+
+
+def error_code(error):
+    """
+    Returns the code of a botocore ClientError: an int for HTTP status
+    codes such as 404, otherwise the S3 error code string.  A response
+    dictionary with an 'Error' entry is also accepted.
     """
-    diff_list = []
+    response = getattr(error, 'response', error)
+    code = response['Error']['Code']
+
+    try:
+        return int(code)
+    except ValueError:
+        return code
+
 
-    for item in desired_list:
+def _clamp(value, bounds):
+    return max(bounds[0], min(bounds[1], value))
 
-        if item not in actual_list:
-            diff_list.append(item)
 
-    return diff_list
+def transfer_config(file_size=None, part_size=None, multipart_threshold=None,
+                    max_concurrency=None, io_queue_size=None):
+    """
+    Builds a boto3 TransferConfig for a multipart transfer.
+
+    usage:
+
+        transfer_config(file_size=200 * 1024 ** 3)
+        transfer_config(part_size=64 * MB, max_concurrency=8)
+
+    Any setting that is not given is picked from file_size:  parts grow
+    with the file so it is sent in roughly AUTO_TARGET_PARTS pieces,
+    and concurrency shrinks as parts grow so the buffered parts stay
+    within AUTO_MEMORY_BUDGET.  Given a file_size, parts - even a
+    part_size that was given - are never small enough for the file to
+    need more than MAX_PARTS.  Without a file_size, unset values fall
+    back to the boto3 defaults.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    if file_size is not None:
+        if part_size is None:
+            part_size = _clamp(-(-file_size // AUTO_TARGET_PARTS),
+                               AUTO_PART_SIZE)
+            part_size = -(-part_size // MB) * MB
+
+        # a part size that is given is still raised if the file would
+        # otherwise need more than MAX_PARTS parts
+        part_size = resumable.fit_part_size(file_size, part_size)
+
+        if multipart_threshold is None:
+            multipart_threshold = part_size
+
+        if max_concurrency is None:
+            max_concurrency = _clamp(AUTO_MEMORY_BUDGET // part_size,
+                                     AUTO_CONCURRENCY)
+
+        if io_queue_size is None:
+            io_queue_size = _clamp(part_size // IO_CHUNKSIZE, AUTO_IO_QUEUE)
+
+    settings = {}
+
+    if part_size is not None:
+        if not MIN_PART_SIZE <= part_size <= MAX_PART_SIZE:
+            raise ValueError("part_size must be between 5 MB and 5 GB")
+        settings['multipart_chunksize'] = part_size
+
+    if multipart_threshold is not None:
+        settings['multipart_threshold'] = multipart_threshold
+
+    if max_concurrency is not None:
+        settings['max_concurrency'] = max_concurrency
+
+    if io_queue_size is not None:
+        settings['max_io_queue'] = io_queue_size
+
+    return TransferConfig(**settings)
+
+
+class TransferResult(object):
+    """
+    Records the outcome of a single transfer within a batch.
+
+    usage:
+
+        TransferResult('object name', outcome)
+
+    outcome is the return value of the transfer call: True when it
+    succeeded, otherwise the error code or exception it returned.
+    retries is how many times the transfer was retried on the way.
+    checksums holds the digests of an uploaded file, computed as it was
+    sent (see checksums.Digests.result), or None.  size is the bytes the
+    transfer moved and seconds how long it took, where known.
+    A TransferResult is truthy only if the transfer succeeded.
+    """
+    def __init__(self, name, outcome=True, retries=0, checksums=None,
+                 size=None, seconds=None):
+
+        self.name = name
+        self.error = None
+        self.status = 'Successful'
+        self.retries = retries
+        self.checksums = checksums
+        self.size = size
+        self.seconds = seconds
+
+        if outcome is not True:
+            self.status = 'Failed'
+            self.error = outcome
+
+    def __bool__(self):
+        return self.status == 'Successful'
+
+    def __repr__(self):
+        status = self.status
+        if self.error is not None:
+            status = "{0}: {1!r}".format(status, self.error)
+        if self.retries:
+            status = "{0}, {1} retries".format(status, self.retries)
+        return "TransferResult({0!r}, {1})".format(self.name, status)
 
 
 class S3Bucket(object):
@@ -74,21 +239,103 @@ class S3Bucket(object):
     authobject in this usage is an instance of admin.KeySecret(object)
     it stores a valid AWS API key and secret with permission to invoke
     the requested S3 bucket/service.
+
+    journal_dir is where resumable uploads and large downloads keep
+    their checkpoints.
+
+    With a cache_dir the key index is also kept in a manifest.Manifest
+    there, so later runs load it from disk and only list the bucket
+    once the manifest is older than reconcile_interval seconds, or when
+    get_objects() is called.
+
+    list_workers is the number of concurrent requests get_objects uses
+    by default.
+
+    Buckets with the same auth, region and endpoint_url share one boto3
+    session and client from connections.get_client, so connections are
+    reused across buckets, jobs and transfers.  Only the client is
+    shared, since boto3 resources are not thread safe.
+    max_pool_connections should cover every transfer thread expected
+    to run at once.
+
+    compression names a codec from compression.CODECS ('gzip' or
+    'zstd') that uploads are compressed with on the fly, unless a
+    transfer asks for another (see upload_codec); the codec is recorded
+    in the object metadata.  decompress=True checks that
+    metadata on download and decompresses such objects as they arrive.
+
+    adaptive=True puts the bucket's client under a
+    concurrency.AdaptiveController, which adjusts the requests in flight
+    and the part size of later transfers to latency, throughput and
+    throttling; controller.report() gives the values it settled on.
+
+    retry_policy is the retry.RetryPolicy failed operations are retried
+    under; the default retries throttling and transient errors with
+    jittered exponential backoff.
+
+    budget is a threading.Semaphore shared with other buckets (see
+    scheduler.py); batch transfers hold one of its slots per file, so
+    jobs running side by side stay within one concurrency limit.
+
+    metrics is a metrics.Emitter that batch transfers report each
+    transfer, and each batch, to.
+
+    mmap=True sends uploads of files known to have stopped changing
+    (see multipart_transfer's stable) from a memory mapping instead of
+    reading them with pread.  A mapped file that is truncated while it
+    is being sent kills the process with SIGBUS (see mapped.py), so
+    only turn it on where nothing rewrites finished files in place.
     """
-    def __init__(self, auth=None, bucket_name=None):
+    def __init__(self, auth=None, bucket_name=None,
+                 journal_dir=resumable.DEFAULT_JOURNAL_DIR, cache_dir=None,
+                 reconcile_interval=manifest.RECONCILE_INTERVAL, list_workers=1,
+                 region=None, max_pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 endpoint_url=None, compression=None, decompress=False,
+                 adaptive=False, retry_policy=None, budget=None,
+                 metrics=None, mmap=False):
 
         self.bucket_name = bucket_name
-        self.s3object = None
-        self.objectlist = None
-        self.resource = boto3.resource('s3')
-
-        if auth is not None:
-            self.auth = auth
-            self.resource = boto3.resource('s3',
-                                           aws_access_key_id=self.auth.key,
-                                           aws_secret_access_key=self.auth.secret)
+        self.compression = compression
+        self.decompress = decompress
+        self.mmap = mmap
+        self.list_workers = list_workers
+        self.journal_dir = journal_dir
+        self.manifest = None
+        self.found = False
+        self.objectindex = None
+        self.auth = auth
+
+        # low level clients are thread safe, so the scheduler's jobs and
+        # the transfers in their worker pools all share this one.
+        self.client = connections.get_client(auth, region,
+                                             max_pool_connections,
+                                             endpoint_url)
+        self._index_lock = threading.RLock()
+        self.retry_policy = retry_policy or retry.RetryPolicy()
+        self.budget = budget
+        self.metrics = metrics
+        self._local = threading.local()
+        self.controller = None
+
+        if adaptive:
+            self.controller = concurrency.for_client(
+                self.client, maximum=max_pool_connections)
+
+        if cache_dir is not None:
+            self.manifest = manifest.Manifest(bucket_name, cache_dir,
+                                              reconcile_interval)
+
+    @property
+    def objectlist(self):
+        """
+        The keys in the bucket as a list, or None if the bucket has not
+        been listed yet.
+        """
+        if self.objectindex is None:
+            return None
+        return list(self.objectindex)
 
-    def exists(self):
+    def exists(self, refresh=False):
         """
         S3Bucket.exists()
 
@@ -97,23 +344,37 @@ class S3Bucket(object):
         If it exists, it returns True.
         If it does not exist, it returns an error.
 
+        The bucket is only listed the first time it is found, when
+        refresh=True, or when the manifest is due to be reconciled;
+        otherwise the key index comes from the manifest and is kept
+        current by this object's own uploads and deletes.
+
         ex:
             mybucket = S3Bucket(auth=myauth, bucket='mybucket')
             if ! mybucket.exists():
                 mybucket.init()
         """
         try:
-            self.resource.meta.client.head_bucket(Bucket=self.bucket_name)
+            self._call(self.client.head_bucket, Bucket=self.bucket_name)
 
         except botocore.exceptions.ClientError as error:
-            return int(error.response['Error']['Code'])
+            return error_code(error)
 
         try:
-            self.s3object = self.resource.Bucket(self.bucket_name)
-            self.get_objects()
+            self.found = True
+
+            if refresh or self.manifest is not None and self.manifest.is_stale():
+                self.get_objects()
+
+            elif self.objectindex is None:
+                if self.manifest is not None:
+                    with self._index_lock, profiling.phase('manifest'):
+                        self.objectindex = self.manifest.load()
+                else:
+                    self.get_objects()
 
         except botocore.exceptions.ClientError as error:
-            return int(error.response['Error']['Code'])
+            return error_code(error)
 
         return True
 
@@ -127,53 +388,110 @@ class S3Bucket(object):
         assert isinstance(bucket_name, object)
 
         if bucket_name:
-            setattr(self.bucket_name, bucket_name)
+            self.bucket_name = bucket_name
 
         elif self.bucket_name is None:
             raise ValueError
 
-        if self.exists() is True:
+        status = self.exists()
+
+        if status is True:
             return True
-        elif self.exists() == 404:
+        elif status == 404:
             try:
-                self.resource.create_bucket(Bucket=self.bucket_name)
+                self._call(self.client.create_bucket, Bucket=self.bucket_name)
             except botocore.exceptions.ClientError as error:
                 return error
         else:
-            return self.exists()
+            return status
 
-        if self.auth is not None:
-            self.resource = boto3.resource(
-                's3',
-                aws_access_key_id=self.auth.key,
-                aws_secret_access_key=self.auth.secret)
+        return self.exists()
 
-        return True
-
-    def get_objects(self):
+    def get_objects(self, workers=None, prefixes=None):
         """
-        Dumps and repopulates a list of objects in a given
+        Dumps and repopulates the index of objects in a given
         bucket.
+
+        This lists the whole bucket, so it is only called when the
+        index is first needed or a caller explicitly asks to refresh it.
+        The manifest, if there is one, is reconciled with the listing.
+
+        usage:
+            S3Bucket.get_objects(workers=16)
+            S3Bucket.get_objects(prefixes=['backups/2024/'])
+
+        With workers (default list_workers) greater than 1 the bucket is
+        split into shards on its '/' prefixes, which are listed
+        concurrently.  prefixes lists (and replaces in the index) only
+        the keys under those prefixes.
         """
-        if self.s3object is None:
-            if self.exists is not True:
+        if not self.found:
+            if self.exists() is not True:
                 raise ValueError
 
-        try:
-            self.objectlist = []
+        if workers is None:
+            workers = self.list_workers
 
-            for s3object in self.s3object.objects.all():
-                # print(s3object.key)
-                # input('\tpress any key for next item...')
-                self.objectlist.append(s3object.key)
+        def _list():
+            if workers > 1 or prefixes is not None:
+                return listing.parallel_list(self.client, self.bucket_name,
+                                             prefixes=prefixes,
+                                             workers=max(workers, 1))
+            return listing.list_prefix(self.client, self.bucket_name)[0]
+
+        try:
+            with profiling.phase('get_objects'):
+                objectindex = self._call(_list)
 
         except botocore.exceptions.ClientError as error:
-            error_code = int(error.response['Error']['Code'])
-            return error_code
+            return error_code(error)
+
+        with self._index_lock:
+            if prefixes is not None:
+                prefixes = tuple(prefixes)
+                for key in list(self.objectindex or ()):
+                    if key.startswith(prefixes) and key not in objectindex:
+                        self._index_remove(key)
+                for entry in objectindex.values():
+                    self._index_add(entry.key, entry.size, entry.etag,
+                                    entry.last_modified)
+                return True
+
+            self.objectindex = objectindex
+
+            if self.manifest is not None:
+                self.manifest.replace(objectindex)
 
         return True
 
-    def add_object(self, new_object, retries=0):
+    def _index_add(self, s3_name, size, etag=None, last_modified=None):
+        """
+        Records a successful upload in the key index.
+        """
+        if last_modified is None:
+            last_modified = datetime.now(timezone.utc)
+
+        with self._index_lock:
+            if self.objectindex is None:
+                self.objectindex = {}
+            entry = RemoteObject(s3_name, size, etag, last_modified)
+            self.objectindex[s3_name] = entry
+
+            if self.manifest is not None:
+                self.manifest.put(entry)
+
+    def _index_remove(self, s3_name):
+        """
+        Drops a deleted object from the key index.
+        """
+        with self._index_lock:
+            if self.objectindex is not None:
+                self.objectindex.pop(s3_name, None)
+
+            if self.manifest is not None:
+                self.manifest.remove(s3_name)
+
+    def add_object(self, new_object, s3_name=None):
         """
         Adds a file or files to the s3 bucket
 
@@ -182,69 +500,235 @@ class S3Bucket(object):
           S3Bucket.add_object('object name')
           alternatively:
           S3Bucket.add_object('list of object names')
+
+        s3_name sets the object key, which defaults to the file name.
+        Failed puts are retried under the bucket's retry_policy.  The
+        file is checksummed as it is sent (see _checked_upload).
         """
         if isinstance(new_object, list):
             return self.add_objects(new_object)
 
+        if s3_name is None:
+            s3_name = new_object
+
+        if self.compression is not None:
+            return self._compressed_upload(new_object, s3_name)
+
         try:
-            new_object_data = open(new_object, mode='rb')
+            self._checked_upload(new_object, s3_name)
 
-            try:
-                self.s3object.put_object(Key=new_object, Body=new_object_data)
-                self.get_objects()
+        except botocore.exceptions.ClientError as error:
+            return error_code(error)
 
-            except botocore.exceptions.ClientError as error:
+        except IOError as error:
+            return error
 
-                if retries < 3:
-                    retries += 1
-                    self.add_object(new_object, retries)
+        return True
 
-                error_code = int(error.response['Error']['Code'])
-                new_object_data.close()
-                return error_code
+    def _checked_upload(self, file_object, s3_name, config=None, stable=False):
+        """
+        Uploads file_object, reading it once and checksumming it on the
+        way (see checksums.py).
+
+        A file below the multipart threshold is sent in one put_object,
+        read with pread or, if it is stable, straight from a memory
+        mapping (see mapped.py), with its Content-MD5, its S3 checksum
+        and its digests in the object metadata.  A bigger one is
+        streamed through the transfer manager, which sends each part
+        with its S3 checksum; its digests go to the transfer result
+        only.
+        """
+        from boto3.s3.transfer import TransferConfig
 
-        except IOError as error:
+        threshold = (config or TransferConfig()).multipart_threshold
 
-            if retries < 3:
-                retries += 1
-                self.add_object(new_object, retries)
+        def _upload():
+            digests = checksums.Digests()
 
-            try:
-                new_object_data.close()
+            stat = os.stat(file_object)
 
-            except NameError:
-                pass
+            if stat.st_size < threshold:
+                with mapped.open_parts(file_object, stable,
+                                       (stat.st_size, stat.st_mtime)) as parts:
+                    body = parts.part(0, parts.size)
 
-            return error
+                    try:
+                        digests.update(body)
+                        response = self.client.put_object(
+                            Bucket=self.bucket_name, Key=s3_name,
+                            Body=mapped.PartBody(body),
+                            Metadata=digests.metadata(), **digests.headers())
+                    finally:
+                        body.release()
 
-        new_object_data.close()
-        return True
+                return digests, response.get('ETag')
+
+            with open(file_object, mode='rb') as source:
+                self.client.upload_fileobj(
+                    checksums.HashingReader(source, digests), self.bucket_name,
+                    s3_name, ExtraArgs={'ChecksumAlgorithm': checksums.ALGORITHM},
+                    Config=config)
+                return digests, None
 
-    def add_objects(self, object_list):
+        digests, etag = self._call(_upload)
+        result = digests.result()
+        if etag is not None:
+            result['etag_verified'] = etag == digests.etag()
+
+        self._local.checksums = result
+        self._local.transferred = digests.size
+        self._index_add(s3_name, digests.size, etag)
+
+    def add_objects(self, object_list, workers=1):
         """
         Adds a list of objects by name to the S3 bucket object destination.
 
-        Future Improvements:
-        return a dictionary with results in the format:
-        {"object_name" : File_upload_result}
+        object_list is either a list of file names, which are also used
+        as the object keys, a dictionary of {"file_name": "object_key"},
+        or an iterable of (file_name, object_key) pairs.
+
+        With workers greater than 1 the files are uploaded concurrently
+        by a thread pool sharing this bucket's client.  A failed upload
+        is recorded in the results and does not stop the batch.
+
+        returns a dictionary with results in the format:
+        {"object_name" : TransferResult}
         """
-        results = {}
+        if isinstance(object_list, list):
+            object_list = {name: name for name in object_list}
+
+        def _upload(file_object, s3_name):
+            return self.add_object(file_object, s3_name=s3_name)
+
+        return self._run_batch(_upload, object_list, workers, 'put')
+
+    def multipart_transfers(self, transfer_list, action, workers=DEFAULT_WORKERS,
+                            config='auto', stable=False, codec=None):
+        """
+        Runs multipart_transfer for every item in transfer_list using a
+        pool of worker threads.
+
+        usage:
+            S3Bucket.multipart_transfers({file_object: s3_name}, 'upload')
+
+        transfer_list is a dictionary of the file_object and s3_name
+        arguments passed to multipart_transfer, along with config,
+        stable and codec.  It can also be an iterable of (file_object, s3_name)
+        pairs, such as a generator fed by a directory scan; transfers
+        then start as soon as the first pair arrives.
 
-        for file_object in object_list:
+        returns a dictionary with results in the format:
+        {"file_object" : TransferResult}
+        """
+        def _transfer(file_object, s3_name):
+            return self.multipart_transfer(file_object, s3_name, action,
+                                           config=config, stable=stable,
+                                           codec=codec)
+
+        return self._run_batch(_transfer, transfer_list, workers, action)
+
+    def _run_batch(self, transfer, jobs, workers, operation):
+        """
+        Calls transfer(name, argument) for every (name, argument) pair in
+        jobs - or every item of a jobs dictionary - on up to workers
+        threads, and collects a TransferResult for each.
+
+        At most workers * BATCH_BACKLOG transfers are queued at a time,
+        so jobs can be a generator over millions of files.  Each
+        transfer gets its own retry budget, and its result records how
+        often it was retried.  With metrics, every transfer and the
+        batch as a whole are reported, tagged with operation.
+        """
+        if isinstance(jobs, dict):
+            jobs = jobs.items()
+
+        tags = {'bucket': self.bucket_name, 'operation': operation}
+        start = time.monotonic()
+
+        def _attempt(name, argument):
+            if self.budget is None:
+                return _transfer(name, argument)
+
+            with self.budget:
+                return _transfer(name, argument)
+
+        def _transfer(name, argument):
+            attempts = self._local.attempts = self.retry_policy.start()
+            self._local.checksums = None
+            self._local.transferred = None
+            started = time.monotonic()
 
             try:
-                self.add_object(file_object)
-                results[file_object] = 'Successful'
+                with profiling.phase('transfer.' + operation):
+                    outcome = transfer(name, argument)
 
-            except botocore.exceptions.ClientError as error:
-                error_code = int(error.response['Error']['Code'])
-                return error_code
+            except Exception as error:  # pylint: disable=broad-except
+                outcome = error
+
+            finally:
+                self._local.attempts = None
+
+            result = TransferResult(name, outcome, attempts.retries,
+                                    self._local.checksums,
+                                    self._local.transferred,
+                                    time.monotonic() - started)
+
+            if self.metrics is not None:
+                metrics.record_transfer(self.metrics, tags, result,
+                                        result.seconds, result.size)
+
+            return result
+
+        results = {}
+
+        if workers <= 1:
+            for name, argument in jobs:
+                results[name] = _attempt(name, argument)
 
-        self.get_objects()
+        else:
+            def _collect(done):
+                for future in done:
+                    results[futures.pop(future)] = future.result()
+
+            futures = {}
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for name, argument in jobs:
+                    if len(futures) >= workers * BATCH_BACKLOG:
+                        _collect(wait(futures,
+                                      return_when=FIRST_COMPLETED).done)
+
+                    futures[pool.submit(_attempt, name, argument)] = name
+
+                _collect(wait(futures).done)
+
+        profiling.add('batch.' + operation, time.monotonic() - start)
+
+        if self.metrics is not None:
+            metrics.record_batch(self.metrics, tags, results,
+                                 time.monotonic() - start,
+                                 sum(results[name].size or 0
+                                     for name in results))
 
         return results
 
-    def multipart_transfer(self, file_object: object, s3_name: str, action: str) -> object:
+    def _attempts(self):
+        """
+        Returns the retry Attempts of the operation running on this
+        thread, or those of a new one.
+        """
+        return (getattr(self._local, 'attempts', None) or
+                self.retry_policy.start())
+
+    def _call(self, function, *args, **kwargs):
+        """
+        Calls function under the bucket's retry policy.
+        """
+        return self._attempts().call(function, *args, **kwargs)
+
+    def multipart_transfer(self, file_object: object, s3_name: str, action: str,
+                           config='auto', stable=False,
+                           codec=None) -> object:
         """
         Performs a multipart transfer of a given object.  useful for really
         really large objects.
@@ -254,38 +738,236 @@ class S3Bucket(object):
             :param file_object:
             :param s3_name:
             :type action: object
+                'upload', 'download', or 'resumable' for an upload that
+                checkpoints its parts in journal_dir and carries on from
+                the last completed part if it is run again, or 'dedup' to
+                store the file as content-defined chunks plus a manifest
+                (see dedup.py).  Large downloads are fetched as concurrent
+                byte ranges and resume where they stopped if run again
+                (see ranged.py); downloading a manifest key rebuilds the
+                file from its chunks.
+            :param config: 'auto' to size the transfer from the file size,
+                a dictionary of transfer_config() settings (unset ones are
+                still picked automatically), a TransferConfig, or None for
+                the boto3 defaults.
+            :param stable: True if the file to upload has stopped changing
+                (see watch.py), so that with mmap=True it is read from a
+                memory mapping; otherwise it is read with pread (see
+                mapped.py).
+            :param codec: the codec to upload with instead of the
+                bucket's compression, or 'none' (see upload_codec).
         """
+        from boto3.s3.transfer import TransferConfig
+
+        config = self._transfer_config(config, file_object, s3_name, action)
+        stable = stable and self.mmap
+        upload_codec = self.upload_codec(codec)
+
+        if action in ('upload', 'resumable') and upload_codec is not None:
+            # a compressed stream can't be resumed part by part
+            return self._compressed_upload(file_object, s3_name, config,
+                                           upload_codec)
+
+        attempts = self._attempts()
+
         if action == 'download':
             try:
-                # transfer_cfg = self.s3object.transfer.TransferConfig()
-                # transfer_cfg = boto3.s3.transfer.TransferConfig(
-                #        multipart_threshold=1024*1024*4)
+                directory = os.path.dirname(s3_name)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory, exist_ok=True)
 
-                # transfer = boto3.s3.transfer.S3Transfer(client=self.s3object,
-                #                                        config=transfer_cfg)
-                # transfer = boto3.s3.transfer.S3Transfer(client=self.s3object)
+                codec = None
+                if self.decompress:
+                    codec = attempts.call(compression.object_codec, self.client,
+                                          self.bucket_name, file_object)
 
-                # transfer.upload_file(file_object, self.bucket_name, s3_name)
+                if file_object.startswith(dedup.MANIFEST_PREFIX):
+                    dedup.restore(self.client, self.bucket_name, file_object,
+                                  s3_name, workers=config.max_concurrency
+                                  if config else DEFAULT_WORKERS,
+                                  attempts=attempts)
 
-                self.s3object.meta.client.download_file(self.bucket_name,
-                                                        file_object,
-                                                      s3_name)
+                elif codec is not None:
+                    attempts.call(compression.download, self.client,
+                                  self.bucket_name, file_object, s3_name, codec)
+                else:
+                    self._ranged_download(file_object, s3_name, config)
+
+                self._local.transferred = os.path.getsize(s3_name)
 
             except botocore.exceptions.ClientError as error:
-                error_code = int(error.response['Error']['Code'])
-                return error_code
+                return error_code(error)
 
         if action == 'upload':
             try:
-                self.s3object.meta.client.upload_file(file_object, self.bucket_name,
-                                                      s3_name)
+                self._checked_upload(file_object, s3_name, config, stable)
+
+            except botocore.exceptions.ClientError as error:
+                return error_code(error)
+
+        if action == 'dedup':
+            try:
+                dedup.upload(self.client, self.bucket_name, file_object, s3_name,
+                             known_keys=self.objectindex or {},
+                             workers=config.max_concurrency if config
+                             else DEFAULT_WORKERS,
+                             on_stored=self._index_add, attempts=attempts)
+                self._local.transferred = os.path.getsize(file_object)
+
+            except botocore.exceptions.ClientError as error:
+                return error_code(error)
+
+        if action == 'resumable':
+            if config is None:
+                config = TransferConfig()
+
+            if os.path.getsize(file_object) < config.multipart_threshold:
+                return self.multipart_transfer(file_object, s3_name, 'upload',
+                                               config=config, stable=stable,
+                                               codec=codec)
+
+            try:
+                upload = resumable.ResumableUpload(
+                    self.client, self.bucket_name, file_object, s3_name,
+                    part_size=config.multipart_chunksize,
+                    workers=config.max_concurrency,
+                    journal_dir=self.journal_dir, attempts=attempts,
+                    stable=stable)
+                response = upload.run()
+                self._local.checksums = upload.checksums
+                self._local.transferred = upload.checksums['size']
+                self._index_add(s3_name, upload.checksums['size'],
+                                response.get('ETag'))
 
             except botocore.exceptions.ClientError as error:
-                error_code = int(error.response['Error']['Code'])
-                return error_code
+                return error_code(error)
+
+        return True
+
+    def _ranged_download(self, s3_name, local_path, config=None):
+        """
+        Downloads s3_name to local_path.  Objects at or above the
+        multipart threshold are fetched as concurrent byte ranges written
+        into a preallocated file, resuming from the parts journalled in
+        journal_dir by an earlier, interrupted run.
+        """
+        from boto3.s3.transfer import TransferConfig
+
+        if config is None:
+            config = TransferConfig()
+
+        entry = (self.objectindex or {}).get(s3_name)
+
+        if entry is not None and entry.size < config.multipart_threshold:
+            self._call(self.client.download_file, self.bucket_name, s3_name,
+                       local_path, Config=config)
+            return
+
+        ranged.RangedDownload(self.client, self.bucket_name, s3_name,
+                              local_path, part_size=config.multipart_chunksize,
+                              workers=config.max_concurrency,
+                              journal_dir=self.journal_dir,
+                              attempts=self._attempts()).run()
+
+    def upload_codec(self, codec=None):
+        """
+        Returns the codec uploads are compressed with, or None: the
+        bucket's compression unless codec names another one, or is
+        'none' to upload uncompressed.
+        """
+        if codec is None:
+            return self.compression
+        if codec == 'none':
+            return None
+        return codec
+
+    def _compressed_upload(self, file_object, s3_name, config=None,
+                           codec=None):
+        """
+        Uploads file_object compressed with codec (by default
+        self.compression), streaming it through the multipart uploader
+        without a temporary file.  The transfer result has the digests
+        of the uncompressed file.
+        """
+        codec = codec or self.compression
+
+        def _upload(size):
+            digests = checksums.Digests()
+
+            with open(file_object, 'rb') as source:
+                reader = compression.CompressingReader(
+                    checksums.HashingReader(source, digests), codec)
+                extra_args = compression.extra_args(codec, size)
+                extra_args['ChecksumAlgorithm'] = checksums.ALGORITHM
+                self.client.upload_fileobj(reader, self.bucket_name, s3_name,
+                                           ExtraArgs=extra_args, Config=config)
+
+            self._local.checksums = digests.result()
+            return reader.bytes_out
+
+        try:
+            sent = self._call(_upload, os.path.getsize(file_object))
+            self._local.transferred = sent
+            self._index_add(s3_name, sent)
+
+        except botocore.exceptions.ClientError as error:
+            return error_code(error)
+
+        except IOError as error:
+            return error
 
         return True
 
+    def abort_stale_uploads(self, older_than=resumable.STALE_AFTER):
+        """
+        Aborts multipart uploads left in the bucket by failed runs that
+        have no local journal to resume them.
+
+        usage:
+            S3Bucket.abort_stale_uploads(older_than=timedelta(hours=12))
+
+        returns a list of the (key, upload_id) pairs that were aborted,
+        or an error code.
+        """
+        try:
+            return self._call(resumable.abort_stale_uploads, self.client,
+                              self.bucket_name, older_than, self.journal_dir)
+
+        except botocore.exceptions.ClientError as error:
+            return error_code(error)
+
+    def _transfer_config(self, config, file_object, s3_name, action):
+        """
+        Resolves the config argument of multipart_transfer to a
+        TransferConfig, or None for the boto3 defaults.
+        """
+        from boto3.s3.transfer import TransferConfig
+
+        if config is None or isinstance(config, TransferConfig):
+            return config
+
+        file_size = None
+
+        if action in ('upload', 'resumable'):
+            try:
+                file_size = os.path.getsize(file_object)
+            except OSError:
+                pass
+
+        elif self.objectindex is not None and file_object in self.objectindex:
+            file_size = self.objectindex[file_object].size
+
+        settings = {} if config == 'auto' else dict(config)
+
+        if (self.controller is not None and self.controller.part_scale > 1
+                and settings.get('part_size') is None):
+            # after throttling, send the same data in fewer, larger parts
+            part_size = transfer_config(file_size, **settings).multipart_chunksize
+            settings['part_size'] = self.controller.part_size(part_size,
+                                                              MAX_PART_SIZE)
+
+        return transfer_config(file_size, **settings)
+
     def delete_object(self, new_object):
         """
         Deletes an object from the S3 bucket.
@@ -295,16 +977,227 @@ class S3Bucket(object):
         returns True if Successful
         returns an error if failed.
         """
+        if isinstance(new_object, list):
+            return self.delete_objects(new_object)
+
         try:
-            self.s3object.delete_object(Bucket=self.bucket_name,
-                                        Key=new_object)
+            self._call(self.client.delete_object, Bucket=self.bucket_name,
+                       Key=new_object)
 
         except botocore.exceptions.ClientError as error:
-            error_code = int(error.response['Error']['Code'])
-            return error_code
+            return error_code(error)
 
+        self._index_remove(new_object)
         return True
 
+    def delete_objects(self, object_list, workers=DEFAULT_WORKERS):
+        """
+        Deletes a list of objects with DeleteObjects requests of up to
+        DELETE_BATCH_SIZE keys, sending up to workers batches at once.
+
+        usage:
+            S3Bucket.delete_objects(['object1', 'object2'])
+
+        A key S3 reports as not deleted, or every key of a batch whose
+        request failed, is recorded as Failed with its error code.
+
+        returns a dictionary with results in the format:
+        {"object_name" : TransferResult}
+        """
+        object_list = list(dict.fromkeys(object_list))
+        batches = [object_list[start:start + DELETE_BATCH_SIZE]
+                   for start in range(0, len(object_list), DELETE_BATCH_SIZE)]
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for outcome in pool.map(self._delete_batch, batches):
+                results.update(outcome)
+
+        return results
+
+    def _delete_batch(self, keys):
+        """
+        Sends one DeleteObjects request and returns a TransferResult for
+        each of its keys.
+        """
+        try:
+            attempts = self.retry_policy.start()
+            response = attempts.call(
+                self.client.delete_objects, Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key} for key in keys],
+                        'Quiet': True})
+
+        except botocore.exceptions.ClientError as error:
+            code = error_code(error)
+            return {key: TransferResult(key, code, attempts.retries)
+                    for key in keys}
+
+        # quiet mode only reports the keys that could not be deleted
+        failed = {error['Key']: error_code({'Error': error})
+                  for error in response.get('Errors', ())}
+        results = {}
+
+        for key in keys:
+            results[key] = TransferResult(key, failed.get(key, True),
+                                          attempts.retries)
+
+            if key not in failed:
+                self._index_remove(key)
+
+        return results
+
+    def _copy_target(self, destination):
+        """
+        Returns (S3Bucket or None, client, bucket name) for the
+        destination argument of copy_object.
+        """
+        if destination is None:
+            return self, self.client, self.bucket_name
+        if isinstance(destination, S3Bucket):
+            return destination, destination.client, destination.bucket_name
+        return None, self.client, destination
+
+    def copy_object(self, s3_name, new_name, destination=None):
+        """
+        Copies an object on the server side, without downloading it.
+
+        usage:
+            S3Bucket.copy_object('db.bak', 'archive/db.bak')
+            S3Bucket.copy_object('db.bak', 'db.bak', destination=archive)
+
+        destination is the bucket to copy into: another S3Bucket, whose
+        client makes the copy and whose index records it, or a bucket
+        name; by default the copy stays in this bucket.  Objects of
+        servercopy.COPY_OBJECT_LIMIT (5 GB) and up are copied as
+        concurrent UploadPartCopy ranges.
+
+        returns True if Successful, or an error code.
+        """
+        target, client, bucket_name = self._copy_target(destination)
+        entry = (self.objectindex or {}).get(s3_name)
+
+        try:
+            size, etag = servercopy.copy_object(
+                client, self.bucket_name, s3_name, bucket_name, new_name,
+                size=entry.size if entry is not None else None,
+                attempts=self._attempts())
+
+        except botocore.exceptions.ClientError as error:
+            return error_code(error)
+
+        if target is not None:
+            target._index_add(new_name, size, etag)
+
+        self._local.transferred = size
+        return True
+
+    def copy_objects(self, object_list, destination=None,
+                     workers=DEFAULT_WORKERS):
+        """
+        Copies many objects on the server side, up to workers at once.
+
+        object_list is a dictionary of {"object_name": "new_name"}, or a
+        list of names kept unchanged in another destination.
+
+        returns a dictionary with results in the format:
+        {"object_name" : TransferResult}
+        """
+        if isinstance(object_list, list):
+            object_list = {name: name for name in object_list}
+
+        def _copy(s3_name, new_name):
+            return self.copy_object(s3_name, new_name, destination)
+
+        return self._run_batch(_copy, object_list, workers, 'copy')
+
+    def move_object(self, s3_name, new_name, destination=None):
+        """
+        Copies an object on the server side and deletes the original.
+
+        usage:
+            S3Bucket.move_object('db.bak', 'archive/db.bak')
+
+        returns True if Successful, or an error code.
+        """
+        outcome = self.copy_object(s3_name, new_name, destination)
+
+        if outcome is not True or self._is_same(s3_name, new_name, destination):
+            return outcome
+
+        return self.delete_object(s3_name)
+
+    def move_objects(self, object_list, destination=None,
+                     workers=DEFAULT_WORKERS):
+        """
+        Moves many objects with copy_objects, then deletes the originals
+        that were copied with batched DeleteObjects requests.
+
+        returns a dictionary with results in the format:
+        {"object_name" : TransferResult}
+        """
+        if isinstance(object_list, list):
+            object_list = {name: name for name in object_list}
+
+        results = self.copy_objects(object_list, destination, workers)
+        copied = [name for name in results if results[name] and
+                  not self._is_same(name, object_list[name], destination)]
+
+        for name, deleted in self.delete_objects(copied, workers).items():
+            if not deleted:
+                results[name] = TransferResult(name, deleted.error,
+                                               results[name].retries)
+
+        return results
+
+    def _is_same(self, s3_name, new_name, destination):
+        """
+        Checks whether a copy went onto its own source, which must not
+        then be deleted.
+        """
+        return (s3_name == new_name and
+                self._copy_target(destination)[2] == self.bucket_name)
+
+
+def upload_job(bucket, local_path, workers=DEFAULT_WORKERS, config='auto',
+               prefix='', compression=None, action='resumable'):
+    """
+    Uploads the new and changed files under local_path to bucket, as
+    resumable uploads or with another multipart_transfer action such as
+    'dedup', keyed by prefix plus their relative names.  Uploads start
+    while the rest of the tree is still being scanned.  config is passed
+    on to multipart_transfer, and compression as its codec.
+
+    returns a dictionary with results in the format:
+    {"file_object" : TransferResult}
+    """
+    return syncplan.stream_upload(profiling.timed('scan',
+                                                  scanner.scan(local_path)),
+                                  bucket, workers=workers, action=action,
+                                  config=config, prefix=prefix,
+                                  compression=compression)
+
+
+def watch_upload_job(bucket, local_path, workers, stop, config='auto',
+                     prefix='', compression=None, action='resumable'):
+    """
+    Uploads the files created or changed under local_path, under
+    prefix and as upload_job does, as soon as they have stopped changing
+    (see watch.py), until stop is set.  The tree is scanned once more
+    after the watch is set up, for files written since the last full
+    run; the bucket is not listed again, as files are compared with the
+    bucket's index, which is kept up to date by the uploads.
+    """
+    def _upload(files):
+        # the files have been quiet for watch.QUIET_PERIOD
+        results = syncplan.stream_upload(files, bucket, workers=workers,
+                                         action=action, config=config,
+                                         stable=True, prefix=prefix,
+                                         compression=compression)
+        for item in results:
+            print(results[item])
+
+    watch.watch(local_path, _upload, stop, rescan=True)
+
 
 def main():
     """
@@ -324,29 +1217,44 @@ def main():
            ii.  if no create an update list
        c.  upload all files that don't exist in the Destination
        d.  report to datadog that all files are up to date.
-    """
-
-    #  Generate Configuration Data
-    auth = admin.KeySecret(source='.s32.secret')
 
-    local_path = os.path.normcase(r"/Program Files/Microsoft SQL Server/MSSQL10_50.MSSQLSERVER/MSSQL/Backup/test/")
-    mybucket = "mtkbackup"
-    jobs = {local_path: mybucket}
+    With --config the pairs are read from the Config.job file and run
+    concurrently under one transfer budget; --daemon repeats them every
+    Config.interval seconds (see scheduler.py), and --watch uploads new
+    and changed files as they appear (see watch.py).  Transfer metrics, and
+    whether each job is up to date, go to the StatsD server or
+    Prometheus textfile the config names (see metrics.py).  --profile
+    times the scan, listing, diff and transfer phases of the run and
+    prints where the time went, optionally profiling it with cProfile or
+    a sampling profiler too (see profiling.py).  --part-size,
+    --multipart-threshold and --max-concurrency set the transfer
+    settings of every job; a job file line can override them for its
+    own job (see scheduler.py), as can --compression, which compresses
+    uploads with gzip or zstd (see compression.py).  --mmap sends the
+    files --watch found quiet from a memory mapping (see mapped.py).
+    """
 
-    for key in jobs:
-        bucket = S3Bucket(auth=auth, bucket_name=jobs[key])
+    parser = cli.parser("Uploads local directories to S3 buckets.",
+                        's3upload-profile', watch=True)
+    parser.add_argument('--compression', choices=compression.CODECS,
+                        help="compress uploads on the fly (default: none)")
+    parser.add_argument('--mmap', action='store_true',
+                        help="with --watch, send files from a memory mapping; "
+                        "a file truncated meanwhile kills the process")
+    args = parser.parse_args()
+
+    def _bucket(bucket_name, budget, **arguments):
+        bucket = S3Bucket(bucket_name=bucket_name,
+                          cache_dir=manifest.DEFAULT_CACHE_DIR,
+                          list_workers=DEFAULT_WORKERS, adaptive=True,
+                          budget=budget, mmap=args.mmap,
+                          compression=args.compression, **arguments)
         print(bucket.init())
-        local_files = listdirectory(key)
-        print("local files: {0}".format(local_files))
-        # s3_files = list_s3files(jobs[key], auth.key,
-        #                        auth.secret)
-        print("remote files: {0}".format(bucket.objectlist))
-        input("type 0oS0bVxxXl||1sdfaksfoijs4fasi;jjdsfdalsjf;afejfwjfka;s to continue")
-        to_upload_list = filelist_diff(local_files, bucket.objectlist)
-        for item in to_upload_list:
-            print(item)
-            if item[0] != ".":
-                bucket.multipart_transfer(item, os.path.normcase(local_path+item), "upload")
+        print("remote files: {0}".format(len(bucket.objectlist or ())))
+        print("aborted stale uploads: {0}".format(bucket.abort_stale_uploads()))
+        return bucket
+
+    cli.run(args, upload_job, _bucket, watch_job=watch_upload_job)
 
 
 if __name__ == "__main__":
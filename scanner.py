@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+scanner.py - walks a local directory tree with os.scandir.
+
+scan() is a generator, so callers can start work on the first files
+while the rest of the tree is still being read.  Each file is yielded
+as a syncplan.LocalFile built from the stat data scandir already has,
+named by its path relative to the root with '/' separators so the name
+can be used as an S3 key.
+
+usage:
+
+    for entry in scanner.scan('/backups/', include=['*.bak']):
+        print(entry.name, entry.size)
+"""
+
+import os
+from fnmatch import fnmatch
+from syncplan import LocalFile
+
+
+def _matches(name, patterns):
+    return any(fnmatch(name, pattern) for pattern in patterns)
+
+
+def scan(local_path, include=None, exclude=None, skip_hidden=True,
+         recursive=True):
+    """
+    Yields a LocalFile for every regular file under local_path.
+
+    include and exclude are lists of fnmatch patterns tested against
+    the relative name; a file is yielded if it matches any include
+    pattern (or none are given) and no exclude pattern.  Directories
+    matching an exclude pattern are not descended into.  Names starting
+    with '.' are skipped unless skip_hidden is False.
+
+    Raises OSError if local_path cannot be read; unreadable directories
+    further down are skipped.
+    """
+    include = include or ()
+    exclude = exclude or ()
+    pending = [('', local_path)]
+    top = True
+
+    while pending:
+        prefix, directory = pending.pop()
+
+        try:
+            entries = os.scandir(directory)
+
+        except OSError:
+            if top:
+                raise
+            continue
+
+        top = False
+        subdirectories = []
+
+        with entries:
+            for entry in entries:
+                if skip_hidden and entry.name.startswith('.'):
+                    continue
+
+                name = prefix + entry.name
+
+                if exclude and _matches(name, exclude):
+                    continue
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            subdirectories.append((name + '/', entry.path))
+                        continue
+
+                    if not entry.is_file():
+                        continue
+
+                    stat = entry.stat()
+
+                except OSError:
+                    continue
+
+                if include and not _matches(name, include):
+                    continue
+
+                yield LocalFile(name, entry.path, stat.st_size, stat.st_mtime)
+
+        # depth first, visiting subdirectories in the order they were seen
+        pending.extend(reversed(subdirectories))
@@ -0,0 +1,390 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+scheduler.py - runs many path -> bucket jobs, once or as a daemon.
+
+The jobs come from the job file named by admin.Config.job, one per line:
+
+    # bucket      [setting=value ...]           local path
+    mtkbackup     part_size=64MB                /Program Files/Microsoft SQL Server/MSSQL/Backup/
+    archive       prefix=exports action=dedup   /srv/exports
+    archive       prefix=logs compression=zstd  /var/log/app
+
+A job's transfer settings (TRANSFER_SETTINGS) override the Scheduler's
+config for that job's transfers; both are transfer_config() settings in
+s3upload.py, and whatever neither sets is picked from each file's size.
+Its other settings are passed to the job itself: prefix puts the job's
+objects under a key prefix of their own, so several jobs can share a
+bucket, compression (gzip, zstd or none) overrides the bucket's
+compression for the job's uploads, and action=dedup stores the job's
+files as deduplicated chunks (see dedup.py) instead of resumable
+multipart uploads.  Jobs whose keys would overlap are rejected.
+
+Jobs run concurrently, but every bucket shares one transfer budget - a
+semaphore S3Bucket takes a slot of for each file it transfers - so the
+total number of files in flight stays the same however many jobs there
+are.  In daemon mode the jobs are repeated every Config.interval
+seconds.  The S3Bucket objects, and with them the shared clients and
+connection pools, key indexes and manifests, are kept between cycles,
+so a cycle starts with a warm index instead of listing every bucket.
+In watch mode the jobs run once and are then kept up to date from
+filesystem events (see watch.py) instead of rescanning on a timer.
+
+usage:
+
+    runner = Scheduler(load_jobs('jobs.txt'), upload_job, make_bucket)
+    runner.run_once()
+    runner.run_forever()
+    runner.watch(watch_upload_job)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import compression
+
+
+# files transferred at once across every job
+DEFAULT_BUDGET = 16
+
+# seconds between daemon cycles when the config has no interval
+DEFAULT_INTERVAL = 3600
+
+SIZE_UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+LOG = logging.getLogger('s3upload.scheduler')
+
+# options is a tuple of (setting, value) pairs, so a Job stays hashable
+Job = namedtuple('Job', 'bucket_name local_path options', defaults=((),))
+
+
+def parse_size(value):
+    """
+    Returns the bytes in a size such as '64MB', '1GB' or '8388608'.
+    """
+    value = value.strip().upper()
+
+    for unit, scale in SIZE_UNITS.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * scale)
+
+    return int(value)
+
+
+def parse_prefix(value):
+    """
+    Returns a key prefix such as 'exports' as 'exports/', or '' for the
+    bucket root.
+    """
+    value = value.strip('/')
+    return value + '/' if value else ''
+
+
+# the multipart_transfer actions an upload job can use
+UPLOAD_ACTIONS = ('resumable', 'upload', 'dedup')
+
+
+def parse_action(value):
+    """
+    Returns an action from UPLOAD_ACTIONS.
+    """
+    if value not in UPLOAD_ACTIONS:
+        raise ValueError("unknown action {0!r}".format(value))
+    return value
+
+
+def parse_compression(value):
+    """
+    Returns a codec from compression.CODECS, or 'none'.
+    """
+    if value != 'none' and value not in compression.CODECS:
+        raise ValueError("unknown compression codec {0!r}".format(value))
+    return value
+
+
+# the transfer_config() settings a job file line can set
+TRANSFER_SETTINGS = {'part_size': parse_size, 'multipart_threshold': parse_size,
+                     'max_concurrency': int, 'io_queue_size': int}
+
+# every setting a job file line can set; those that are not transfer
+# settings are passed to run_job and watch_job as keyword arguments
+JOB_SETTINGS = dict(TRANSFER_SETTINGS, prefix=parse_prefix,
+                    compression=parse_compression, action=parse_action)
+
+
+def load_jobs(job_file):
+    """
+    Reads a job file of "bucket [setting=value ...] local_path" lines;
+    blank lines and lines starting with '#' are skipped.  The settings
+    are those in JOB_SETTINGS, and the rest of the line, spaces and
+    all, is the path.  Two jobs may only share a bucket if neither's
+    prefix contains the other's, or they would overwrite each other's
+    objects.
+
+    returns a list of Job
+    """
+    jobs = []
+    prefixes = {}
+
+    with open(job_file, 'r') as source:
+        for number, line in enumerate(source, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            fields = line.split(None, 1)
+            if len(fields) != 2:
+                raise ValueError("{0} line {1}: expected 'bucket local_path'"
+                                 .format(job_file, number))
+
+            bucket_name, local_path = fields
+            options = []
+
+            while True:
+                fields = local_path.split(None, 1)
+                setting, equals, value = fields[0].partition('=')
+                if not equals or setting not in JOB_SETTINGS:
+                    break
+                if len(fields) != 2:
+                    raise ValueError("{0} line {1}: expected 'bucket "
+                                     "local_path'".format(job_file, number))
+
+                try:
+                    options.append((setting, JOB_SETTINGS[setting](value)))
+                except ValueError:
+                    raise ValueError("{0} line {1}: bad {2} {3!r}".format(
+                        job_file, number, setting, value))
+
+                local_path = fields[1]
+
+            prefix = dict(options).get('prefix', '')
+            for other, other_number in prefixes.get(bucket_name, ()):
+                if prefix.startswith(other) or other.startswith(prefix):
+                    raise ValueError("{0} line {1}: {2}/{3} overlaps the "
+                                     "job on line {4}; give each job its own "
+                                     "prefix".format(job_file, number,
+                                                     bucket_name, prefix,
+                                                     other_number))
+            prefixes.setdefault(bucket_name, []).append((prefix, number))
+
+            jobs.append(Job(bucket_name, os.path.normcase(local_path),
+                            tuple(options)))
+
+    return jobs
+
+
+def configure_logging(config):
+    """
+    Sends log records to config.logfile, at config.loglevel, if set.
+    """
+    level = getattr(logging, str(config.loglevel or 'INFO').upper(),
+                    logging.INFO)
+    logging.basicConfig(filename=config.logfile or None, level=level,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+
+class Scheduler(object):
+    """
+    Runs jobs under one transfer budget.
+
+    usage:
+
+        Scheduler(jobs, run_job, make_bucket, budget=16, interval=3600)
+
+    run_job(bucket, local_path, workers, config, **arguments) performs
+    one job and returns its {name: TransferResult} results; config is
+    the job's transfer_config() settings - config overlaid with the
+    job's own - or 'auto' if there are none, and arguments the job's
+    other settings, such as prefix.  make_bucket(bucket_name,
+    budget) returns a ready S3Bucket using the budget semaphore; it is
+    called once per bucket name and the bucket is reused from then on.
+
+    With metrics (a metrics.Emitter) every job reports its duration,
+    files and failures, and job.up_to_date: 1 once a run has left
+    nothing behind, 0 if a transfer failed.
+    """
+    def __init__(self, jobs, run_job, make_bucket, budget=DEFAULT_BUDGET,
+                 interval=None, metrics=None, config=None):
+
+        self.jobs = list(jobs)
+        self.run_job = run_job
+        self.make_bucket = make_bucket
+        self.workers = budget
+        self.budget = threading.BoundedSemaphore(budget)
+        self.interval = int(interval or DEFAULT_INTERVAL)
+        self.buckets = {}
+        self.metrics = metrics
+        self.config = dict(config or {})
+        self.cycles = 0
+        self._checked = {}
+        self._building = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def bucket(self, bucket_name):
+        """
+        Returns the S3Bucket for bucket_name, creating it the first time.
+
+        From the second cycle on, the first job of a cycle to use a
+        bucket calls exists() on it, which picks up changes made by
+        others once the manifest is due to be reconciled; otherwise the
+        index is already warm.
+
+        make_bucket lists the bucket, so it runs outside the scheduler's
+        lock and buckets start up concurrently; jobs sharing a bucket
+        wait for the one building it.  If it fails, those jobs fail with
+        it and the next cycle tries again.
+        """
+        with self._lock:
+            building = self._building.get(bucket_name)
+            owner = building is None
+            if owner:
+                building = self._building[bucket_name] = Future()
+
+        if owner:
+            try:
+                bucket = self.make_bucket(bucket_name, self.budget)
+            except BaseException as error:
+                with self._lock:
+                    del self._building[bucket_name]
+                building.set_exception(error)
+                raise
+
+            with self._lock:
+                self.buckets[bucket_name] = bucket
+                self._checked[bucket_name] = self.cycles
+            building.set_result(bucket)
+
+        bucket = building.result()
+
+        with self._lock:
+            check = self._checked[bucket_name] != self.cycles
+            self._checked[bucket_name] = self.cycles
+
+        if check:
+            bucket.exists()
+
+        return bucket
+
+    def transfer_config(self, job):
+        """
+        Returns the transfer settings for job's transfers.
+        """
+        settings = dict(self.config)
+        settings.update((setting, value) for setting, value in job.options
+                        if setting in TRANSFER_SETTINGS)
+        return settings or 'auto'
+
+    @staticmethod
+    def job_arguments(job):
+        """
+        Returns the settings of job that are passed to it as keyword
+        arguments.
+        """
+        return {setting: value for setting, value in job.options
+                if setting not in TRANSFER_SETTINGS}
+
+    def _run(self, job):
+        start = time.monotonic()
+        bucket = self.bucket(job.bucket_name)
+        results = self.run_job(bucket, job.local_path, self.workers,
+                               self.transfer_config(job),
+                               **self.job_arguments(job))
+        failed = [name for name in results if not results[name]]
+        seconds = time.monotonic() - start
+
+        LOG.info("%s -> %s: %d transferred, %d failed in %.1fs",
+                 job.local_path, job.bucket_name, len(results) - len(failed),
+                 len(failed), seconds)
+        for name in failed:
+            LOG.warning("%s: %r", job.bucket_name, results[name])
+
+        if self.metrics is not None:
+            tags = {'bucket': job.bucket_name, 'path': job.local_path}
+            self.metrics.emit('job.duration', round(seconds * 1000, 3),
+                              'timing', tags)
+            self.metrics.emit('job.files', len(results), 'count', tags)
+            self.metrics.emit('job.failed', len(failed), 'count', tags)
+            self.metrics.emit('job.up_to_date', 0 if failed else 1, 'gauge',
+                              tags)
+
+        return results
+
+    def run_once(self):
+        """
+        Runs every job once, concurrently.
+
+        returns {Job: results}, where a job that raised has the
+        exception as its results.
+        """
+        outcomes = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.jobs))) as pool:
+            futures = {pool.submit(self._run, job): job for job in self.jobs}
+
+            for future, job in futures.items():
+                try:
+                    outcomes[job] = future.result()
+
+                except Exception as error:  # pylint: disable=broad-except
+                    LOG.exception("%s -> %s failed", job.local_path,
+                                  job.bucket_name)
+                    outcomes[job] = error
+
+                    if self.metrics is not None:
+                        self.metrics.emit('job.up_to_date', 0, 'gauge',
+                                          {'bucket': job.bucket_name,
+                                           'path': job.local_path})
+
+        self.cycles += 1
+        return outcomes
+
+    def run_forever(self):
+        """
+        Repeats run_once every interval seconds, measured from the start
+        of each cycle, until stop() is called.
+        """
+        while not self._stop.is_set():
+            start = time.monotonic()
+            self.run_once()
+            self._stop.wait(max(0, self.interval - (time.monotonic() - start)))
+
+    def watch(self, watch_job):
+        """
+        Runs every job once, then keeps each one up to date from
+        filesystem events until stop() is called.
+
+        watch_job(bucket, local_path, workers, stop, config, **arguments)
+        watches local_path and uploads what changes until the stop event
+        is set; it runs on a thread of its own per job.  Files written after
+        run_once scanned a tree but before its watch started raise no
+        events, so watch_job has to rescan the tree once its watch is
+        set up (see watch.watch's rescan).
+        """
+        self.run_once()
+
+        def _watch(job):
+            bucket = self.bucket(job.bucket_name)
+            while not self._stop.is_set():
+                try:
+                    watch_job(bucket, job.local_path, self.workers, self._stop,
+                              self.transfer_config(job),
+                              **self.job_arguments(job))
+                except Exception:  # pylint: disable=broad-except
+                    LOG.exception("watching %s -> %s failed", job.local_path,
+                                  job.bucket_name)
+                    self._stop.wait(self.interval)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.jobs))) as pool:
+            for future in [pool.submit(_watch, job) for job in self.jobs]:
+                future.result()
+
+    def stop(self):
+        """
+        Ends run_forever after the cycle in progress, or watch once the
+        watchers notice.
+        """
+        self._stop.set()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+servercopy.py - copies objects inside S3 without passing the data
+through this host.
+
+Objects below COPY_OBJECT_LIMIT are copied with a single CopyObject.
+Bigger ones, which CopyObject refuses, are copied as a multipart upload
+whose parts are UploadPartCopy requests for byte ranges of the source,
+sent concurrently.  The parts are copied with CopySourceIfMatch on the
+source's ETag, so a source replaced mid-copy fails the copy instead of
+producing a mix of two versions.  A multipart copy doesn't carry the
+source's metadata over by itself, so its content headers and user
+metadata are set on the new upload.
+
+usage:
+
+    copy_object(client, 'backups', 'db.bak', 'archive', '2024/db.bak')
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import botocore.exceptions
+import retry
+
+
+MB = 1024 * 1024
+
+# the largest object a single CopyObject request can copy
+COPY_OBJECT_LIMIT = 5 * 1024 * MB
+
+# ranges copied per UploadPartCopy; the data never reaches this host,
+# so parts are much bigger than for uploads
+COPY_PART_SIZE = 512 * MB
+MAX_PARTS = 10000
+
+# parts of one object copied at once
+COPY_WORKERS = 16
+
+# headers a multipart copy has to set again on the new object
+_CONTENT_HEADERS = ('CacheControl', 'ContentDisposition', 'ContentEncoding',
+                    'ContentLanguage', 'ContentType', 'Metadata')
+
+
+def _part_size(size, part_size):
+    return max(part_size, -(-size // MAX_PARTS))
+
+
+def copy_object(client, source_bucket, source_key, bucket_name, s3_name,
+                size=None, part_size=COPY_PART_SIZE, workers=COPY_WORKERS,
+                multipart_threshold=COPY_OBJECT_LIMIT, attempts=None):
+    """
+    Copies source_bucket/source_key to bucket_name/s3_name on the server.
+
+    size is the size of the source if known; otherwise it is looked up.
+    With attempts (see retry.py) each request, and each part, is retried
+    on its own.
+
+    returns (size, etag) of the new object.
+    """
+    head = None
+    if size is None:
+        head = retry.call(attempts, client.head_object, Bucket=source_bucket,
+                          Key=source_key)
+        size = head['ContentLength']
+
+    source = {'Bucket': source_bucket, 'Key': source_key}
+
+    if size < multipart_threshold:
+        response = retry.call(attempts, client.copy_object, CopySource=source,
+                              Bucket=bucket_name, Key=s3_name)
+        return size, response['CopyObjectResult'].get('ETag')
+
+    if head is None:
+        head = retry.call(attempts, client.head_object, Bucket=source_bucket,
+                          Key=source_key)
+
+    arguments = {header: head[header] for header in _CONTENT_HEADERS
+                 if head.get(header)}
+    upload_id = retry.call(attempts, client.create_multipart_upload,
+                           Bucket=bucket_name, Key=s3_name,
+                           **arguments)['UploadId']
+    part_size = _part_size(size, part_size)
+
+    def _copy_part(number):
+        start = (number - 1) * part_size
+        last = min(start + part_size, size) - 1
+        response = client.upload_part_copy(
+            Bucket=bucket_name, Key=s3_name, UploadId=upload_id,
+            PartNumber=number, CopySource=source,
+            CopySourceIfMatch=head['ETag'],
+            CopySourceRange='bytes={0}-{1}'.format(start, last))
+        return {'PartNumber': number,
+                'ETag': response['CopyPartResult']['ETag']}
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(
+                lambda number: retry.call(attempts, _copy_part, number),
+                range(1, -(-size // part_size) + 1)))
+
+        response = retry.call(attempts, client.complete_multipart_upload,
+                              Bucket=bucket_name, Key=s3_name,
+                              UploadId=upload_id,
+                              MultipartUpload={'Parts': parts})
+
+    except Exception:
+        # a copy has nothing worth resuming locally; don't leave its
+        # parts behind to be billed
+        try:
+            client.abort_multipart_upload(Bucket=bucket_name, Key=s3_name,
+                                          UploadId=upload_id)
+        except botocore.exceptions.ClientError:
+            pass
+        raise
+
+    return size, response.get('ETag')
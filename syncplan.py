@@ -0,0 +1,276 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+syncplan.py - works out which files need to move between a local
+directory and an S3 bucket.
+
+Local files and remote objects are both indexed by name in
+dictionaries, so building a plan is linear in the number of entries.
+A file counts as changed when its size differs, when the newer side was
+modified after the other, or - optionally - when its MD5 no longer
+matches a single part ETag.
+
+usage:
+
+    local = syncplan.local_index('/backups/', listdirectory('/backups/'))
+    plan = syncplan.plan_upload(local, bucket.objectindex)
+    print(plan)
+    results = plan.execute(bucket)
+
+or, to start uploading while a directory is still being scanned:
+
+    syncplan.stream_upload(scanner.scan('/backups/'), bucket)
+"""
+
+import hashlib
+import os
+from collections import namedtuple
+import dedup
+import profiling
+
+
+# one entry of a bucket's key index, mirroring the ObjectSummary fields
+RemoteObject = namedtuple('RemoteObject', 'key size etag last_modified')
+
+# a local file, keyed in the local index by the name used as its S3 key
+LocalFile = namedtuple('LocalFile', 'name path size mtime')
+
+# one entry of a plan; local or remote is None when that side is missing
+SyncItem = namedtuple('SyncItem', 'name local remote')
+
+
+def local_index(local_path, names):
+    """
+    Builds a {name: LocalFile} index for the given file names in
+    local_path.  Files that vanish before they can be stat'ed are left
+    out.
+
+    usage:
+
+        local_index('local_path', ['file1', 'file2'])
+    """
+    index = {}
+
+    for name in names or ():
+        path = os.path.join(local_path, name)
+
+        try:
+            stat = os.stat(path)
+
+        except OSError:
+            continue
+
+        index[name] = LocalFile(name, path, stat.st_size, stat.st_mtime)
+
+    return index
+
+
+def file_md5(path, blocksize=1024 * 1024):
+    """
+    Returns the quoted hex MD5 of a file, in the form S3 uses for the
+    ETag of an object uploaded in a single part.
+    """
+    digest = hashlib.md5()
+
+    with open(path, 'rb') as data:
+        for block in iter(lambda: data.read(blocksize), b''):
+            digest.update(block)
+
+    return '"{0}"'.format(digest.hexdigest())
+
+
+def to_timestamp(value):
+    """
+    Returns a POSIX timestamp for a datetime or a number.
+    """
+    if value is None:
+        return None
+    if hasattr(value, 'timestamp'):
+        return value.timestamp()
+    return float(value)
+
+
+def _etag_differs(local, remote):
+    """
+    Compares a local file's MD5 with the ETag of a remote object.
+    Multipart ETags (containing a '-') are not an MD5 of the content and
+    never count as a difference.
+    """
+    if not remote.etag or '-' in remote.etag:
+        return False
+    return file_md5(local.path) != remote.etag
+
+
+class SyncPlan(object):
+    """
+    The result of comparing a local and a remote index.
+
+    new, changed and unchanged are lists of SyncItem.  The plan can be
+    inspected before calling execute() to carry it out.
+
+    usage:
+
+        plan = SyncPlan('upload', local_path='/backups/')
+        plan.execute(bucket, workers=8)
+    """
+    def __init__(self, action, local_path=None):
+
+        self.action = action
+        self.local_path = local_path
+        self.new = []
+        self.changed = []
+        self.unchanged = []
+
+    def pending(self):
+        """
+        Returns the items that need to be transferred.
+        """
+        return self.new + self.changed
+
+    def transfers(self):
+        """
+        Returns the pending items as the {file_object: s3_name}
+        dictionary taken by S3Bucket.multipart_transfers.
+        """
+        transfers = {}
+
+        for item in self.pending():
+            if self.action == 'upload':
+                transfers[item.local.path] = item.name
+            else:
+                path = item.local.path if item.local else os.path.join(
+                    self.local_path, item.name)
+                transfers[item.remote.key] = path
+
+        return transfers
+
+    def execute(self, bucket, workers=1, action=None, config='auto'):
+        """
+        Transfers every new and changed item through the given S3Bucket.
+        action overrides the multipart_transfer action, e.g. 'resumable'
+        for uploads, and config is passed on to multipart_transfer.
+
+        returns a dictionary with results in the format:
+        {"file_object" : TransferResult}
+        """
+        return bucket.multipart_transfers(self.transfers(),
+                                          action or self.action,
+                                          workers=workers, config=config)
+
+    def __repr__(self):
+        return "SyncPlan({0}: {1} new, {2} changed, {3} unchanged)".format(
+            self.action, len(self.new), len(self.changed), len(self.unchanged))
+
+
+def upload_state(local, remote, checksum=False, compare_size=True):
+    """
+    Compares a LocalFile with the RemoteObject of the same name, which
+    may be None, and returns 'new', 'changed' or 'unchanged'.
+
+    compare_size=False skips the size check, for objects stored
+    compressed.
+    """
+    if remote is None:
+        return 'new'
+    if compare_size and local.size != remote.size:
+        return 'changed'
+    if int(local.mtime) > (to_timestamp(remote.last_modified) or 0):
+        # LastModified only has whole seconds
+        return 'changed'
+    if checksum and compare_size and _etag_differs(local, remote):
+        return 'changed'
+    return 'unchanged'
+
+
+def plan_upload(local, remote, checksum=False, compare_size=True):
+    """
+    Plans an upload of the local index to a bucket.
+
+    local is a {name: LocalFile} index and remote the bucket's
+    {key: RemoteObject} index.  With checksum=True files whose size and
+    time match are also hashed and compared with single part ETags.
+    Pass compare_size=False when uploads are compressed, since the
+    remote size is then the compressed one.
+
+    returns a SyncPlan
+    """
+    plan = SyncPlan('upload')
+    remote = remote or {}
+
+    with profiling.phase('plan'):
+        for name, entry in local.items():
+            item = SyncItem(name, entry, remote.get(name))
+            state = upload_state(entry, item.remote, checksum, compare_size)
+            getattr(plan, state).append(item)
+
+    return plan
+
+
+def stream_upload(entries, bucket, workers=1, action='upload', checksum=False,
+                  config='auto', stable=False, prefix='', compression=None):
+    """
+    Uploads the new and changed files from an iterable of LocalFile,
+    such as scanner.scan(), as they are produced rather than after the
+    whole tree has been read.  Each file is stored under prefix plus
+    its name.  Sizes are not compared if the uploads are compressed,
+    and with action='dedup' files are compared with their dedup
+    manifests.  config and stable are passed on to multipart_transfer,
+    and compression as its codec.
+
+    returns a dictionary with results in the format:
+    {"file_object" : TransferResult}
+    """
+    remote = bucket.objectindex or {}
+    compare_size = (bucket.upload_codec(compression) is None and
+                    action != 'dedup')
+
+    if action == 'dedup':
+        remote = dedup.remote_files(remote)
+
+    def _pending():
+        for entry in entries:
+            with profiling.phase('diff'):
+                state = upload_state(entry, remote.get(prefix + entry.name),
+                                     checksum, compare_size)
+            if state != 'unchanged':
+                yield entry.path, prefix + entry.name
+
+    return bucket.multipart_transfers(_pending(), action, workers=workers,
+                                      config=config, stable=stable,
+                                      codec=compression)
+
+
+def plan_download(remote, local, local_path, checksum=False,
+                  compare_size=True):
+    """
+    Plans a download of a bucket's {key: RemoteObject} index into
+    local_path, given the {name: LocalFile} index of what is already
+    there.  Pass compare_size=False when objects may be stored
+    compressed.
+
+    returns a SyncPlan
+    """
+    plan = SyncPlan('download', local_path=local_path)
+    local = local or {}
+
+    with profiling.phase('plan'):
+        for name, entry in (remote or {}).items():
+            if name.endswith('/'):
+                # folder placeholder objects have nothing to download
+                continue
+
+            item = SyncItem(name, local.get(name), entry)
+
+            if item.local is None:
+                plan.new.append(item)
+            elif compare_size and entry.size != item.local.size:
+                plan.changed.append(item)
+            elif (to_timestamp(entry.last_modified) or 0) > item.local.mtime:
+                plan.changed.append(item)
+            elif checksum and compare_size and _etag_differs(item.local,
+                                                             entry):
+                plan.changed.append(item)
+            else:
+                plan.unchanged.append(item)
+
+    return plan
@@ -0,0 +1,55 @@
+# coding=utf-8
+"""
+Fixtures shared by the tests: a moto S3 server started once per run,
+and an empty bucket on it for each test that asks for one.
+"""
+
+import logging
+import os
+import socket
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import admin  # noqa: E402
+import s3upload  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def endpoint_url():
+    """
+    Starts a moto server on a free local port for the whole run.
+    """
+    server_module = pytest.importorskip('moto.server')
+
+    # keep the server's access log out of the test output
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    server = server_module.ThreadedMotoServer(ip_address='127.0.0.1',
+                                              port=port, verbose=False)
+    server.start()
+    yield 'http://127.0.0.1:{0}'.format(port)
+    server.stop()
+
+
+@pytest.fixture
+def bucket(endpoint_url, tmp_path):
+    """
+    Returns an S3Bucket for a new, empty bucket.
+    """
+    name = 'test-' + uuid.uuid4().hex[:16]
+    s3bucket = s3upload.S3Bucket(admin.KeySecret(key='test', secret='test'),
+                                 name, region='us-east-1',
+                                 endpoint_url=endpoint_url,
+                                 journal_dir=str(tmp_path / 'journal'))
+    s3bucket.client.create_bucket(Bucket=name)
+    s3bucket.init()
+    return s3bucket
@@ -0,0 +1,43 @@
+# coding=utf-8
+"""
+Tests for admin.py's configuration and credential files.
+"""
+
+import admin
+
+
+def test_config_values_are_kept_whole(tmp_path):
+    path = tmp_path / 's3upload.conf'
+    path.write_text("# settings\n"
+                    "job: /etc/s3upload/jobs.txt\n"
+                    "logfile: C:\\Program Files\\s3upload\\run log.txt\n"
+                    "keyfile:/etc/s3upload/interval.secret\n"
+                    "interval : 3600\n"
+                    "reconcile_interval: 600\n"
+                    "prometheus_file: /var/lib/node_exporter/s3upload.prom\n"
+                    "statsd_host: 127.0.0.1\n"
+                    "unknown: value\n")
+
+    config = admin.Config(config=str(path))
+
+    assert config.job == '/etc/s3upload/jobs.txt'
+    assert config.logfile == 'C:\\Program Files\\s3upload\\run log.txt'
+    assert config.keyfile == '/etc/s3upload/interval.secret'
+    assert config.interval == '3600'
+    assert config.reconcile_interval == '600'
+    assert config.prometheus_file == '/var/lib/node_exporter/s3upload.prom'
+    assert config.statsd_host == '127.0.0.1'
+    assert config.statsd_port is None
+    assert not hasattr(config, 'unknown')
+
+
+def test_key_secret_file(tmp_path):
+    path = tmp_path / '.s32.secret'
+    path.write_text("key: AKIAEXAMPLE\n"
+                    "secret: wJalr/XUtnFEMI+K7MDENG:key\n")
+
+    auth = admin.KeySecret(source=str(path))
+
+    assert auth.key == 'AKIAEXAMPLE'
+    assert auth.secret == 'wJalr/XUtnFEMI+K7MDENG:key'
+    assert auth.cfile == str(path)
@@ -0,0 +1,122 @@
+# coding=utf-8
+"""
+Tests for cli.py: the options and run loop shared by s3upload.py and
+s3download.py.
+"""
+
+import sys
+
+import pytest
+
+import cli
+import s3download
+import s3upload
+
+MB = s3upload.MB
+
+
+def test_parser_common_options():
+    args = cli.parser("test", 'test-profile').parse_args(
+        ['--config', 's3.conf', '--daemon', '--part-size', '64MB',
+         '--max-concurrency', '4'])
+
+    assert args.config == 's3.conf'
+    assert args.daemon
+    assert args.profile is None and args.profile_out == 'test-profile'
+    assert cli.transfer_settings(args) == {'part_size': 64 * MB,
+                                           'max_concurrency': 4}
+    assert not hasattr(args, 'watch')
+
+    with pytest.raises(SystemExit):
+        cli.parser("test", 'test-profile').parse_args(['--watch'])
+    assert cli.parser("test", 'test-profile',
+                      watch=True).parse_args(['--watch']).watch
+
+
+class _Controller(object):
+
+    def report(self):
+        return {}
+
+
+class _Bucket(object):
+
+    def __init__(self, bucket_name, **arguments):
+        self.bucket_name = bucket_name
+        self.arguments = arguments
+        self.controller = _Controller()
+
+    def exists(self):
+        return True
+
+
+def test_run_reads_jobs_and_credentials_from_config(tmp_path, capsys):
+    (tmp_path / 'jobs.txt').write_text("one  part_size=64MB  /srv/one\n"
+                                       "two  prefix=b  /srv/two\n")
+    (tmp_path / 'keys').write_text("key: AKIAEXAMPLE\nsecret: secret\n")
+    (tmp_path / 's3.conf').write_text(
+        "job: {0}\nkeyfile: {1}\n".format(tmp_path / 'jobs.txt',
+                                          tmp_path / 'keys'))
+    args = cli.parser("test", 'test-profile').parse_args(
+        ['--config', str(tmp_path / 's3.conf'), '--max-concurrency', '2'])
+    buckets = []
+    calls = []
+
+    def _make_bucket(bucket_name, budget, **arguments):
+        buckets.append(_Bucket(bucket_name, **arguments))
+        return buckets[-1]
+
+    def _run_job(bucket, local_path, workers, config, **arguments):
+        calls.append((bucket.bucket_name, config, arguments))
+        return {local_path: 'done'}
+
+    cli.run(args, _run_job, _make_bucket)
+
+    assert sorted(calls) == [
+        ('one', {'max_concurrency': 2, 'part_size': 64 * MB}, {}),
+        ('two', {'max_concurrency': 2}, {'prefix': 'b/'})]
+    assert [bucket.arguments['auth'].key for bucket in buckets] == \
+        ['AKIAEXAMPLE'] * 2
+    assert all(bucket.arguments['metrics'] is None for bucket in buckets)
+    assert 'reconcile_interval' not in buckets[0].arguments
+    assert capsys.readouterr().out.count('concurrency: {}') == 2
+
+
+def test_run_passes_reconcile_interval_to_buckets(tmp_path, endpoint_url):
+    (tmp_path / 'jobs.txt').write_text("one  /srv/one\n")
+    (tmp_path / 'keys').write_text("key: test\nsecret: test\n")
+    (tmp_path / 's3.conf').write_text(
+        "job: {0}\nkeyfile: {1}\nreconcile_interval: 600\n".format(
+            tmp_path / 'jobs.txt', tmp_path / 'keys'))
+    args = cli.parser("test", 'test-profile').parse_args(
+        ['--config', str(tmp_path / 's3.conf')])
+    buckets = []
+
+    def _make_bucket(bucket_name, budget, **arguments):
+        buckets.append(s3upload.S3Bucket(
+            bucket_name=bucket_name, cache_dir=str(tmp_path / 'cache'),
+            region='us-east-1', endpoint_url=endpoint_url, **arguments))
+        return _Bucket(bucket_name)
+
+    cli.run(args, lambda *args, **arguments: {}, _make_bucket)
+
+    [bucket] = buckets
+    assert bucket.manifest.reconcile_interval == 600
+
+
+@pytest.mark.parametrize('module, run_job, watch_job', [
+    (s3upload, s3upload.upload_job, s3upload.watch_upload_job),
+    (s3download, s3download.download_job, None)])
+def test_entry_points_run_through_cli(monkeypatch, module, run_job,
+                                      watch_job):
+    calls = []
+    monkeypatch.setattr(sys, 'argv', ['s3', '--part-size', '8MB'])
+    monkeypatch.setattr(cli, 'run', lambda args, *given, **options:
+                        calls.append((args, given, options)))
+
+    module.main()
+
+    [(args, (job, _), options)] = calls
+    assert job is run_job
+    assert options.get('watch_job') is watch_job
+    assert cli.transfer_settings(args) == {'part_size': 8 * MB}
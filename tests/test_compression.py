@@ -0,0 +1,61 @@
+# coding=utf-8
+"""
+Tests for compression.py through S3Bucket: per-job codecs, restoring
+compressed objects, and files that vanish before they are sent.
+"""
+
+import gzip
+import os
+
+import compression
+import s3download
+import s3upload
+
+
+def _tree(tmp_path, data):
+    (tmp_path / 'tree').mkdir()
+    (tmp_path / 'tree' / 'db.bak').write_bytes(data)
+    return str(tmp_path / 'tree')
+
+
+def test_job_compression_round_trip(bucket, tmp_path):
+    data = b'0123456789' * 100000
+    tree = _tree(tmp_path, data)
+
+    results = s3upload.upload_job(bucket, tree, compression='gzip')
+    assert all(results.values())
+
+    stored = bucket.client.get_object(Bucket=bucket.bucket_name, Key='db.bak')
+    assert stored['Metadata'][compression.CODEC_METADATA] == 'gzip'
+    assert gzip.decompress(stored['Body'].read()) == data
+
+    # compressed sizes differ from the file's, so only times are compared
+    assert s3upload.upload_job(bucket, tree, compression='gzip') == {}
+
+    bucket.decompress = True
+    results = s3download.download_job(bucket, str(tmp_path / 'restore'),
+                                      compression='gzip')
+    assert all(results.values())
+    assert (tmp_path / 'restore' / 'db.bak').read_bytes() == data
+
+
+def test_job_can_turn_bucket_compression_off(bucket, tmp_path):
+    data = os.urandom(1024)
+    bucket.compression = 'gzip'
+
+    results = s3upload.upload_job(bucket, _tree(tmp_path, data),
+                                  compression='none')
+    assert all(results.values())
+
+    stored = bucket.client.get_object(Bucket=bucket.bucket_name, Key='db.bak')
+    assert compression.CODEC_METADATA not in stored['Metadata']
+    assert stored['Body'].read() == data
+
+
+def test_vanished_file_is_a_failed_transfer(bucket, tmp_path):
+    bucket.compression = 'gzip'
+    missing = str(tmp_path / 'missing')
+
+    assert isinstance(bucket.add_object(missing, 'missing'), OSError)
+    assert isinstance(bucket.multipart_transfer(missing, 'missing', 'upload'),
+                      OSError)
@@ -0,0 +1,58 @@
+# coding=utf-8
+"""
+Tests for concurrency.py: the AIMD limit and the part size scale.
+"""
+
+import concurrency
+
+
+def _clean_windows(controller, windows):
+    for _ in range(windows):
+        for _ in range(controller.limit):
+            controller.acquire()
+            controller.release(0.01, 1024)
+
+
+def test_throttle_halves_limit_and_scales_parts():
+    controller = concurrency.AdaptiveController(initial=16, maximum=64)
+
+    controller.acquire()
+    controller.release(0.01, throttled=True)
+
+    assert controller.limit == 8
+    assert controller.part_scale == 2
+    assert controller.part_size(8, 1024) == 16
+
+    # the requests in flight with the first throttle don't cut again
+    controller.acquire()
+    controller.release(0.01, throttled=True)
+    assert controller.limit == 8
+    assert controller.part_scale == 2
+
+
+def _throttle(controller):
+    controller.acquire()
+    controller.release(0.01, throttled=True)
+
+
+def test_part_scale_recovers_after_clean_windows():
+    controller = concurrency.AdaptiveController(initial=16, maximum=64)
+
+    _throttle(controller)
+    _clean_windows(controller, concurrency.CLEAN_WINDOWS - 1)
+    assert controller.part_scale == 2
+
+    # a throttle starts the count again
+    _throttle(controller)
+    assert controller.part_scale == 4
+    _clean_windows(controller, concurrency.CLEAN_WINDOWS - 1)
+    assert controller.part_scale == 4
+
+    _clean_windows(controller, 1)
+    assert controller.part_scale == 2
+    _clean_windows(controller, concurrency.CLEAN_WINDOWS)
+    assert controller.part_scale == 1
+
+    _clean_windows(controller, concurrency.CLEAN_WINDOWS)
+    assert controller.part_scale == 1
+    assert controller.part_size(8, 1024) == 8
@@ -0,0 +1,50 @@
+# coding=utf-8
+"""
+Tests for connections.py: buckets share one thread safe client, and
+list through its paginator rather than a boto3 resource.
+"""
+
+import admin
+import s3upload
+
+
+def _bucket(endpoint_url, bucket_name, max_pool_connections=10):
+    return s3upload.S3Bucket(admin.KeySecret(key='test', secret='test'),
+                             bucket_name, region='us-east-1',
+                             endpoint_url=endpoint_url,
+                             max_pool_connections=max_pool_connections)
+
+
+def test_buckets_share_one_client(endpoint_url):
+    one = _bucket(endpoint_url, 'one')
+    two = _bucket(endpoint_url, 'two')
+
+    assert one.client is two.client
+    assert not hasattr(one, 'resource')
+
+    # a bigger pool rebuilds the shared client for later buckets
+    bigger = _bucket(endpoint_url, 'three', max_pool_connections=200)
+    assert bigger.client is not one.client
+    assert bigger.client.meta.config.max_pool_connections == 200
+    assert _bucket(endpoint_url, 'four').client is bigger.client
+
+
+def test_get_objects_lists_with_the_client(bucket):
+    keys = ['a', 'a/b', 'c/d/e'] + ['many/{0:04d}'.format(number)
+                                    for number in range(1100)]
+    for key in keys:
+        bucket.client.put_object(Bucket=bucket.bucket_name, Key=key,
+                                 Body=key.encode('ascii'))
+
+    fresh = _bucket(bucket.client.meta.endpoint_url, bucket.bucket_name)
+    assert fresh.exists() is True
+    assert sorted(fresh.objectindex) == sorted(keys)
+    assert fresh.objectindex['a/b'].size == 3
+
+
+def test_init_creates_missing_bucket(endpoint_url):
+    bucket = _bucket(endpoint_url, 'created-by-init')
+
+    assert bucket.exists() == 404
+    assert bucket.init() is True
+    assert bucket.found
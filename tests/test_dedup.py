@@ -0,0 +1,130 @@
+# coding=utf-8
+"""
+Tests for dedup.py: chunk boundaries that survive edits, storing and
+restoring files, and keeping the chunk store apart from user keys.
+"""
+
+import hashlib
+import io
+import os
+
+import dedup
+import s3download
+import s3upload
+
+MB = 1024 * 1024
+
+
+def _digests(data):
+    return [hashlib.sha256(chunk).hexdigest()
+            for _, chunk in dedup.chunks(io.BytesIO(data))]
+
+
+def test_chunks_cover_the_data():
+    data = os.urandom(9 * MB)
+    pieces = list(dedup.chunks(io.BytesIO(data)))
+
+    assert b''.join(chunk for _, chunk in pieces) == data
+    assert [offset for offset, _ in pieces] == \
+        [sum(len(chunk) for _, chunk in pieces[:number])
+         for number in range(len(pieces))]
+    assert all(len(chunk) <= dedup.MAX_CHUNK for _, chunk in pieces)
+    assert all(len(chunk) >= dedup.MIN_CHUNK for _, chunk in pieces[:-1])
+
+
+def test_insertion_only_changes_nearby_chunks():
+    data = os.urandom(16 * MB)
+    edited = data[:8 * MB] + b'inserted' + data[8 * MB:]
+
+    before = _digests(data)
+    after = _digests(edited)
+
+    assert len(set(before) - set(after)) <= 2
+    assert len(set(after) - set(before)) <= 2
+
+
+def test_upload_and_restore(bucket, tmp_path):
+    data = os.urandom(6 * MB)
+    source = tmp_path / 'db.bak'
+    source.write_bytes(data)
+
+    result = bucket.multipart_transfer(str(source), 'db.bak', 'dedup')
+    assert result
+    manifest = dedup.manifest_key('db.bak')
+    assert manifest.startswith('.')
+    assert manifest in bucket.objectindex
+
+    stats = dedup.upload(bucket.client, bucket.bucket_name, str(source),
+                         'db.bak', known_keys=bucket.objectindex)
+    assert stats['chunks_sent'] == 0
+    assert stats['bytes_skipped'] == len(data)
+
+    restored = tmp_path / 'restored'
+    dedup.restore(bucket.client, bucket.bucket_name, manifest, str(restored))
+    assert restored.read_bytes() == data
+
+
+def test_deleted_chunk_is_sent_again(bucket, tmp_path):
+    data = os.urandom(3 * MB)
+    source = tmp_path / 'db.bak'
+    source.write_bytes(data)
+    assert bucket.multipart_transfer(str(source), 'db.bak', 'dedup')
+
+    chunk = sorted(key for key in bucket.objectindex
+                   if key.startswith(dedup.CHUNK_PREFIX))[0]
+    # deleted behind the back of the (now stale) index
+    bucket.client.delete_object(Bucket=bucket.bucket_name, Key=chunk)
+
+    stats = dedup.upload(bucket.client, bucket.bucket_name, str(source),
+                         'db.bak', known_keys=bucket.objectindex)
+    assert stats['chunks_sent'] == 1
+
+    restored = tmp_path / 'restored'
+    dedup.restore(bucket.client, bucket.bucket_name,
+                  dedup.manifest_key('db.bak'), str(restored))
+    assert restored.read_bytes() == data
+
+
+def test_download_job_keeps_user_keys_apart(bucket, tmp_path):
+    source = tmp_path / 'db.bak'
+    data = os.urandom(MB)
+    source.write_bytes(data)
+    assert bucket.multipart_transfer(str(source), 'db.bak', 'dedup')
+
+    for key in ('chunks/report.txt', 'manifests/notes.txt'):
+        bucket.client.put_object(Bucket=bucket.bucket_name, Key=key,
+                                 Body=key.encode())
+    bucket.get_objects()
+
+    target = tmp_path / 'out'
+    results = s3download.download_job(bucket, str(target))
+
+    assert all(results.values())
+    assert (target / 'db.bak').read_bytes() == data
+    assert (target / 'chunks' / 'report.txt').read_bytes() == \
+        b'chunks/report.txt'
+    assert (target / 'manifests' / 'notes.txt').read_bytes() == \
+        b'manifests/notes.txt'
+    assert not (target / '.s3upload').exists()
+
+
+def test_dedup_job_round_trip(bucket, tmp_path):
+    data = os.urandom(3 * MB)
+    (tmp_path / 'tree').mkdir()
+    (tmp_path / 'tree' / 'db.bak').write_bytes(data)
+
+    results = s3upload.upload_job(bucket, str(tmp_path / 'tree'),
+                                  prefix='sql/', action='dedup')
+    assert all(results.values())
+    assert dedup.manifest_key('sql/db.bak') in bucket.objectindex
+    assert 'sql/db.bak' not in bucket.objectindex
+
+    # the manifest stands for the file, which is up to date
+    assert s3upload.upload_job(bucket, str(tmp_path / 'tree'),
+                               prefix='sql/', action='dedup') == {}
+
+    results = s3download.download_job(bucket, str(tmp_path / 'restore'),
+                                      prefix='sql/', action='dedup')
+    assert all(results.values())
+    assert os.listdir(str(tmp_path / 'restore')) == ['db.bak']
+    assert (tmp_path / 'restore' / 'db.bak').read_bytes() == data
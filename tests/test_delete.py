@@ -0,0 +1,66 @@
+# coding=utf-8
+"""
+Tests for S3Bucket.delete_objects: keys S3 reports as not deleted are
+failed and stay in the index.
+"""
+
+import botocore.exceptions
+
+import s3upload
+
+
+def _put(bucket, keys):
+    for key in keys:
+        bucket.client.put_object(Bucket=bucket.bucket_name, Key=key, Body=b'x')
+    bucket.get_objects()
+
+
+def test_partly_failed_delete_reports_failed_keys(bucket, monkeypatch):
+    keys = ['keep/one', 'gone/two', 'keep/three', 'gone/four']
+    _put(bucket, keys)
+    delete_objects = bucket.client.delete_objects
+
+    def _delete_objects(Bucket, Delete):
+        # S3 answers 200 and lists the keys it could not delete
+        objects = Delete['Objects']
+        response = delete_objects(
+            Bucket=Bucket, Delete=dict(Delete, Objects=[
+                item for item in objects
+                if not item['Key'].startswith('keep/')]))
+        response['Errors'] = [{'Key': item['Key'], 'Code': 'AccessDenied',
+                               'Message': 'Access Denied'}
+                              for item in objects
+                              if item['Key'].startswith('keep/')]
+        return response
+
+    monkeypatch.setattr(bucket.client, 'delete_objects', _delete_objects)
+    monkeypatch.setattr(s3upload, 'DELETE_BATCH_SIZE', 3)
+    results = bucket.delete_objects(keys, workers=2)
+
+    assert sorted(results) == sorted(keys)
+    assert [key for key in keys if results[key]] == ['gone/two', 'gone/four']
+    assert results['keep/one'].status == 'Failed'
+    assert results['keep/one'].error == 'AccessDenied'
+    assert results['keep/three'].error == 'AccessDenied'
+    assert sorted(bucket.objectindex) == ['keep/one', 'keep/three']
+
+    monkeypatch.undo()
+    bucket.get_objects()
+    assert sorted(bucket.objectindex) == ['keep/one', 'keep/three']
+
+
+def test_failed_delete_request_fails_every_key(bucket, monkeypatch):
+    keys = ['one', 'two']
+    _put(bucket, keys)
+
+    def _delete_objects(**kwargs):
+        raise botocore.exceptions.ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}},
+            'DeleteObjects')
+
+    monkeypatch.setattr(bucket.client, 'delete_objects', _delete_objects)
+    results = bucket.delete_objects(keys)
+
+    assert not any(results.values())
+    assert {result.error for result in results.values()} == {'AccessDenied'}
+    assert sorted(bucket.objectindex) == keys
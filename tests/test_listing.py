@@ -0,0 +1,40 @@
+# coding=utf-8
+"""
+Tests for listing.py: a sharded listing finds exactly the keys a
+sequential one does.
+"""
+
+import pytest
+
+import listing
+
+# keys on either side of every shard boundary: top level objects next
+# to prefixes of the same name, folder placeholders, empty path
+# segments and nesting below MAX_SHARD_DEPTH
+KEYS = ['a', 'a/', 'a/b', 'a/b/', 'a/b/c', 'a/b/c/d/e/f', 'ab', 'ab/c',
+        'a//b', '/lead', 'b/' + 'x/' * 6 + 'deep', 'b/y', 'top', 'z/']
+
+
+@pytest.fixture
+def keys(bucket):
+    for key in KEYS:
+        bucket.client.put_object(Bucket=bucket.bucket_name, Key=key,
+                                 Body=key.encode('ascii'))
+    return bucket
+
+
+@pytest.mark.parametrize('workers', [1, 2, 4, 64])
+def test_parallel_list_matches_sequential_listing(keys, workers):
+    sequential = listing.list_prefix(keys.client, keys.bucket_name)[0]
+
+    assert sorted(sequential) == sorted(KEYS)
+    assert listing.parallel_list(keys.client, keys.bucket_name,
+                                 workers=workers) == sequential
+
+
+def test_parallel_list_of_prefixes(keys):
+    found = listing.parallel_list(keys.client, keys.bucket_name,
+                                  prefixes=['a/b/', 'a/', 'b/'], workers=4)
+
+    assert sorted(found) == sorted(key for key in KEYS
+                                   if key.startswith(('a/', 'b/')))
@@ -0,0 +1,88 @@
+# coding=utf-8
+"""
+Tests for mapped.py: only stable, unchanged files are mapped, and only
+when the bucket opts in.
+"""
+
+import os
+
+import pytest
+
+import mapped
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / 'db.bak'
+    path.write_bytes(b'0123456789' * 100)
+    return str(path)
+
+
+def _expected(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def test_unstable_files_are_read_with_pread(data_file):
+    with mapped.open_parts(data_file) as parts:
+        assert isinstance(parts, mapped.PartReader)
+        assert bytes(parts.part(10, 5)) == b'01234'
+
+
+def test_stable_unchanged_file_is_mapped(data_file):
+    with mapped.open_parts(data_file, True, _expected(data_file)) as parts:
+        assert isinstance(parts, mapped.MappedFile)
+        assert bytes(parts.part(10, 5)) == b'01234'
+
+
+def test_changed_file_is_not_mapped(data_file):
+    expected = _expected(data_file)
+
+    with open(data_file, 'r+b') as changed:
+        changed.truncate(500)
+
+    with mapped.open_parts(data_file, True, expected) as parts:
+        assert isinstance(parts, mapped.PartReader)
+
+
+def test_truncated_file_raises_instead_of_sending_short_part(data_file):
+    with mapped.open_parts(data_file) as parts:
+        with open(data_file, 'r+b') as changed:
+            changed.truncate(500)
+
+        assert bytes(parts.part(0, 500)) == b'0123456789' * 50
+        with pytest.raises(OSError):
+            parts.part(400, 200)
+
+
+def test_mapped_file_changed_since_is_read_with_pread(data_file):
+    with mapped.open_parts(data_file, True, _expected(data_file)) as parts:
+        assert isinstance(parts, mapped.MappedFile)
+
+        with open(data_file, 'r+b') as changed:
+            changed.truncate(500)
+
+        # reading the mapping past the new end would be SIGBUS
+        assert bytes(parts.part(0, 10)) == b'0123456789'
+        with pytest.raises(OSError):
+            parts.part(400, 200)
+
+
+@pytest.mark.parametrize('mmap, stable, asked', [
+    (False, False, [False]), (False, True, [False]),
+    (True, False, [False]), (True, True, [True])])
+def test_buckets_only_map_when_asked(bucket, data_file, monkeypatch, mmap,
+                                     stable, asked):
+    requested = []
+    open_parts = mapped.open_parts
+
+    def _open_parts(path, stable=False, expected=None):
+        requested.append(stable)
+        return open_parts(path, stable, expected)
+
+    monkeypatch.setattr(mapped, 'open_parts', _open_parts)
+    bucket.mmap = mmap
+
+    assert bucket.multipart_transfer(data_file, 'db.bak', 'upload',
+                                     stable=stable) is True
+    assert requested == asked
@@ -0,0 +1,144 @@
+# coding=utf-8
+"""
+Tests for metrics.py: the StatsD datagrams and the Prometheus textfile.
+"""
+
+import os
+import socket
+
+import pytest
+
+import metrics
+from s3upload import TransferResult
+
+
+@pytest.fixture
+def statsd_server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    yield server
+    server.close()
+
+
+def _received_lines(server):
+    lines = []
+    server.setblocking(False)
+    while True:
+        try:
+            packet = server.recv(65536)
+        except BlockingIOError:
+            return lines
+        lines.extend(packet.decode('utf-8').split('\n'))
+
+
+def _emit_transfer(emitter):
+    metrics.record_transfer(emitter, {'bucket': 'b'},
+                            TransferResult('db.bak', 'SlowDown', retries=2),
+                            0.5, 2048)
+    emitter.close()
+
+
+def test_dogstatsd_lines(statsd_server):
+    emitter = metrics.StatsdEmitter(*statsd_server.getsockname(),
+                                    dogstatsd=True)
+    _emit_transfer(emitter)
+
+    assert _received_lines(statsd_server) == [
+        's3upload.transfer.count:1|c|#bucket:b,status:failed',
+        's3upload.transfer.duration:500.0|ms|#bucket:b,status:failed',
+        's3upload.transfer.bytes:2048|c|#bucket:b,status:failed',
+        's3upload.transfer.throughput:4096|h|#bucket:b,status:failed',
+        's3upload.transfer.retries:2|c|#bucket:b,status:failed',
+        's3upload.transfer.errors:1|c|#bucket:b,error:SlowDown,status:failed',
+    ]
+    assert emitter.dropped == 0
+
+
+def test_plain_statsd_lines_have_no_tags(statsd_server):
+    emitter = metrics.StatsdEmitter(*statsd_server.getsockname(),
+                                    prefix='backup')
+    _emit_transfer(emitter)
+
+    assert _received_lines(statsd_server) == [
+        'backup.transfer.count:1|c',
+        'backup.transfer.duration:500.0|ms',
+        'backup.transfer.bytes:2048|c',
+        'backup.transfer.throughput:4096|ms',
+        'backup.transfer.retries:2|c',
+        'backup.transfer.errors:1|c',
+    ]
+
+
+def test_statsd_packets_stay_under_max_packet(statsd_server):
+    emitter = metrics.StatsdEmitter(*statsd_server.getsockname(),
+                                    max_packet=100)
+    for number in range(50):
+        emitter.emit('files', number)
+    emitter.close()
+
+    packets = []
+    statsd_server.setblocking(False)
+    while True:
+        try:
+            packets.append(statsd_server.recv(65536))
+        except BlockingIOError:
+            break
+
+    assert len(packets) > 1
+    assert all(len(packet) <= 100 for packet in packets)
+    assert b'\n'.join(packets).decode('utf-8').split('\n') == [
+        's3upload.files:{0}|c'.format(number) for number in range(50)]
+
+
+def test_prometheus_textfile(tmp_path):
+    path = str(tmp_path / 's3upload.prom')
+    emitter = metrics.PrometheusEmitter(path, interval=3600)
+
+    emitter.emit('transfer.bytes', 1024, 'count', {'bucket': 'b'})
+    emitter.emit('transfer.bytes', 2048, 'count', {'bucket': 'b'})
+    emitter.emit('job.up_to_date', 0, 'gauge', {'path': 'C:\\backup "x"'})
+    emitter.emit('job.up_to_date', 1, 'gauge', {'path': 'C:\\backup "x"'})
+    emitter.emit('transfer.duration', 250.5, 'timing')
+    emitter.emit('transfer.duration', 100, 'timing')
+    emitter.close()
+
+    with open(path) as textfile:
+        assert textfile.read() == (
+            '# TYPE s3upload_job_up_to_date gauge\n'
+            's3upload_job_up_to_date{path="C:\\\\backup \\"x\\""} 1\n'
+            '# TYPE s3upload_transfer_bytes counter\n'
+            's3upload_transfer_bytes_total{bucket="b"} 3072\n'
+            '# TYPE s3upload_transfer_duration summary\n'
+            's3upload_transfer_duration_count 2\n'
+            's3upload_transfer_duration_sum 350.5\n')
+
+
+def test_prometheus_textfile_is_replaced_atomically(tmp_path, monkeypatch):
+    path = str(tmp_path / 's3upload.prom')
+    emitter = metrics.PrometheusEmitter(path, interval=3600)
+    emitter.emit('files', 1)
+    emitter.flush()
+    first = os.stat(path).st_ino
+
+    # a reader holding the old file keeps reading the old file
+    with open(path) as reader:
+        replaced = []
+        replace = os.replace
+
+        def _replace(source, destination):
+            # the new contents are complete before they are renamed in
+            with open(source) as written:
+                replaced.append(written.read())
+            replace(source, destination)
+
+        monkeypatch.setattr(os, 'replace', _replace)
+        emitter.emit('files', 1)
+        emitter.close()
+
+        assert reader.read() == ('# TYPE s3upload_files counter\n'
+                                 's3upload_files_total 1\n')
+
+    assert replaced == ['# TYPE s3upload_files counter\n'
+                        's3upload_files_total 2\n']
+    assert os.stat(path).st_ino != first
+    assert os.listdir(str(tmp_path)) == ['s3upload.prom']
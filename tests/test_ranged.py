@@ -0,0 +1,128 @@
+# coding=utf-8
+"""
+Tests for ranged.py: resuming an interrupted download, and If-Match
+keeping two versions of an object from being mixed.
+"""
+
+import os
+
+import botocore.exceptions
+import pytest
+
+import ranged
+
+PART_SIZE = 256 * 1024
+
+
+def _download(bucket, local_path):
+    return ranged.RangedDownload(bucket.client, bucket.bucket_name, 'db.bak',
+                                 str(local_path), part_size=PART_SIZE,
+                                 workers=1, journal_dir=bucket.journal_dir)
+
+
+def _fetched_parts(monkeypatch, client, fail=None, before=None):
+    monkeypatch.undo()
+    fetched = []
+    get_object = client.get_object
+
+    def _get_object(**kwargs):
+        number = int(kwargs['Range'][len('bytes='):].split('-')[0]) \
+            // PART_SIZE + 1
+        if before is not None:
+            before(number)
+        if number == fail:
+            raise OSError("part {0} failed".format(fail))
+        fetched.append(number)
+        return get_object(**kwargs)
+
+    monkeypatch.setattr(client, 'get_object', _get_object)
+    return fetched
+
+
+def _interrupted(bucket, tmp_path, monkeypatch):
+    data = os.urandom(5 * PART_SIZE - 100)
+    bucket.client.put_object(Bucket=bucket.bucket_name, Key='db.bak',
+                             Body=data)
+    local_path = tmp_path / 'restore' / 'db.bak'
+
+    fetched = _fetched_parts(monkeypatch, bucket.client, fail=3)
+    with pytest.raises(OSError):
+        _download(bucket, local_path).run()
+
+    assert fetched == [1, 2, 4, 5]
+    assert not local_path.exists()
+    assert os.path.getsize(str(local_path) + '.part') == len(data)
+    return data, local_path
+
+
+def test_resumes_missing_parts(bucket, tmp_path, monkeypatch):
+    data, local_path = _interrupted(bucket, tmp_path, monkeypatch)
+
+    fetched = _fetched_parts(monkeypatch, bucket.client)
+    download = _download(bucket, local_path)
+    assert download.run() == len(data)
+
+    assert fetched == [3]
+    assert download.resumed_parts == 4
+    assert local_path.read_bytes() == data
+    assert not os.path.exists(str(local_path) + '.part')
+    assert os.listdir(bucket.journal_dir) == []
+
+
+def test_replaced_object_starts_over(bucket, tmp_path, monkeypatch):
+    _, local_path = _interrupted(bucket, tmp_path, monkeypatch)
+    data = os.urandom(4 * PART_SIZE)
+    bucket.client.put_object(Bucket=bucket.bucket_name, Key='db.bak',
+                             Body=data)
+
+    fetched = _fetched_parts(monkeypatch, bucket.client)
+    download = _download(bucket, local_path)
+    download.run()
+
+    assert fetched == [1, 2, 3, 4]
+    assert download.resumed_parts == 0
+    assert local_path.read_bytes() == data
+
+
+def test_object_replaced_mid_download_fails_if_match(bucket, tmp_path,
+                                                     monkeypatch):
+    data = os.urandom(3 * PART_SIZE)
+    bucket.client.put_object(Bucket=bucket.bucket_name, Key='db.bak',
+                             Body=data)
+    local_path = tmp_path / 'db.bak'
+
+    def _replace(number):
+        if number == 2:
+            bucket.client.put_object(Bucket=bucket.bucket_name, Key='db.bak',
+                                     Body=os.urandom(3 * PART_SIZE))
+
+    _fetched_parts(monkeypatch, bucket.client, before=_replace)
+    with pytest.raises(botocore.exceptions.ClientError) as failed:
+        _download(bucket, local_path).run()
+
+    assert failed.value.response['Error']['Code'] == 'PreconditionFailed'
+    assert not local_path.exists()
+
+    # the next run sees the new ETag and fetches everything again
+    fetched = _fetched_parts(monkeypatch, bucket.client)
+    download = _download(bucket, local_path)
+    download.run()
+
+    assert fetched == [1, 2, 3]
+    assert download.resumed_parts == 0
+
+
+def test_resume_keeps_part_size(bucket, tmp_path, monkeypatch):
+    data, local_path = _interrupted(bucket, tmp_path, monkeypatch)
+
+    # a later run asks for parts twice the size, e.g. after throttling
+    fetched = _fetched_parts(monkeypatch, bucket.client)
+    download = ranged.RangedDownload(bucket.client, bucket.bucket_name,
+                                     'db.bak', str(local_path),
+                                     part_size=2 * PART_SIZE, workers=1,
+                                     journal_dir=bucket.journal_dir)
+    download.run()
+
+    assert fetched == [3]
+    assert download.part_size == PART_SIZE
+    assert local_path.read_bytes() == data
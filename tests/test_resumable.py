@@ -0,0 +1,136 @@
+# coding=utf-8
+"""
+Tests for resumable.py: carrying on after a failed part, with the part
+size it started with, and keeping uploads within S3's part limit.
+"""
+
+import os
+
+import pytest
+
+import concurrency
+import resumable
+
+MB = resumable.MB
+
+
+def _upload(bucket, path, part_size=5 * MB):
+    return resumable.ResumableUpload(bucket.client, bucket.bucket_name,
+                                     str(path), 'large', part_size=part_size,
+                                     workers=1, journal_dir=bucket.journal_dir)
+
+
+def _sent_parts(monkeypatch, client, fail=None):
+    sent = []
+    upload_part = client.upload_part
+
+    def _upload_part(**kwargs):
+        if kwargs['PartNumber'] == fail:
+            raise OSError("part {0} failed".format(fail))
+        sent.append(kwargs['PartNumber'])
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(client, 'upload_part', _upload_part)
+    return sent
+
+
+def test_resumes_after_failed_part(bucket, tmp_path, monkeypatch):
+    data = os.urandom(17 * MB)
+    path = tmp_path / 'large'
+    path.write_bytes(data)
+
+    sent = _sent_parts(monkeypatch, bucket.client, fail=3)
+    with pytest.raises(OSError, match='part 3 failed'):
+        _upload(bucket, path).run()
+
+    assert sent == [1, 2]
+    assert os.listdir(bucket.journal_dir)
+
+    monkeypatch.undo()
+    sent = _sent_parts(monkeypatch, bucket.client)
+    upload = _upload(bucket, path)
+    upload.run()
+
+    assert sent == [3, 4]
+    assert upload.resumed_parts == 2
+    assert upload.checksums['etag_verified']
+    assert os.listdir(bucket.journal_dir) == []
+
+    body = bucket.client.get_object(Bucket=bucket.bucket_name, Key='large')
+    assert body['Body'].read() == data
+
+
+def test_changed_file_starts_over(bucket, tmp_path, monkeypatch):
+    path = tmp_path / 'large'
+    path.write_bytes(os.urandom(12 * MB))
+
+    _sent_parts(monkeypatch, bucket.client, fail=2)
+    with pytest.raises(OSError):
+        _upload(bucket, path).run()
+
+    data = os.urandom(12 * MB)
+    path.write_bytes(data)
+    os.utime(str(path), (1, 1))
+
+    monkeypatch.undo()
+    sent = _sent_parts(monkeypatch, bucket.client)
+    upload = _upload(bucket, path)
+    upload.run()
+
+    assert sent == [1, 2, 3]
+    assert upload.resumed_parts == 0
+    body = bucket.client.get_object(Bucket=bucket.bucket_name, Key='large')
+    assert body['Body'].read() == data
+
+
+def test_fit_part_size():
+    gigabytes = 1024 * MB
+
+    assert resumable.fit_part_size(gigabytes, 8 * MB) == 8 * MB
+    # 200 GB in 8 MB parts would be 25,600 parts
+    part_size = resumable.fit_part_size(200 * gigabytes, 8 * MB)
+    assert part_size % MB == 0
+    assert -(-200 * gigabytes // part_size) <= resumable.MAX_PARTS
+
+
+def test_part_size_raised_to_max_parts(bucket, tmp_path, monkeypatch):
+    monkeypatch.setattr(resumable, 'MAX_PARTS', 3)
+    data = os.urandom(17 * MB)
+    path = tmp_path / 'large'
+    path.write_bytes(data)
+
+    sent = _sent_parts(monkeypatch, bucket.client)
+    upload = _upload(bucket, path)
+    upload.run()
+
+    assert upload.part_size == 6 * MB
+    assert sent == [1, 2, 3]
+    body = bucket.client.get_object(Bucket=bucket.bucket_name, Key='large')
+    assert body['Body'].read() == data
+
+
+def test_resume_keeps_part_size_after_throttling(bucket, tmp_path,
+                                                 monkeypatch):
+    data = os.urandom(40 * MB)
+    path = tmp_path / 'large'
+    path.write_bytes(data)
+    bucket.controller = concurrency.AdaptiveController()
+
+    # 40 MB is sent in 8 MB parts (see s3upload.transfer_config)
+    config = {'max_concurrency': 1}
+    sent = _sent_parts(monkeypatch, bucket.client, fail=4)
+    with pytest.raises(OSError, match='part 4 failed'):
+        bucket.multipart_transfer(str(path), 'large', 'resumable', config)
+    assert sent == [1, 2, 3]
+
+    # throttling since has doubled the part size of new transfers
+    bucket.controller.part_scale = 2
+    monkeypatch.undo()
+    sent = _sent_parts(monkeypatch, bucket.client)
+    assert bucket.multipart_transfer(str(path), 'large', 'resumable',
+                                     config) is True
+
+    assert sent == [4, 5]
+    assert os.listdir(bucket.journal_dir) == []
+    body = bucket.client.get_object(Bucket=bucket.bucket_name, Key='large')
+    assert body['Body'].read() == data
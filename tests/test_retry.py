@@ -0,0 +1,183 @@
+# coding=utf-8
+"""
+Tests for retry.py: which errors are retried, and that the jittered
+waits stay within the policy's attempts and time budget.  The clock,
+sleep and random source are stubbed, so nothing here really waits.
+"""
+
+import botocore.exceptions
+import pytest
+
+import retry
+
+
+def _client_error(code, status=400):
+    return botocore.exceptions.ClientError(
+        {'Error': {'Code': code, 'Message': code},
+         'ResponseMetadata': {'HTTPStatusCode': status}}, 'PutObject')
+
+
+def _wrapped(error):
+    try:
+        try:
+            raise error
+        except Exception as cause:
+            raise RuntimeError("upload failed") from cause
+    except RuntimeError as wrapper:
+        return wrapper
+
+
+@pytest.mark.parametrize('error', [
+    _client_error('SlowDown', 503),
+    _client_error('RequestTimeout'),
+    _client_error('503', 503),
+    _client_error('Unknown', 502),
+    botocore.exceptions.EndpointConnectionError(endpoint_url='http://s3'),
+    botocore.exceptions.ReadTimeoutError(endpoint_url='http://s3'),
+    botocore.exceptions.IncompleteReadError(actual_bytes=1, expected_bytes=2),
+    _wrapped(_client_error('SlowDown', 503))])
+def test_retryable_errors(error):
+    assert retry.retryable(error) is True
+
+
+@pytest.mark.parametrize('error', [
+    _client_error('AccessDenied', 403),
+    _client_error('NoSuchKey', 404),
+    _client_error('404', 404),
+    _client_error('InvalidRequest'),
+    OSError(2, 'No such file or directory'),
+    ValueError('bad part size'),
+    _wrapped(_client_error('AccessDenied', 403))])
+def test_fatal_errors(error):
+    assert retry.retryable(error) is False
+
+
+class _Clock(object):
+    """
+    Stands in for the time module: monotonic() only moves when sleep()
+    is called, and every wait is recorded.
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.waits = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.waits.append(seconds)
+        self.now += seconds
+
+
+class _Highest(object):
+    """
+    Stands in for the random module, always jittering to the longest
+    wait allowed.
+    """
+    @staticmethod
+    def uniform(low, high):
+        return high
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(retry, 'time', clock)
+    monkeypatch.setattr(retry, 'random', _Highest)
+    return clock
+
+
+def _failing(error, calls):
+    def _call():
+        calls.append(1)
+        raise error
+    return _call
+
+
+def test_delay_is_capped_full_jitter(monkeypatch):
+    policy = retry.RetryPolicy(base=0.5, cap=3)
+    bounds = []
+
+    class _Record(object):
+        @staticmethod
+        def uniform(low, high):
+            bounds.append((low, high))
+            return low
+
+    monkeypatch.setattr(retry, 'random', _Record)
+    assert [policy.delay(number) for number in range(5)] == [0] * 5
+    assert bounds == [(0, 0.5), (0, 1), (0, 2), (0, 3), (0, 3)]
+
+
+def test_retries_stop_after_max_attempts(clock):
+    calls = []
+    policy = retry.RetryPolicy(max_attempts=4, base=1, cap=2, budget=100,
+                               sleep=clock.sleep)
+    attempts = policy.start()
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        attempts.call(_failing(_client_error('SlowDown', 503), calls))
+
+    assert len(calls) == 4
+    assert attempts.retries == 3
+    assert clock.waits == [1, 2, 2]
+
+
+def test_waits_stay_within_budget(clock):
+    calls = []
+    policy = retry.RetryPolicy(max_attempts=10, base=4, cap=30, budget=10,
+                               sleep=clock.sleep)
+    attempts = policy.start()
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        attempts.call(_failing(_client_error('SlowDown', 503), calls))
+
+    # the second wait would have been 8s, but only 6s of budget was left
+    assert clock.waits == [4, 6]
+    assert sum(clock.waits) <= policy.budget
+    assert len(calls) == 3
+
+
+def test_budget_is_shared_by_an_operation(clock):
+    policy = retry.RetryPolicy(max_attempts=10, base=4, cap=4, budget=10,
+                               sleep=clock.sleep)
+    attempts = policy.start()
+    error = _client_error('SlowDown', 503)
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        attempts.call(_failing(error, []))
+
+    # a later call of the same operation has no budget left
+    with pytest.raises(botocore.exceptions.ClientError):
+        attempts.call(_failing(error, []))
+
+    assert sum(clock.waits) <= policy.budget
+    assert attempts.retries == 3
+
+
+def test_fatal_errors_are_not_retried(clock):
+    calls = []
+    attempts = retry.RetryPolicy(sleep=clock.sleep).start()
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        attempts.call(_failing(_client_error('AccessDenied', 403), calls))
+
+    assert len(calls) == 1
+    assert clock.waits == []
+    assert attempts.retries == 0
+
+
+def test_success_after_retry(clock):
+    outcomes = [_client_error('SlowDown', 503), 'done']
+
+    def _call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    attempts = retry.RetryPolicy(base=1, sleep=clock.sleep).start()
+
+    assert attempts.call(_call) == 'done'
+    assert attempts.retries == 1
+    assert clock.waits == [1]
@@ -0,0 +1,176 @@
+# coding=utf-8
+"""
+Tests for scheduler.py: job files, how each job's settings reach its
+transfers, and jobs sharing a bucket.
+"""
+
+import os
+import threading
+
+import pytest
+
+import s3download
+import s3upload
+import scheduler
+
+MB = s3upload.MB
+
+
+def _jobs(tmp_path, text):
+    job_file = tmp_path / 'jobs.txt'
+    job_file.write_text(text)
+    return scheduler.load_jobs(str(job_file))
+
+
+def test_load_jobs_settings(tmp_path):
+    jobs = _jobs(tmp_path, "# bucket  settings  path\n"
+                           "\n"
+                           "plain    /srv/with space\n"
+                           "tuned    part_size=64MB max_concurrency=4  /srv/a=b\n"
+                           "logs     prefix=/app/ compression=zstd  /var/log\n")
+
+    assert jobs == [
+        scheduler.Job('plain', os.path.normcase('/srv/with space')),
+        scheduler.Job('tuned', os.path.normcase('/srv/a=b'),
+                      (('part_size', 64 * MB), ('max_concurrency', 4))),
+        scheduler.Job('logs', os.path.normcase('/var/log'),
+                      (('prefix', 'app/'), ('compression', 'zstd')))]
+
+
+@pytest.mark.parametrize('line', ['lonely\n', 'tuned part_size=64MB\n',
+                                  'tuned part_size=lots /srv\n',
+                                  'packed compression=rar /srv\n',
+                                  'chunked action=rsync /srv\n',
+                                  'shared /a\nshared /b\n',
+                                  'shared prefix=a /a\nshared /b\n',
+                                  'shared prefix=a /a\nshared prefix=a/b /b\n'])
+def test_load_jobs_errors(tmp_path, line):
+    with pytest.raises(ValueError):
+        _jobs(tmp_path, line)
+
+
+def test_jobs_sharing_a_bucket_need_separate_prefixes(tmp_path):
+    jobs = _jobs(tmp_path, "shared prefix=a /a\n"
+                           "shared prefix=ab action=dedup /b\n"
+                           "other /a\n")
+
+    assert [dict(job.options).get('prefix') for job in jobs] == \
+        ['a/', 'ab/', None]
+    assert dict(jobs[1].options)['action'] == 'dedup'
+
+
+class _Bucket(object):
+
+    def exists(self):
+        return True
+
+
+def test_job_settings_override_scheduler_config():
+    configs = {}
+    arguments = {}
+
+    def _run_job(bucket, local_path, workers, config, **job_arguments):
+        configs[local_path] = config
+        arguments[local_path] = job_arguments
+        return {}
+
+    jobs = [scheduler.Job('one', '/a'),
+            scheduler.Job('two', '/b', (('part_size', 64 * MB),
+                                        ('prefix', 'b/')))]
+    runner = scheduler.Scheduler(jobs, _run_job, lambda name, budget: _Bucket(),
+                                 config={'part_size': 16 * MB,
+                                         'max_concurrency': 2})
+    runner.run_once()
+
+    assert configs == {'/a': {'part_size': 16 * MB, 'max_concurrency': 2},
+                       '/b': {'part_size': 64 * MB, 'max_concurrency': 2}}
+    assert arguments == {'/a': {}, '/b': {'prefix': 'b/'}}
+
+    runner = scheduler.Scheduler(jobs[:1], _run_job,
+                                 lambda name, budget: _Bucket())
+    runner.run_once()
+    assert configs['/a'] == 'auto'
+
+
+def test_upload_job_uses_config(bucket, tmp_path, monkeypatch):
+    (tmp_path / 'tree').mkdir()
+    (tmp_path / 'tree' / 'large').write_bytes(os.urandom(12 * MB))
+
+    sent = []
+    upload_part = bucket.client.upload_part
+
+    def _upload_part(**kwargs):
+        sent.append(kwargs['PartNumber'])
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(bucket.client, 'upload_part', _upload_part)
+    results = s3upload.upload_job(bucket, str(tmp_path / 'tree'),
+                                  config={'part_size': 5 * MB,
+                                          'multipart_threshold': 5 * MB})
+
+    assert all(results.values())
+    assert sorted(sent) == [1, 2, 3]
+
+
+def test_jobs_sharing_a_bucket_keep_their_own_keys(bucket, tmp_path):
+    for name in ('one', 'two'):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'db.bak').write_bytes(name.encode('ascii'))
+
+    for name in ('one', 'two'):
+        results = s3upload.upload_job(bucket, str(tmp_path / name),
+                                      prefix=name + '/')
+        assert list(results) == [str(tmp_path / name / 'db.bak')]
+        assert all(results.values())
+
+    assert sorted(bucket.objectindex) == ['one/db.bak', 'two/db.bak']
+
+    # a second run finds both jobs up to date
+    assert s3upload.upload_job(bucket, str(tmp_path / 'one'),
+                               prefix='one/') == {}
+
+    results = s3download.download_job(bucket, str(tmp_path / 'restore'),
+                                      prefix='two/')
+    assert all(results.values())
+    assert os.listdir(str(tmp_path / 'restore')) == ['db.bak']
+    assert (tmp_path / 'restore' / 'db.bak').read_bytes() == b'two'
+
+
+def test_buckets_start_up_concurrently():
+    lock = threading.Lock()
+    started = []
+    both_started = threading.Event()
+
+    def _make_bucket(bucket_name, budget):
+        with lock:
+            started.append(bucket_name)
+            if len(started) == 2:
+                both_started.set()
+        # a listing that only finishes once the other bucket has started
+        assert both_started.wait(5), "buckets were built one at a time"
+        return _Bucket()
+
+    jobs = [scheduler.Job('one', '/a'), scheduler.Job('two', '/b'),
+            scheduler.Job('one', '/c')]
+    runner = scheduler.Scheduler(jobs, lambda *args: {}, _make_bucket)
+    outcomes = runner.run_once()
+
+    assert all(results == {} for results in outcomes.values())
+    assert sorted(started) == ['one', 'two']
+
+
+def test_failed_bucket_is_built_again_next_cycle():
+    calls = []
+
+    def _make_bucket(bucket_name, budget):
+        calls.append(bucket_name)
+        if len(calls) == 1:
+            raise OSError("listing failed")
+        return _Bucket()
+
+    runner = scheduler.Scheduler([scheduler.Job('one', '/a')],
+                                 lambda *args: {}, _make_bucket)
+
+    assert isinstance(list(runner.run_once().values())[0], OSError)
+    assert list(runner.run_once().values()) == [{}]
+    assert calls == ['one', 'one']
@@ -0,0 +1,99 @@
+# coding=utf-8
+"""
+Tests for servercopy.py: objects at or above the copy threshold are
+copied as UploadPartCopy ranges and arrive intact.
+"""
+
+import os
+
+import botocore.exceptions
+import pytest
+
+import servercopy
+
+MB = servercopy.MB
+
+
+@pytest.fixture
+def source(bucket):
+    data = os.urandom(12 * MB + 123)
+    bucket.client.put_object(Bucket=bucket.bucket_name, Key='db.bak',
+                             Body=data, ContentType='application/x-backup',
+                             Metadata={'origin': 'sql01'})
+    return bucket, data
+
+
+def _spy(monkeypatch, client):
+    ranges = []
+    upload_part_copy = client.upload_part_copy
+
+    def _upload_part_copy(**kwargs):
+        ranges.append((kwargs['PartNumber'], kwargs['CopySourceRange']))
+        return upload_part_copy(**kwargs)
+
+    monkeypatch.setattr(client, 'upload_part_copy', _upload_part_copy)
+    return ranges
+
+
+def test_multipart_copy_matches_source(source, monkeypatch):
+    bucket, data = source
+    client = bucket.client
+    ranges = _spy(monkeypatch, client)
+
+    size, etag = servercopy.copy_object(
+        client, bucket.bucket_name, 'db.bak', bucket.bucket_name,
+        'copy/db.bak', part_size=5 * MB, workers=3,
+        multipart_threshold=5 * MB)
+
+    assert size == len(data)
+    assert sorted(ranges) == [
+        (1, 'bytes=0-{0}'.format(5 * MB - 1)),
+        (2, 'bytes={0}-{1}'.format(5 * MB, 10 * MB - 1)),
+        (3, 'bytes={0}-{1}'.format(10 * MB, len(data) - 1))]
+
+    copy = client.get_object(Bucket=bucket.bucket_name, Key='copy/db.bak')
+    assert copy['Body'].read() == data
+    assert copy['ETag'] == etag
+    assert etag.endswith('-3"')
+    # a multipart copy sets the source's headers again itself
+    assert copy['ContentType'] == 'application/x-backup'
+    assert copy['Metadata'] == {'origin': 'sql01'}
+
+
+def test_copy_below_threshold_is_a_single_request(source, monkeypatch):
+    bucket, data = source
+    ranges = _spy(monkeypatch, bucket.client)
+
+    size, _ = servercopy.copy_object(
+        bucket.client, bucket.bucket_name, 'db.bak', bucket.bucket_name,
+        'copy/db.bak', size=len(data), part_size=5 * MB)
+
+    assert size == len(data)
+    assert ranges == []
+    assert bucket.client.get_object(Bucket=bucket.bucket_name,
+                                    Key='copy/db.bak')['Body'].read() == data
+
+
+def test_failed_part_aborts_the_copy(source, monkeypatch):
+    bucket, _ = source
+    client = bucket.client
+    upload_part_copy = client.upload_part_copy
+
+    def _upload_part_copy(**kwargs):
+        if kwargs['PartNumber'] == 2:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'AccessDenied', 'Message': 'denied'}},
+                'UploadPartCopy')
+        return upload_part_copy(**kwargs)
+
+    monkeypatch.setattr(client, 'upload_part_copy', _upload_part_copy)
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        servercopy.copy_object(client, bucket.bucket_name, 'db.bak',
+                               bucket.bucket_name, 'copy/db.bak',
+                               part_size=5 * MB, multipart_threshold=5 * MB)
+
+    uploads = client.list_multipart_uploads(Bucket=bucket.bucket_name)
+    assert uploads.get('Uploads', []) == []
+    assert 'Contents' not in client.list_objects_v2(
+        Bucket=bucket.bucket_name, Prefix='copy/')
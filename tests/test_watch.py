@@ -0,0 +1,79 @@
+# coding=utf-8
+"""
+Tests for watch.py: the polling fallback's rescans, and reporting files
+once they are quiet.
+"""
+
+import threading
+import time
+
+import watch
+
+
+def test_polling_rescans_once_per_interval(tmp_path, monkeypatch):
+    watcher = watch.PollingWatcher(str(tmp_path), interval=0.5)
+    scans = []
+    scan = watcher._scan
+    monkeypatch.setattr(watcher, '_scan',
+                        lambda: scans.append(time.monotonic()) or scan())
+
+    (tmp_path / 'new.bak').write_bytes(b'data')
+
+    started = time.monotonic()
+    names = set()
+    while time.monotonic() - started < 0.4:
+        found, overflowed = watcher.poll(0.05)
+        names.update(found)
+        assert not overflowed
+    assert scans == []
+    assert names == set()
+
+    while not names:
+        names, _ = watcher.poll(0.05)
+    assert names == {'new.bak'}
+    assert len(scans) == 1
+
+
+def _watch(tmp_path, monkeypatch, rescan):
+    monkeypatch.setattr(watch, 'WAKE_INTERVAL', 0.1)
+    stop = threading.Event()
+    reported = []
+
+    def _on_ready(files):
+        reported.extend(entry.name for entry in files)
+        stop.set()
+
+    thread = threading.Thread(target=watch.watch,
+                              args=(str(tmp_path), _on_ready, stop),
+                              kwargs={'quiet': 0.2, 'rescan': rescan})
+    thread.start()
+    return thread, stop, reported
+
+
+def test_rescan_reports_files_written_before_the_watch(tmp_path, monkeypatch):
+    (tmp_path / 'early.bak').write_bytes(b'written before the watch')
+    (tmp_path / '.hidden').write_bytes(b'skipped')
+
+    thread, stop, reported = _watch(tmp_path, monkeypatch, rescan=True)
+    thread.join(10)
+    stop.set()
+
+    assert not thread.is_alive()
+    assert reported == ['early.bak']
+
+
+def test_reports_file_once_quiet(tmp_path, monkeypatch):
+    (tmp_path / 'old.bak').write_bytes(b'already there')
+
+    thread, stop, reported = _watch(tmp_path, monkeypatch, rescan=False)
+    time.sleep(0.2)
+    with open(str(tmp_path / 'new.bak'), 'wb') as output:
+        output.write(b'first half ')
+        output.flush()
+        time.sleep(0.1)
+        output.write(b'second half')
+    thread.join(10)
+    stop.set()
+
+    assert not thread.is_alive()
+    assert reported == ['new.bak']
@@ -0,0 +1,330 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+watch.py - collects the files created or changed under a directory.
+
+On Linux the kernel's inotify interface is used through ctypes, so an
+idle watch costs nothing but a wake-up every WAKE_INTERVAL seconds to
+check whether it should stop.  Elsewhere, or when inotify can't be set
+up (for instance when the watch limit is used up), the tree is polled
+with scanner.scan every POLL_INTERVAL seconds instead.
+
+Backups are written over minutes, so a changed file is only reported
+once it has been quiet - no events, and the same size and mtime - for
+QUIET_PERIOD seconds.  Names starting with '.' are ignored, like
+scanner.scan does, which skips the usual hidden temporary files.
+
+usage:
+
+    watch('/backups/', lambda files: upload(files), stop=threading.Event())
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+import scanner
+from syncplan import LocalFile
+
+
+# seconds a file must go unchanged before it is reported
+QUIET_PERIOD = 10.0
+
+# seconds between rescans when polling
+POLL_INTERVAL = 30.0
+
+# longest an idle watch sleeps before checking its stop event
+WAKE_INTERVAL = 5.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+IN_NONBLOCK = 0x00000800
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+_EVENT = struct.Struct('iIII')
+
+
+def _local_file(root, name):
+    """
+    Returns the LocalFile for root/name, or None if it isn't a regular
+    file any more.
+    """
+    path = os.path.join(root, *name.split('/'))
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    if not os.path.isfile(path):
+        return None
+
+    return LocalFile(name, path, stat.st_size, stat.st_mtime)
+
+
+class InotifyWatcher(object):
+    """
+    Reports the names of files changed under root, using inotify.
+
+    usage:
+
+        watcher = InotifyWatcher('/backups/')
+        names, overflowed = watcher.poll(timeout=5)
+
+    Raises OSError if inotify isn't available.
+    """
+    def __init__(self, root):
+
+        self.root = root
+        self._directories = {}
+
+        name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        try:
+            self._add_tree('')
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, prefix):
+        path = os.path.join(self.root, *prefix.split('/')) if prefix else self.root
+        descriptor = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(path), WATCH_MASK)
+
+        if descriptor < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(error, "inotify_add_watch failed for " + path)
+
+        self._directories[descriptor] = prefix
+        return True
+
+    def _add_tree(self, prefix):
+        """
+        Watches a directory and everything below it.  Returns the names
+        of the files already there, which were created before the watch.
+        """
+        if not self._add(prefix):
+            return []
+
+        path = os.path.join(self.root, *prefix.split('/')) if prefix else self.root
+        names = []
+
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return names
+
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+
+            name = prefix + entry.name
+
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    names.extend(self._add_tree(name + '/'))
+                elif entry.is_file():
+                    names.append(name)
+            except OSError:
+                continue
+
+        return names
+
+    def poll(self, timeout):
+        """
+        Waits up to timeout seconds for events.
+
+        returns (set of changed names, overflowed); overflowed means
+        events were lost and the caller should rescan.
+        """
+        names = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return names, False
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names, False
+
+        offset = 0
+        overflowed = False
+
+        while offset < len(data):
+            descriptor, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            raw = data[offset:offset + length].split(b'\0', 1)[0]
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+
+            if mask & IN_IGNORED:
+                self._directories.pop(descriptor, None)
+                continue
+
+            prefix = self._directories.get(descriptor)
+            entry = os.fsdecode(raw)
+            if prefix is None or not entry or entry.startswith('.'):
+                continue
+
+            name = prefix + entry
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    names.update(self._add_tree(name + '/'))
+            else:
+                names.add(name)
+
+        return names, overflowed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    Reports the names of files changed under root by rescanning it.
+
+    usage:
+
+        watcher = PollingWatcher('/backups/')
+        names, _ = watcher.poll(timeout=30)
+    """
+    def __init__(self, root, interval=POLL_INTERVAL):
+
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._scanned = time.monotonic()
+
+    def _scan(self):
+        try:
+            return {entry.name: (entry.size, entry.mtime)
+                    for entry in scanner.scan(self.root)}
+        except OSError:
+            return {}
+
+    def poll(self, timeout):
+        """
+        Sleeps for timeout seconds, or until the next rescan is due if
+        that is sooner, and returns (set of new or changed names, False).
+        The tree is only rescanned once every interval seconds; a poll
+        that ends before then returns no names.
+        """
+        due = self._scanned + self.interval
+        time.sleep(max(0.0, min(timeout, due - time.monotonic())))
+
+        if time.monotonic() < due:
+            return set(), False
+
+        snapshot = self._scan()
+        self._scanned = time.monotonic()
+        names = {name for name, state in snapshot.items()
+                 if self._snapshot.get(name) != state}
+        self._snapshot = snapshot
+        return names, False
+
+    def close(self):
+        pass
+
+
+def watcher(root):
+    """
+    Returns an InotifyWatcher for root, or a PollingWatcher where
+    inotify can't be used.
+    """
+    try:
+        return InotifyWatcher(root)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(root)
+
+
+def watch(root, on_ready, stop, quiet=QUIET_PERIOD, rescan=False):
+    """
+    Calls on_ready with a list of LocalFile for every batch of files
+    created or changed under root that has been quiet for quiet
+    seconds, until the stop event is set.
+
+    With rescan=True every file already under root is reported too,
+    once it is quiet, after the watch has been set up: files written
+    between an earlier full scan and the start of the watch raise no
+    events of their own.  on_ready is expected to skip the ones that
+    are up to date.
+    """
+    source = watcher(root)
+    pending = {}
+
+    if rescan:
+        now = time.monotonic()
+        for entry in scanner.scan(root):
+            pending[entry.name] = (now, (entry.size, entry.mtime))
+
+    try:
+        while not stop.is_set():
+            now = time.monotonic()
+            timeout = WAKE_INTERVAL
+            if pending:
+                due = min(changed for changed, _ in pending.values()) + quiet
+                timeout = max(0.0, min(timeout, due - now))
+
+            names, overflowed = source.poll(timeout)
+            now = time.monotonic()
+
+            if overflowed:
+                names.update(entry.name for entry in scanner.scan(root))
+
+            for name in names:
+                entry = _local_file(root, name)
+                if entry is None:
+                    pending.pop(name, None)
+                else:
+                    pending[name] = (now, (entry.size, entry.mtime))
+
+            ready = []
+            for name, (changed, state) in list(pending.items()):
+                if now - changed < quiet:
+                    continue
+
+                entry = _local_file(root, name)
+                del pending[name]
+
+                if entry is None:
+                    continue
+                if (entry.size, entry.mtime) != state:
+                    # still being written, without events (e.g. polling)
+                    pending[name] = (now, (entry.size, entry.mtime))
+                    continue
+
+                ready.append(entry)
+
+            if ready:
+                on_ready(ready)
+
+    finally:
+        source.close()